@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""
+Simulates concurrent submissions of a form with 40 fields, saving the
+values with one ``bulk_create`` (``FormSubmission.objects.submit``)
+compared to one INSERT per field, which is what ``submit`` used to do.
+
+Each of a few threads saves some submissions, the total time and the
+submissions per second are shown. The threads need to share the database,
+so by default it is a temporary SQLite file, set ``DATABASE_URL`` to run
+it against PostgreSQL. Run it from the root of the repository::
+
+    python benchmarks/form_submissions.py
+    DATABASE_URL=postgres://localhost/widgy_bench python benchmarks/form_submissions.py
+
+The tables are created with ``migrate`` and the data isn't cleaned up, so
+use a database that you can throw away.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings_contrib')
+if 'DATABASE_URL' not in os.environ:
+    os.environ['DATABASE_URL'] = 'sqlite:///' + tempfile.mkstemp(suffix='.sqlite3')[1]
+
+import django
+django.setup()
+
+from django.core.management import call_command  # NOQA
+from django.db import connection, transaction  # NOQA
+from django.test.utils import setup_test_environment  # NOQA
+
+from widgy.contrib.form_builder.models import Form, FormInput, FormSubmission  # NOQA
+from widgy.models import Node  # NOQA
+from widgy.site import WidgySite  # NOQA
+
+FIELDS = 40
+THREADS = 4
+SUBMISSIONS_PER_THREAD = 50
+
+widgy_site = WidgySite()
+
+
+def make_form():
+    form = Form.add_root(widgy_site)
+    form.children['fields'].add_children(widgy_site, [
+        (FormInput, {'label': 'field %d' % i, 'type': 'text'}) for i in range(FIELDS)
+    ])
+    node = Node.objects.get(pk=form.node.pk)
+    node.prefetch_tree()
+    return node.content
+
+
+@transaction.atomic
+def submit_one_by_one(form, data, fields):
+    submission = FormSubmission.objects.create(
+        form_node=form.node,
+        form_ident=form.ident,
+    )
+    for name, field in fields.items():
+        submission.values.create(
+            field_node=field.node,
+            field_name=field.label,
+            field_ident=field.ident,
+            value=field.serialize_value(data[name]),
+        )
+
+
+def submit_bulk(form, data, fields):
+    FormSubmission.objects.submit(form, data, fields)
+
+
+def run(submit, form):
+    fields = form.get_fields()
+    data = dict((name, 'value of %s' % name) for name in fields)
+
+    def worker():
+        try:
+            for i in range(SUBMISSIONS_PER_THREAD):
+                submit(form, data, fields)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker) for i in range(THREADS)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.time() - start
+
+
+def main():
+    setup_test_environment()
+    call_command('migrate', run_syncdb=True, verbosity=0)
+    form = make_form()
+    total = THREADS * SUBMISSIONS_PER_THREAD
+    print('%d threads, %d submissions of %d fields' % (THREADS, total, FIELDS))
+
+    print('%12s %10s %16s' % ('', 'time', 'submissions/s'))
+    for label, submit in (('one by one', submit_one_by_one), ('bulk_create', submit_bulk)):
+        seconds = run(submit, form)
+        print('%12s %8.2fs %16.1f' % (label, seconds, total / seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+Compares building a frozen tree of about 10000 nodes for rendering with
+``Node.prefetch_tree`` and with ``widgy.frozen.FrozenNode.fetch_tree``. It
+shows the time to build the tree and, on Python 3, the memory allocated
+for it, including the content instances.
+
+The tree is created in an in-memory SQLite database using the test
+project's settings. Run it from the root of the repository::
+
+    python benchmarks/frozen_tree.py
+"""
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+os.environ.setdefault('DATABASE_URL', 'sqlite://:memory:')
+
+import django
+django.setup()
+
+from django.core.management import call_command  # NOQA
+from django.test.utils import setup_test_environment  # NOQA
+
+from tests.core_tests.models import Bucket, RawTextWidget  # NOQA
+from tests.core_tests.widgy_config import widgy_site  # NOQA
+from widgy.frozen import FrozenNode  # NOQA
+from widgy.models import Node  # NOQA
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+BUCKETS = 500
+WIDGETS_PER_BUCKET = 20
+REPEAT = 5
+
+
+def make_tree():
+    root = Bucket.add_root(widgy_site)
+    root.add_children(widgy_site, [
+        (Bucket, {}) for i in range(BUCKETS)
+    ])
+    for i, bucket in enumerate(root.get_children()):
+        bucket.add_children(widgy_site, [
+            (RawTextWidget, {'text': '%d.%d' % (i, j)}) for j in range(WIDGETS_PER_BUCKET)
+        ])
+    Node.objects.update(is_frozen=True)
+    return root.node.pk
+
+
+def prefetch_tree(pk):
+    node = Node.objects.get(pk=pk)
+    node.prefetch_tree()
+    return node
+
+
+def fetch_frozen_tree(pk):
+    return FrozenNode.fetch_tree(Node.objects.get(pk=pk))
+
+
+def measure(build, pk):
+    seconds = min(timeit.repeat(lambda: build(pk), number=1, repeat=REPEAT))
+    if tracemalloc is None:
+        return seconds, None
+    tracemalloc.start()
+    tree = build(pk)  # NOQA
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return seconds, size
+
+
+def main():
+    setup_test_environment()
+    call_command('migrate', run_syncdb=True, verbosity=0)
+    pk = make_tree()
+    print('%d nodes' % Node.objects.count())
+
+    print('%14s %10s %10s' % ('', 'time', 'memory'))
+    for label, build in (('prefetch_tree', prefetch_tree), ('FrozenNode', fetch_frozen_tree)):
+        seconds, size = measure(build, pk)
+        memory = '%8.1fMB' % (size / 1024.0 / 1024) if size is not None else 'n/a'
+        print('%14s %8.1fms %10s' % (label, seconds * 1000, memory))
+
+
+if __name__ == '__main__':
+    main()
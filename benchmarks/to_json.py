@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+Measures ``Node.to_json`` on a tree of about 1000 nodes, building the URLs
+with ``WidgySite.cached_reverse`` compared to calling ``WidgySite.reverse``
+for every URL, which is what ``to_json`` used to do.
+
+The tree is created in an in-memory SQLite database using the test
+project's settings. Run it from the root of the repository::
+
+    python benchmarks/to_json.py
+
+Each row shows the best of a few runs. The preview templates are rendered
+with ``preview=False`` too, to show how much of the time is spent on URLs.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+os.environ.setdefault('DATABASE_URL', 'sqlite://:memory:')
+
+import django
+django.setup()
+
+from django.core.management import call_command  # NOQA
+from django.test.utils import setup_test_environment  # NOQA
+
+from tests.core_tests.models import Bucket, RawTextWidget  # NOQA
+from tests.core_tests.widgy_config import widgy_site  # NOQA
+from widgy.models import Node  # NOQA
+
+BUCKETS = 90
+WIDGETS_PER_BUCKET = 10
+REPEAT = 5
+
+
+def make_tree():
+    root = Bucket.add_root(widgy_site)
+    for i in range(BUCKETS):
+        bucket = root.add_child(widgy_site, Bucket)
+        bucket.add_children(widgy_site, [
+            (RawTextWidget, {'text': '%d.%d' % (i, j)}) for j in range(WIDGETS_PER_BUCKET)
+        ])
+    node = Node.objects.get(pk=root.node.pk)
+    node.prefetch_tree()
+    return node
+
+
+def time_to_json(node, **kwargs):
+    return min(timeit.repeat(
+        lambda: node.to_json(widgy_site, **kwargs),
+        number=1, repeat=REPEAT))
+
+
+def uncached_reverse(view, kwargs):
+    return widgy_site.reverse(view, kwargs=kwargs)
+
+
+def main():
+    setup_test_environment()
+    call_command('migrate', run_syncdb=True, verbosity=0)
+    node = make_tree()
+    print('%d nodes' % len(node.depth_first_order()))
+
+    print('%14s %16s %16s' % ('', 'cached_reverse', 'reverse'))
+    for kwargs in ({}, {'preview': False}):
+        new = time_to_json(node, **kwargs)
+        widgy_site.cached_reverse = uncached_reverse
+        try:
+            old = time_to_json(node, **kwargs)
+        finally:
+            del widgy_site.cached_reverse
+        label = 'preview=False' if kwargs else 'preview=True'
+        print('%14s %14.2fms %14.2fms' % (label, new * 1000, old * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+"""
+Measures how long it takes to assemble a prefetched tree with
+``Node.assemble_tree`` compared to the old recursive ``consume_children``
+algorithm, which called ``list.pop(0)`` for every node.
+
+The trees are synthetic: the nodes are never saved, so no database is
+needed. Run it from the root of the repository::
+
+    python benchmarks/tree_assembly.py
+
+Each row shows the best of a few runs. When the number of nodes goes up by
+10x, a linear algorithm should take roughly 10x as long.
+"""
+from __future__ import print_function
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+
+import django
+django.setup()
+
+from widgy.models import Node  # NOQA
+
+SIZES = (100, 1000, 10000)
+FANOUT = 8
+REPEAT = 5
+
+
+def make_tree(size, fanout=FANOUT):
+    """
+    Returns a list of ``size`` unsaved nodes in path order. Each node has up
+    to ``fanout`` children.
+    """
+    root = Node(path=Node._get_path(None, 1, 1), depth=1)
+    nodes = [root]
+
+    def add_children(parent):
+        children = []
+        for step in range(1, fanout + 1):
+            if len(nodes) >= size:
+                break
+            child = Node(path=Node._get_path(parent.path, parent.depth + 1, step),
+                         depth=parent.depth + 1)
+            nodes.append(child)
+            children.append(child)
+        return children
+
+    # build breadth first so the tree is bushy, then sort into path order.
+    queue = [root]
+    while queue and len(nodes) < size:
+        queue.extend(add_children(queue.pop(0)))
+    nodes.sort(key=lambda node: node.path)
+    return nodes
+
+
+def consume_children(node, descendants):
+    # The algorithm Node.prefetch_trees used before assemble_tree.
+    node._children = []
+    while descendants:
+        child = descendants[0]
+        if child.depth == node.depth + 1:
+            node._children.append(descendants.pop(0))
+            child._parent = node
+            consume_children(child, descendants)
+        else:
+            break
+
+
+def time_assemble_tree(nodes):
+    return min(timeit.repeat(
+        lambda: nodes[0].assemble_tree(iter(nodes[1:])),
+        number=1, repeat=REPEAT))
+
+
+def time_consume_children(nodes):
+    return min(timeit.repeat(
+        lambda: consume_children(nodes[0], list(nodes[1:])),
+        number=1, repeat=REPEAT))
+
+
+def main():
+    print('%8s %18s %18s' % ('nodes', 'assemble_tree', 'consume_children'))
+    previous = None
+    for size in SIZES:
+        nodes = make_tree(size)
+        new = time_assemble_tree(nodes)
+        old = time_consume_children(nodes)
+        print('%8d %16.2fms %16.2fms' % (size, new * 1000, old * 1000), end='')
+        if previous:
+            print('   (x%.1f, x%.1f)' % (new / previous[0], old / previous[1]))
+        else:
+            print()
+        previous = (new, old)
+
+
+if __name__ == '__main__':
+    main()
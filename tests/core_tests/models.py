@@ -16,10 +16,14 @@ from widgy.models.mixins import InvisibleMixin
 class Layout(Content):
     accepting_children = True
 
+    static_valid_child_of = True
+
     @classmethod
     def valid_child_of(self, parent, obj=None):
         return False
 
+    static_valid_parent_of = True
+
     def valid_parent_of(self, cls, obj=None):
         return issubclass(cls, Bucket)
 
@@ -54,10 +58,14 @@ class RawTextWidget(Content):
 
 
 class CantGoAnywhereWidget(Content):
+    static_valid_child_of = True
+
     @classmethod
     def valid_child_of(cls, parent, obj=None):
         return False
 
+    static_valid_parent_of = True
+
     def valid_parent_of(self, cls, obj=None):
         return False
 
@@ -112,6 +120,8 @@ class VowelBucket(Bucket):
     class Meta:
         proxy = True
 
+    static_valid_parent_of = True
+
     def valid_parent_of(self, cls, obj=None):
         return cls.__name__[0].lower() in 'aeiou'
 
@@ -257,6 +267,7 @@ class VariegatedFieldsWidget(Content):
     date = models.DateField(null=True)
     time = models.TimeField(null=True)
     datetime = models.DateTimeField(null=True)
+    decimal = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True)
 
 
 class ReviewedVersionedPage(models.Model):
@@ -19,7 +19,7 @@ from ..models import (
     Bucket, ImmovableBucket, UndeletableRawTextWidget, RawTextWidget, Layout,
     PickyBucket,
 )
-from .base import RootNodeTestCase, HttpTestCase, make_a_nice_tree, SwitchUserTestCase
+from .base import RootNodeTestCase, HttpTestCase, make_a_nice_tree, SwitchUserTestCase, refetch
 
 
 def decode_json_request(req):
@@ -210,9 +210,9 @@ class TestApi(RootNodeTestCase, HttpTestCase):
         left, right = make_a_nice_tree(self.root_node, self.widgy_site)
 
         # loads . dumps == normalize the types to what json uses, list vs tuple
-        left_json = json.loads(json.dumps(left.to_json(self.widgy_site)))
+        left_json = json.loads(json.dumps(refetch(left).to_json(self.widgy_site)))
         left_url = left_json['url']
-        root_json = json.loads(json.dumps(self.root_node.to_json(self.widgy_site)))
+        root_json = json.loads(json.dumps(refetch(self.root_node).to_json(self.widgy_site)))
         root_url = root_json['url']
 
         def doit(method, *args):
@@ -234,6 +234,55 @@ class TestApi(RootNodeTestCase, HttpTestCase):
         doit('put', left_json)
         doit('delete')
 
+    def test_compatibility_delta(self):
+        left, right = make_a_nice_tree(self.root_node, self.widgy_site)
+        root_url = self.root_node.get_api_url(self.widgy_site)
+        subbucket = left.get_children()[2]
+
+        def doit(method, url, *args):
+            url = '{0}?include_compatibility_for={1}&compatibility=delta'.format(url, root_url)
+            resp = decode_json_request(getattr(self, method)(url, *args))
+            self.assertNotIn('compatibility', resp)
+            delta = resp['compatibility_delta']
+
+            # every entry that's sent is correct
+            compatibility = decode_json_request(self.get(
+                self.root_node.to_json(self.widgy_site)['available_children_url']))
+            for node_url, classes in delta['changed'].items():
+                self.assertEqual(compatibility[node_url], classes)
+            for node_url in delta['removed']:
+                self.assertNotIn(node_url, compatibility)
+            return resp, delta
+
+        def urls(*nodes):
+            return sorted(i.get_api_url(self.widgy_site) for i in nodes)
+
+        resp, delta = doit('post', self.node_url, {
+            '__class__': 'core_tests.bucket',
+            'parent_id': subbucket.get_api_url(self.widgy_site),
+            'right_id': None,
+        })
+        new = Node.objects.get(pk=extract_id(resp['node']['url']))
+        self.assertEqual(sorted(delta['changed']), urls(self.root_node, left, subbucket, new))
+        self.assertEqual(delta['removed'], [])
+
+        subbucket_children = list(subbucket.get_children())
+        resp, delta = doit('put', subbucket.get_api_url(self.widgy_site), {
+            'parent_id': right.get_api_url(self.widgy_site),
+            'right_id': None,
+        })
+        self.assertEqual(sorted(delta['changed']), urls(self.root_node, left, right, subbucket,
+                                                         *subbucket_children))
+
+        resp, delta = doit('delete', subbucket.get_api_url(self.widgy_site))
+        self.assertEqual(sorted(delta['changed']), urls(self.root_node, right))
+        self.assertEqual(sorted(delta['removed']), urls(subbucket, *subbucket_children))
+
+        # GET isn't a mutation, it always gets all of it
+        resp = self.get('{0}?include_compatibility_for={1}&compatibility=delta'.format(
+            left.get_api_url(self.widgy_site), root_url))
+        self.assertIn('compatibility', decode_json_request(resp))
+
     def test_delete_undeletable(self):
         node = UndeletableRawTextWidget.add_root(self.widgy_site,
                                                  text='asdf').node
@@ -269,7 +318,7 @@ class TestApi(RootNodeTestCase, HttpTestCase):
     def test_node_404(self):
         left, right = make_a_nice_tree(self.root_node, self.widgy_site)
 
-        before_json = self.root_node.to_json(self.widgy_site)
+        before_json = refetch(self.root_node).to_json(self.widgy_site)
         # make a fake url
         right.pk += 9000
         r = self.put(left.get_api_url(self.widgy_site), {
@@ -305,6 +354,152 @@ class TestApi(RootNodeTestCase, HttpTestCase):
         left = Node.objects.get(pk=left.pk)
         self.assertEqual(before_children + 1, len(left.get_children()))
 
+    def test_get_depth(self):
+        left, right = make_a_nice_tree(self.root_node, self.widgy_site)
+        url = self.root_node.get_api_url(self.widgy_site)
+
+        with self.assertNumQueries(6):
+            # session, user, the node, its descendants, and a query for each
+            # content type
+            resp = self.get(url + '?depth=1')
+        root = decode_json_request(resp)['node']
+        self.assertFalse(root['collapsed'])
+        self.assertEqual([i['collapsed'] for i in root['children']], [True, True])
+        self.assertEqual([i['children'] for i in root['children']], [None, None])
+
+        resp = self.get(root['children'][0]['url'] + '?depth=1')
+        left_json = decode_json_request(resp)['node']
+        self.assertEqual([i['collapsed'] for i in left_json['children']], [False, False, True])
+
+        resp = self.get(url + '?depth=0')
+        self.assertTrue(decode_json_request(resp)['node']['collapsed'])
+
+        resp = self.get(url + '?depth=-1')
+        self.assertEqual(resp.status_code, 400)
+
+        resp = self.get(url + '?depth=10')
+        self.assertEqual(decode_json_request(resp)['node'],
+                         decode_json_request(self.get(url))['node'])
+
+    def test_to_json_without_preview_argument(self):
+        make_a_nice_tree(self.root_node, self.widgy_site)
+
+        def to_json(self, site):
+            return super(RawTextWidget, self).to_json(site)
+
+        with mock.patch.object(RawTextWidget, 'to_json', to_json):
+            resp = self.get(self.root_node.get_api_url(self.widgy_site))
+        self.assertEqual(resp.status_code, 200)
+        left_1 = decode_json_request(resp)['node']['children'][0]['children'][0]
+        self.assertIn('preview_template', left_1['content'])
+
+    def test_previews(self):
+        left, right = make_a_nice_tree(self.root_node, self.widgy_site)
+        url = self.root_node.get_api_url(self.widgy_site)
+
+        root = decode_json_request(self.get(url + '?preview=0'))['node']
+        self.assertNotIn('preview_template', root['content'])
+        urls = [i['url'] for i in root['children'][0]['children']]
+
+        resp = self.get(self.widgy_site.reverse(self.widgy_site.previews_view),
+                        {'node': urls})
+        self.assertEqual(resp.status_code, 200)
+        previews = decode_json_request(resp)
+        self.assertEqual(sorted(previews), sorted(urls))
+        left_1 = Node.objects.get(pk=extract_id(urls[0]))
+        self.assertEqual(previews[urls[0]], left_1.content.get_preview_template(self.widgy_site))
+
+        bogus_url = right.get_api_url(self.widgy_site).replace(str(right.pk), '9000')
+        resp = self.get(self.widgy_site.reverse(self.widgy_site.previews_view),
+                        {'node': bogus_url})
+        self.assertEqual(resp.status_code, 404)
+
+    def batch(self, *operations):
+        return self.post(self.widgy_site.reverse(self.widgy_site.batch_view),
+                         {'operations': operations})
+
+    def test_batch(self):
+        left, right = make_a_nice_tree(self.root_node, self.widgy_site)
+        left_1, left_2, subbucket = left.get_children()
+        right_1, right_2 = right.get_children()
+
+        resp = self.batch(
+            {'op': 'add', '__class__': 'core_tests.rawtextwidget',
+             'parent_id': right.get_api_url(self.widgy_site)},
+            {'op': 'update', 'node': '$0', 'attributes': {'text': 'new'}},
+            {'op': 'move', 'node': left_1.get_api_url(self.widgy_site), 'right_id': '$0'},
+            {'op': 'delete', 'node': subbucket.get_api_url(self.widgy_site)},
+        )
+        self.assertEqual(resp.status_code, 200)
+        data = decode_json_request(resp)
+
+        new = RawTextWidget.objects.get(text='new').node
+        self.assertEqual(data['results'], [
+            new.get_api_url(self.widgy_site),
+            new.get_api_url(self.widgy_site),
+            left_1.get_api_url(self.widgy_site),
+            None,
+        ])
+        self.assertEqual(data['node'], json.loads(json.dumps(
+            refetch(self.root_node).to_json(self.widgy_site))))
+        self.assertEqual([i.content.text for i in refetch(left).get_children()], ['left_2'])
+        self.assertEqual([i.content.text for i in refetch(right).get_children()],
+                         ['right_1', 'right_2', 'left_1', 'new'])
+
+    def test_batch_is_atomic(self):
+        left, right = make_a_nice_tree(self.root_node, self.widgy_site)
+        before_json = refetch(self.root_node).to_json(self.widgy_site)
+
+        resp = self.batch(
+            {'op': 'delete', 'node': right.get_api_url(self.widgy_site)},
+            {'op': 'update', 'node': left.get_children()[0].get_api_url(self.widgy_site),
+             'attributes': {'text': ''}},
+        )
+        self.assertEqual(resp.status_code, 409)
+        errors = decode_json_request(resp)
+        self.assertEqual(errors['index'], [1])
+        self.assertIn('text', errors)
+
+        self.assertEqual(before_json, refetch(self.root_node).to_json(self.widgy_site))
+
+    def test_batch_one_tree(self):
+        other_root = Bucket.add_root(self.widgy_site).node
+
+        resp = self.batch(
+            {'op': 'add', '__class__': 'core_tests.rawtextwidget',
+             'parent_id': self.root_node.get_children()[0].get_api_url(self.widgy_site)},
+            {'op': 'add', '__class__': 'core_tests.rawtextwidget',
+             'parent_id': other_root.get_api_url(self.widgy_site)},
+        )
+        self.assertEqual(resp.status_code, 409)
+        self.assertFalse(RawTextWidget.objects.exists())
+
+        resp = self.batch({'op': 'frobnicate', 'node': other_root.get_api_url(self.widgy_site)})
+        self.assertEqual(resp.status_code, 400)
+
+    def test_batch_error_index(self):
+        left, right = make_a_nice_tree(self.root_node, self.widgy_site)
+        bogus_url = right.get_api_url(self.widgy_site).replace(str(right.pk), '9000')
+
+        def check(status, *operations):
+            resp = self.batch(*operations)
+            self.assertEqual(resp.status_code, status)
+            self.assertEqual(decode_json_request(resp)['index'], [len(operations) - 1])
+
+        delete = {'op': 'delete', 'node': left.get_api_url(self.widgy_site)}
+        check(404, delete, {'op': 'delete', 'node': bogus_url})
+        check(404, delete, {'op': 'update', 'node': bogus_url, 'attributes': {}})
+        check(400, delete, 'delete')
+        check(400, delete, {'op': 'frobnicate', 'node': right.get_api_url(self.widgy_site)})
+        check(400, delete, {'op': 'add', 'parent_id': right.get_api_url(self.widgy_site)})
+        check(400, delete, {'op': 'add', '__class__': 'rawtextwidget',
+                            'parent_id': right.get_api_url(self.widgy_site)})
+        check(400, delete, {'op': 'update', 'attributes': {}})
+        check(400, delete, {'op': 'delete', 'node': 1})
+        check(400, {'op': 'update', 'node': '$3', 'attributes': {}})
+        # nothing was deleted
+        self.assertEqual(len(refetch(left).get_children()), 3)
+
 
 class PermissionsTest(SwitchUserTestCase, RootNodeTestCase, HttpTestCase):
     widgy_site = widgy_site
@@ -6,18 +6,24 @@ import mock
 import unittest
 import contextlib
 
-from django.test import TestCase
+from django.test import TestCase, skipUnlessDBFeature
+from django.test.utils import override_script_prefix, override_settings, CaptureQueriesContext
+from django.conf.urls import url, include
+from django.core.urlresolvers import NoReverseMatch
 from django.test.client import RequestFactory
 from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 from django.utils import timezone
 from django.db.models.deletion import ProtectedError
-from django.db import transaction
+from django.db import connection, models, transaction
 
 from widgy.models import Node, UnknownWidget, VersionTracker, Content, VersionCommit
+from widgy.models.base import clone_contents
+from widgy.signals import pre_delete_widget, pre_delete_widgets
 from widgy.exceptions import (
     ParentWasRejected, ChildWasRejected, MutualRejection, InvalidTreeMovement,
     InvalidOperation, ParentChildRejection)
+from widgy.site import WidgySite
 from widgy.views.versioning import daisydiff
 
 from ..widgy_config import widgy_site
@@ -77,6 +83,50 @@ class TestCore(RootNodeTestCase):
         else:
             assert False, "Should have raised a MutualRejection exception"
 
+    def test_static_rules(self):
+        self.assertTrue(Layout.has_static_rule('valid_parent_of'))
+        self.assertTrue(Layout.has_static_rule('valid_child_of'))
+        self.assertTrue(AnotherLayout.has_static_rule('valid_parent_of'))
+        # the default rules
+        self.assertFalse(Bucket.has_static_rule('valid_parent_of'))
+        self.assertFalse(Bucket.has_static_rule('valid_child_of'))
+        # overridden without being declared static
+        self.assertFalse(PickyBucket.has_static_rule('valid_parent_of'))
+        self.assertFalse(UnnestableWidget.has_static_rule('valid_child_of'))
+
+    def test_compatibility_matrix(self):
+        site = WidgySite()
+        layout = self.root_node.content
+        bucket = layout.get_children()[0]
+        picky_bucket = layout.add_child(site, PickyBucket)
+
+        with mock.patch.object(Layout, 'valid_parent_of', autospec=True,
+                               return_value=True) as valid_parent_of:
+            site.validate_relationship(layout, Bucket)
+            site.validate_relationship(layout, bucket)
+            site.validate_relationship(refetch(layout), Bucket)
+            self.assertEqual(valid_parent_of.call_count, 1)
+
+        with mock.patch.object(PickyBucket, 'valid_parent_of', autospec=True,
+                               return_value=True) as valid_parent_of:
+            site.validate_relationship(picky_bucket, RawTextWidget)
+            site.validate_relationship(picky_bucket, RawTextWidget)
+            self.assertEqual(valid_parent_of.call_count, 2)
+
+        # accepting_children can be instance state
+        bucket.accepting_children = False
+        with self.assertRaises(ChildWasRejected):
+            site.validate_relationship(bucket, RawTextWidget)
+        site.validate_relationship(refetch(bucket), RawTextWidget)
+
+        # the matrix gives the same answers as the rules themselves
+        with self.assertRaises(ChildWasRejected):
+            site.validate_relationship(layout, RawTextWidget)
+        with self.assertRaises(ChildWasRejected):
+            site.validate_relationship(layout, RawTextWidget)
+        with self.assertRaises(MutualRejection):
+            site.validate_relationship(layout, CantGoAnywhereWidget)
+
     def test_validate_relationship_instance(self):
         picky_bucket = self.root_node.content.add_child(self.widgy_site,
                                                         PickyBucket)
@@ -94,6 +144,100 @@ class TestCore(RootNodeTestCase):
             picky_bucket.add_child(self.widgy_site,
                                    Layout)
 
+    def test_add_children(self):
+        left = self.root_node.get_children()[0].content
+        left.add_child(self.widgy_site, RawTextWidget, text='first')
+        children = left.add_children(self.widgy_site, [
+            (RawTextWidget, {'text': 'second'}),
+            (Bucket, {}),
+            (RawTextWidget, {'text': 'third'}),
+        ])
+        self.assertEqual([type(i) for i in children], [RawTextWidget, Bucket, RawTextWidget])
+        self.assertEqual([getattr(i, 'text', None) for i in refetch(left).get_children()],
+                         ['first', 'second', None, 'third'])
+        self.assertEqual(refetch(left.node).numchild, 4)
+        self.assertEqual(children[1].add_child(self.widgy_site, Bucket).get_parent(), children[1])
+        self.assertFalse(any(Node.find_problems()))
+
+        # the digests are the same as if they were computed from scratch
+        digest = refetch(self.root_node).digest
+        self.assertTrue(digest)
+        Node.objects.update(digest='')
+        self.assertEqual(refetch(self.root_node).get_digest(), digest)
+
+    def test_add_children_after_existing_children(self):
+        left = refetch(self.root_node.get_children()[0])
+        left.content.add_child(self.widgy_site, RawTextWidget, text='first')
+        left = refetch(left)
+        left.prefetch_tree()
+        children = left.content.add_children(self.widgy_site, [
+            (RawTextWidget, {'text': 'second'}),
+            (RawTextWidget, {'text': 'third'}),
+        ])
+        self.assertEqual([i.node.get_sibling_index() for i in children], [1, 2])
+        self.assertIsNone(children[1].node.get_next_sibling())
+        # the parent's prefetched children include them
+        self.assertEqual([i.content.text for i in left.get_children()],
+                         ['first', 'second', 'third'])
+        self.assertEqual(left.get_children()[0].get_next_sibling(), children[0].node)
+
+    def test_add_children_rejected(self):
+        picky_bucket = self.root_node.content.add_child(self.widgy_site, PickyBucket)
+
+        with self.assertRaises(ChildWasRejected):
+            picky_bucket.add_children(self.widgy_site, [
+                (RawTextWidget, {'text': 'hello'}),
+                (RawTextWidget, {'text': 'aasdf'}),
+            ])
+        self.assertFalse(RawTextWidget.objects.exists())
+        self.assertEqual(refetch(picky_bucket.node).numchild, 0)
+
+    def test_delete_tree(self):
+        left, right = make_a_nice_tree(self.root_node)
+        batches = []
+        singles = []
+
+        def batch_receiver(sender, instances, raw, **kwargs):
+            batches.append((sender, sorted(getattr(i, 'text', '') for i in instances)))
+
+        def single_receiver(sender, instance, raw, **kwargs):
+            singles.append(instance.text)
+
+        pre_delete_widgets.connect(batch_receiver)
+        pre_delete_widget.connect(single_receiver, sender=RawTextWidget)
+        try:
+            left.content.delete()
+        finally:
+            pre_delete_widgets.disconnect(batch_receiver)
+            pre_delete_widget.disconnect(single_receiver, sender=RawTextWidget)
+
+        self.assertEqual(batches, [
+            (Bucket, ['', '']),
+            (RawTextWidget, ['left_1', 'left_2', 'subbucket_1', 'subbucket_2']),
+        ])
+        self.assertEqual(singles, ['left_1', 'left_2', 'subbucket_1', 'subbucket_2'])
+        self.assertEqual(sorted(RawTextWidget.objects.values_list('text', flat=True)),
+                         ['right_1', 'right_2'])
+        self.assertEqual(Bucket.objects.count(), 1)
+        self.assertEqual(refetch(self.root_node).numchild, 1)
+        self.assertEqual(refetch(self.root_node).digest, '')
+        self.assertFalse(any(Node.find_problems()))
+
+    def test_delete_tree_queries(self):
+        def delete_queries(widgets):
+            bucket = self.root_node.content.add_child(self.widgy_site, Bucket)
+            bucket.add_children(self.widgy_site, [
+                (Bucket, {}) for i in range(widgets)
+            ] + [
+                (RawTextWidget, {'text': 'text'}) for i in range(widgets)
+            ])
+            bucket = refetch(bucket)
+            with CaptureQueriesContext(connection) as queries:
+                bucket.delete()
+            return len(queries)
+
+        self.assertEqual(delete_queries(2), delete_queries(10))
+
     def test_reposition_rechecks_deep_deep_compatibility(self):
         a = self.root_node.content.add_child(widgy_site, UnnestableWidget)
         first_bucket = self.root_node.content.add_child(widgy_site, Bucket)
@@ -390,13 +534,21 @@ class TestVersioning(RootNodeTestCase):
         root_node = root.node
         root_node.prefetch_tree()
 
-        # - savepoint
-        # - root content (1 query)
-        # - release savepoint
-        # - root node (2 queries, 2 savepoints)
-        # - 2 text contents (2 queries, 2 savepoints)
-        # - subnodes (1 query)
-        with self.assertNumQueries(12):
+        if connection.features.can_return_ids_from_bulk_insert:
+            # - root content (1 query)
+            # - text contents (1 query)
+            # - root node (2 queries)
+            # - subnodes (1 query)
+            num_queries = 5
+        else:
+            # - savepoint
+            # - root content (1 query)
+            # - release savepoint
+            # - root node (2 queries, 2 savepoints)
+            # - 2 text contents (2 queries, 2 savepoints)
+            # - subnodes (1 query)
+            num_queries = 12
+        with self.assertNumQueries(num_queries):
             root_node.clone_tree()
 
     def test_content_equal(self):
@@ -778,6 +930,120 @@ class TestVersioning(RootNodeTestCase):
         vt = VersionTracker.objects.get(pk=vt.pk)
         self.assertTrue(vt.has_changes())
 
+    def test_structural_sharing(self):
+        make_a_nice_tree(self.root_node)
+        vt = VersionTracker.objects.create(working_copy=self.root_node)
+        commit1 = vt.commit()
+
+        # off by default
+        commit2 = vt.commit()
+        self.assertNotEqual(commit1.root_node, commit2.root_node)
+
+        with mock.patch.object(VersionTracker, 'structural_sharing', True):
+            vt = VersionTracker.objects.get(pk=vt.pk)
+            node_count = Node.objects.count()
+            commit3 = vt.commit()
+            self.assertEqual(commit3.root_node, commit2.root_node)
+            self.assertEqual(Node.objects.count(), node_count)
+
+            refetch(self.root_node).get_children()[0].content.add_child(
+                self.widgy_site, RawTextWidget, text='foo')
+            vt = VersionTracker.objects.get(pk=vt.pk)
+            commit4 = vt.commit()
+            self.assertNotEqual(commit4.root_node, commit3.root_node)
+
+        # shared trees are only deleted once
+        vt.delete()
+        self.assertFalse(Node.objects.filter(pk=commit3.root_node.pk).exists())
+
+    def test_structural_sharing_of_subtrees(self):
+        make_a_nice_tree(self.root_node)
+        vt = VersionTracker.objects.create(working_copy=self.root_node)
+        commit1 = vt.commit()
+
+        right_1 = self.root_node.get_children()[1].get_children()[0].content
+        right_1.text = 'changed'
+        right_1.save()
+
+        counts = dict((cls, cls.objects.count()) for cls in (Layout, Bucket, RawTextWidget))
+        with mock.patch.object(VersionTracker, 'structural_sharing', True):
+            vt = VersionTracker.objects.get(pk=vt.pk)
+            commit2 = vt.commit()
+        # only the changed widget and its ancestors are cloned
+        self.assertEqual(Layout.objects.count(), counts[Layout] + 1)
+        self.assertEqual(Bucket.objects.count(), counts[Bucket] + 1)
+        self.assertEqual(RawTextWidget.objects.count(), counts[RawTextWidget] + 1)
+
+        old, new = refetch(commit1.root_node), refetch(commit2.root_node)
+        Node.prefetch_trees(old, new)
+        self.assertEqual(len(old.depth_first_order()), len(new.depth_first_order()))
+        self.assertEqual(
+            [i.content.text for i in new.depth_first_order() if isinstance(i.content, RawTextWidget)],
+            ['left_1', 'left_2', 'subbucket_1', 'subbucket_2', 'changed', 'right_2'])
+        self.assertEqual(old.get_children()[1].get_children()[0].content.text, 'right_1')
+        shared = [(a, b) for a, b in zip(old.depth_first_order(), new.depth_first_order())
+                  if a.content_id == b.content_id]
+        self.assertEqual(len(shared), 7)
+        for a, b in shared:
+            self.assertIs(a.content.node, a)
+            self.assertIs(b.content.node, b)
+            self.assertEqual(a.digest, b.digest)
+        self.assertFalse(vt.has_changes())
+
+        vt.delete()
+        self.assertFalse(Node.objects.exists())
+        self.assertFalse(RawTextWidget.objects.exists())
+
+    def test_structural_sharing_stale_working_copy(self):
+        make_a_nice_tree(self.root_node)
+        with mock.patch.object(VersionTracker, 'structural_sharing', True):
+            vt = VersionTracker.objects.create(working_copy=self.root_node)
+            commit1 = vt.commit()
+            # edited through another instance, vt.working_copy doesn't know
+            refetch(self.root_node).get_children()[0].content.add_child(
+                self.widgy_site, RawTextWidget, text='foo')
+            commit2 = vt.commit()
+        self.assertNotEqual(commit2.root_node, commit1.root_node)
+        self.assertEqual(len(refetch(commit2.root_node).depth_first_order()),
+                         len(refetch(self.root_node).depth_first_order()))
+        self.assertIn('foo', [
+            i.content.text for i in refetch(commit2.root_node).depth_first_order()
+            if isinstance(i.content, RawTextWidget)])
+
+    def test_shared_content_node(self):
+        make_a_nice_tree(self.root_node)
+        vt = VersionTracker.objects.create(working_copy=self.root_node)
+        vt.commit()
+        refetch(self.root_node).content.add_child(self.widgy_site, Bucket)
+        with mock.patch.object(VersionTracker, 'structural_sharing', True):
+            vt = VersionTracker.objects.get(pk=vt.pk)
+            new = vt.commit().root_node
+        new.prefetch_tree()
+        node = new.get_children()[0]
+        self.assertIs(node.content.node, node)
+        # in the trees of both commits
+        content = type(node.content).objects.get(pk=node.content_id)
+        with self.assertRaises(Node.MultipleObjectsReturned):
+            content.node
+
+    def test_structural_sharing_uses_contents_once(self):
+        # the two empty buckets are the same
+        left, right = self.root_node.get_children()
+        self.assertEqual(left.get_digest(), right.get_digest())
+        vt = VersionTracker.objects.create(working_copy=self.root_node)
+        vt.commit()
+        refetch(self.root_node).content.add_child(self.widgy_site, Bucket)
+
+        bucket_count = Bucket.objects.count()
+        with mock.patch.object(VersionTracker, 'structural_sharing', True):
+            vt = VersionTracker.objects.get(pk=vt.pk)
+            new = vt.commit().root_node
+        contents = [(i.content_type_id, i.content_id) for i in new.depth_first_order()]
+        self.assertEqual(len(contents), 4)
+        self.assertEqual(len(contents), len(set(contents)))
+        # two of the three buckets are shared
+        self.assertEqual(Bucket.objects.count(), bucket_count + 1)
+
     def test_daisydiff(self):
         a = """<html>
             <body>
@@ -855,6 +1121,64 @@ class TestVersioning(RootNodeTestCase):
         self.assertEqual(tracker.get_published_node(request_factory.get('/')),
                          commit2.root_node)
 
+    def test_published_commit_single_query(self):
+        tracker, commit1 = make_commit(self.widgy_site, datetime.timedelta(days=-1))
+        for i in range(10):
+            tracker.commit(publish_at=timezone.now() + datetime.timedelta(days=1 + i))
+
+        # stored when the commits were saved
+        tracker = refetch(tracker)
+        self.assertEqual(tracker.published_commit_id, commit1.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(tracker.get_published_node(None), commit1.root_node)
+
+        # looking it up doesn't write
+        VersionTracker.objects.filter(pk=tracker.pk).update(published_commit=None)
+        tracker = refetch(tracker)
+        # - newest ready commit
+        # - next publish_at
+        with self.assertNumQueries(2):
+            self.assertEqual(tracker.get_published_node(None), commit1.root_node)
+        self.assertIsNone(refetch(tracker).published_commit_id)
+
+    def test_published_commit_expires(self):
+        tracker, commit1 = make_commit(self.widgy_site, datetime.timedelta(days=-1))
+        publish_at = timezone.now() + datetime.timedelta(hours=1)
+        commit2 = tracker.commit(publish_at=publish_at)
+
+        tracker = refetch(tracker)
+        self.assertEqual(tracker.get_published_node(None), commit1.root_node)
+        self.assertEqual(tracker.published_commit_expires_at, publish_at)
+
+        later = publish_at + datetime.timedelta(minutes=1)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            self.assertEqual(tracker.get_published_node(None), commit2.root_node)
+            self.assertEqual(tracker.published_commit_id, commit2.pk)
+            self.assertIsNone(tracker.published_commit_expires_at)
+            # only remembered in memory until the next commit is saved
+            self.assertEqual(refetch(tracker).published_commit_id, commit1.pk)
+            self.assertEqual(refetch(tracker).get_published_node(None), commit2.root_node)
+            commit2.save()
+            tracker = refetch(tracker)
+            self.assertEqual(tracker.published_commit_id, commit2.pk)
+            self.assertIsNone(tracker.published_commit_expires_at)
+
+    def test_published_commit_invalidated(self):
+        tracker, commit1 = make_commit(self.widgy_site, datetime.timedelta(days=1))
+        tracker = refetch(tracker)
+        self.assertIsNone(tracker.get_published_node(None))
+
+        commit1.publish_at = timezone.now()
+        commit1.save()
+        tracker = refetch(tracker)
+        self.assertEqual(tracker.get_published_node(None), commit1.root_node)
+
+        # saving the tracker doesn't overwrite it with a stale copy
+        stale = refetch(tracker)
+        commit2 = tracker.commit()
+        stale.save()
+        self.assertEqual(refetch(tracker).get_published_node(None), commit2.root_node)
+
     def test_created_at(self):
         tracker, commit = make_commit(self.widgy_site)
         created_at = commit.created_at
@@ -880,6 +1204,59 @@ class TestVersioning(RootNodeTestCase):
         new_root = root.clone()
         self.assertEqual(new_root.tags.get(), tag)
 
+    def test_clone_contents(self):
+        tag = Tag.objects.create(name='foo')
+        m2m = ManyToManyWidget.add_root(self.widgy_site)
+        m2m.tags.add(tag)
+        text = RawTextWidget.add_root(self.widgy_site, text='text')
+        weird = WeirdPkBucket.add_root(self.widgy_site, bubble=2)
+
+        clones = clone_contents([m2m, text, weird])
+        self.assertEqual([type(i) for i in clones], [ManyToManyWidget, RawTextWidget, WeirdPkBucket])
+        for obj, clone in zip([m2m, text, weird], clones):
+            self.assertNotEqual(refetch(clone).pk, obj.pk)
+        self.assertEqual(refetch(clones[0]).tags.get(), tag)
+        self.assertEqual(refetch(clones[1]).text, 'text')
+
+    def test_clone_contents_sends_save_signals(self):
+        text = RawTextWidget.add_root(self.widgy_site, text='text')
+        bucket = Bucket.add_root(self.widgy_site)
+        received = []
+
+        def receiver(signal, sender, instance, **kwargs):
+            received.append((signal, sender, instance, kwargs.get('created')))
+
+        # receivers for every model, like easy_thumbnails'
+        models.signals.pre_save.connect(receiver)
+        models.signals.post_save.connect(receiver)
+        try:
+            clones = clone_contents([text, bucket])
+        finally:
+            models.signals.pre_save.disconnect(receiver)
+            models.signals.post_save.disconnect(receiver)
+
+        for clone in clones:
+            self.assertIn((models.signals.pre_save, type(clone), clone, None), received)
+            self.assertIn((models.signals.post_save, type(clone), clone, True), received)
+
+    @skipUnlessDBFeature('can_return_ids_from_bulk_insert')
+    def test_clone_tree_bulk(self):
+        tag = Tag.objects.create(name='foo')
+
+        def clone_queries(widgets):
+            root = Bucket.add_root(self.widgy_site)
+            root.add_children(self.widgy_site, [(RawTextWidget, {'text': 'text'})] * widgets)
+            root.add_child(self.widgy_site, ManyToManyWidget).tags.add(tag)
+            root_node = Node.objects.get(pk=root.node.pk)
+            root_node.prefetch_tree()
+            with CaptureQueriesContext(connection) as queries:
+                new_root = root_node.clone_tree()
+            self.assertEqual(refetch(new_root).get_digest(), root_node.digest)
+            return len(queries)
+
+        # one query per model, not per widget
+        self.assertEqual(clone_queries(2), clone_queries(10))
+
     def test_reset_exception(self):
         """
         Some widgets can't be deleted. We should still be able to reset.
@@ -1023,6 +1400,106 @@ class VersioningViewsTest(SwitchUserTestCase, RootNodeTestCase):
         self.assertIn(tracker2, vt_class.objects.published())
 
 
+class TestDigest(RootNodeTestCase):
+    widgy_site = widgy_site
+
+    def setUp(self):
+        super(TestDigest, self).setUp()
+        self.left, self.right = make_a_nice_tree(self.root_node)
+
+    def digest(self):
+        return refetch(self.root_node).digest
+
+    def test_maintained(self):
+        digest = self.digest()
+        self.assertTrue(digest)
+        self.assertEqual(digest, self.root_node.get_digest())
+
+        text = self.right.get_children()[0].content
+        text.text = 'changed'
+        text.save()
+        self.assertNotEqual(self.digest(), digest)
+
+        text.text = 'right_1'
+        text.save()
+        self.assertEqual(self.digest(), digest)
+
+    def test_save_doesnt_depend_on_tree_size(self):
+        text = refetch(self.right).get_children()[0].content
+
+        def save():
+            text.text += '!'
+            with CaptureQueriesContext(connection) as queries:
+                text.save()
+            return len(queries)
+
+        before = save()
+        for i in range(10):
+            self.left.content.add_child(self.widgy_site, Bucket).add_child(
+                self.widgy_site, RawTextWidget, text=str(i))
+        self.assertEqual(save(), before)
+        # same as computed from scratch
+        digest = self.digest()
+        Node.objects.update(digest='')
+        self.assertEqual(refetch(self.root_node).get_digest(), digest)
+
+    def test_add_move_delete(self):
+        digests = [self.digest()]
+
+        text = self.left.content.add_child(self.widgy_site, RawTextWidget, text='new')
+        digests.append(self.digest())
+
+        text.reposition(self.widgy_site, parent=self.right.content)
+        digests.append(self.digest())
+
+        self.assertEqual(len(set(digests)), 3)
+
+        refetch(text).delete()
+        # deleting only invalidates
+        self.assertEqual(self.digest(), '')
+        self.assertEqual(self.root_node.get_digest(), digests[0])
+        self.assertEqual(self.digest(), digests[0])
+
+    def test_m2m(self):
+        widget = self.left.content.add_child(self.widgy_site, ManyToManyWidget)
+        digest = self.digest()
+        widget.tags.add(Tag.objects.create(name='foo'))
+        self.assertNotEqual(self.digest(), digest)
+        widget.tags.clear()
+        self.assertEqual(self.digest(), digest)
+
+    def test_same_as_clone(self):
+        new_root = self.root_node.clone_tree()
+        self.assertEqual(new_root.digest, self.digest())
+        # computed from scratch
+        Node.objects.filter(path__startswith=new_root.path).update(digest='')
+        self.assertEqual(new_root.get_digest(), self.digest())
+
+    def test_has_changes(self):
+        vt = VersionTracker.objects.create(working_copy=self.root_node)
+        vt.commit()
+        vt = VersionTracker.objects.get(pk=vt.pk)
+        # - head
+        # - head's root node
+        # - working copy
+        with self.assertNumQueries(3):
+            self.assertFalse(vt.has_changes())
+
+        text = refetch(self.right).get_children()[0].content
+        text.text = 'changed'
+        text.save()
+        self.assertTrue(VersionTracker.objects.get(pk=vt.pk).has_changes())
+        # the tracker's own working copy instance is stale now
+        self.assertTrue(vt.has_changes())
+
+    def test_has_changes_without_digest(self):
+        vt = VersionTracker.objects.create(working_copy=self.root_node)
+        commit = vt.commit()
+        Node.objects.filter(path__startswith=commit.root_node.path).update(digest='')
+        vt = VersionTracker.objects.get(pk=vt.pk)
+        self.assertFalse(vt.has_changes())
+
+
 class TestPrefetchTree(RootNodeTestCase):
     widgy_site = widgy_site
 
@@ -1141,13 +1618,57 @@ class TestPrefetchTree(RootNodeTestCase):
         self.assertEqual(left.get_root(), left.get_parent())
         self.assertEqual(left.get_children()[0].get_root(), left.get_parent())
 
+    def test_sibling_index(self):
+        root_node = Node.objects.get(pk=self.root_node.pk)
+        root_node.prefetch_tree()
+
+        with self.assertNumQueries(0):
+            left, right = root_node.get_children()
+            self.assertEqual(root_node.get_sibling_index(), 0)
+            self.assertEqual(left.get_sibling_index(), 0)
+            self.assertEqual(right.get_sibling_index(), 1)
+            subbucket = left.get_children()[2]
+            self.assertEqual(subbucket.get_sibling_index(), 2)
+            self.assertEqual(subbucket.get_children()[1].get_sibling_index(), 1)
+            self.assertEqual(left.get_children()[1].get_next_sibling(), subbucket)
+            self.assertEqual(subbucket.get_children()[1].get_ancestors(),
+                             [root_node, left, subbucket])
+
+        # without prefetching it has to count the previous siblings
+        right = Node.objects.get(pk=right.pk)
+        with self.assertNumQueries(1):
+            self.assertEqual(right.get_sibling_index(), 1)
+
+    def test_iter_depth_first(self):
+        texts = ['left_1', 'left_2', 'subbucket_1', 'subbucket_2', 'right_1', 'right_2']
+        root_node = Node.objects.get(pk=self.root_node.pk)
+        root_node.prefetch_tree()
+        root = root_node.content
+
+        with self.assertNumQueries(0):
+            self.assertEqual(list(root_node.iter_depth_first()), root_node.depth_first_order())
+            self.assertEqual([i.text for i in root.iter_depth_first(RawTextWidget)], texts)
+            buckets = root.get_descendants_of_type(Bucket)
+            self.assertEqual(len(buckets), 3)
+            # remembered on the prefetched node, but every caller gets a copy
+            with mock.patch.object(type(root), 'iter_depth_first') as iter_depth_first:
+                buckets.pop()
+                self.assertEqual(len(root.get_descendants_of_type(Bucket)), 3)
+                self.assertFalse(iter_depth_first.called)
+
+        # without prefetching, only the RawTextWidgets are fetched
+        root = refetch(self.root_node).content
+        root.node = refetch(self.root_node)
+        with self.assertNumQueries(2):
+            self.assertEqual([i.text for i in root.iter_depth_first(RawTextWidget)], texts)
+
     def test_prefetch_trees(self):
         a = Node.objects.get(pk=self.root_node.pk)
         b = Node.objects.get(pk=self.root_node.pk)
 
-        # a.get_descendants, b.get_descendants
+        # descendants of a and b
         # 3 contents
-        with self.assertNumQueries(5):
+        with self.assertNumQueries(4):
             Node.prefetch_trees(a, b)
 
         root_node_dfo = self.root_node.depth_first_order()
@@ -1159,6 +1680,65 @@ class TestPrefetchTree(RootNodeTestCase):
             self.assertEqual(a.depth_first_order(),
                              b.depth_first_order())
 
+    def test_prefetch_trees_separate_instances(self):
+        a = Node.objects.get(pk=self.root_node.pk)
+        b = Node.objects.get(pk=self.root_node.pk)
+        Node.prefetch_trees(a, b)
+
+        for x, y in zip(a.depth_first_order(), b.depth_first_order()):
+            self.assertEqual(x, y)
+            self.assertIsNot(x, y)
+
+    def test_prefetch_trees_many_roots(self):
+        other_root = Layout.add_root(widgy_site).node
+        left = self.root_node.get_children()[0]
+        roots = [
+            Node.objects.get(pk=self.root_node.pk),
+            Node.objects.get(pk=other_root.pk),
+            # a subtree of the first tree
+            Node.objects.get(pk=left.pk),
+        ]
+        expected = [
+            [root.pk] + [i.pk for i in root.get_descendants().order_by('path')]
+            for root in roots
+        ]
+
+        # descendants of all the roots
+        # 3 contents
+        with self.assertNumQueries(4):
+            Node.prefetch_trees(*roots)
+
+        with self.assertNumQueries(0):
+            self.assertEqual([[i.pk for i in root.depth_first_order()] for root in roots],
+                             expected)
+            self.assertEqual(roots[2].get_children()[2].get_parent(), roots[2])
+
+    def test_assemble_tree(self):
+        nodes = list(self.root_node.get_descendants().order_by('path'))
+        root_node = Node.objects.get(pk=self.root_node.pk)
+        with self.assertNumQueries(0):
+            root_node.assemble_tree(nodes)
+            left, right = root_node.get_children()
+            self.assertEqual(len(left.get_children()), 3)
+            self.assertEqual(len(right.get_children()), 2)
+            self.assertEqual(len(left.get_children()[2].get_children()), 2)
+            self.assertEqual(right.get_parent(), root_node)
+
+    def test_assemble_tree_deep(self):
+        # A deep tree shouldn't run into the recursion limit.
+        nodes = [Node(path=Node._get_path(None, 1, 1), depth=1)]
+        for i in range(2, 2000):
+            parent = nodes[-1]
+            nodes.append(Node(path=Node._get_path(parent.path, i, 1), depth=i))
+        nodes[0].assemble_tree(nodes[1:])
+        self.assertEqual(nodes[-1].get_parent(), nodes[-2])
+        self.assertEqual(nodes[-2].get_children(), [nodes[-1]])
+
+    def test_assemble_tree_not_a_subtree(self):
+        left, right = self.root_node.get_children()
+        with self.assertRaises(AssertionError):
+            left.assemble_tree([right])
+
     def test_attach_content_instances(self):
         nodes = self.root_node.depth_first_order()
         nodes = Node.attach_content_instances(nodes)
@@ -1197,6 +1777,71 @@ class TestSite(TestCase):
 
         self.assertNotIn('widgy/models/content.scss', files)
 
+    def test_cached_reverse(self):
+        site = self.widgy_site
+        cases = [
+            (site.node_view, {'node_pk': 1}),
+            (site.node_view, {'node_pk': 12345}),
+            (site.node_edit_view, {'node_pk': 'a_b'}),
+            (site.revert_view, {'pk': 3, 'commit_pk': 4}),
+            (site.content_view, {'app_label': 'core_tests', 'object_name': 'bucket', 'object_pk': 5}),
+            # these aren't templated
+            (site.node_view, {'node_pk': 'sp ace'}),
+            (site.node_view, {'node_pk': u'\N{SNOWMAN}'}),
+            (site.diff_view, {}),
+        ]
+        for prefix in ('/', '/prefix/'):
+            with override_script_prefix(prefix):
+                for view, kwargs in cases:
+                    self.assertEqual(site.cached_reverse(view, kwargs=kwargs),
+                                     site.reverse(view, kwargs=kwargs))
+
+        with self.assertRaises(NoReverseMatch):
+            site.cached_reverse(site.node_view, kwargs={'bad': 1})
+        # the template accepts it, but not the app_label pattern
+        with self.assertRaises(NoReverseMatch):
+            site.cached_reverse(site.content_view, kwargs={
+                'app_label': '9lives', 'object_name': 'bucket', 'object_pk': 5})
+
+    def test_cached_reverse_checks_patterns(self):
+        class DigitsSite(WidgySite):
+            def get_urls(self):
+                return [
+                    url('^node/(?P<node_pk>\d+)/$', self.node_view),
+                    url('^node/(?P<node_pk>[^/]+)/edit/(?P<tab>[a-z0-9]+)/$', self.node_edit_view),
+                ]
+
+        site = DigitsSite()
+
+        class urlconf:
+            urlpatterns = [url('^digits/', include(site.urls))]
+
+        with override_settings(ROOT_URLCONF=urlconf):
+            for i in range(2):
+                self.assertEqual(site.cached_reverse(site.node_view, kwargs={'node_pk': 1}),
+                                 '/digits/node/1/')
+                with self.assertRaises(NoReverseMatch):
+                    site.cached_reverse(site.node_view, kwargs={'node_pk': 'a'})
+
+                kwargs = {'node_pk': 2, 'tab': 'main'}
+                self.assertEqual(site.cached_reverse(site.node_edit_view, kwargs=kwargs),
+                                 '/digits/node/2/edit/main/')
+                with self.assertRaises(NoReverseMatch):
+                    site.cached_reverse(site.node_edit_view, kwargs={'node_pk': 2, 'tab': 'a_b'})
+
+            # the placeholders match the tab pattern, so it is templated
+            with mock.patch.object(site, 'reverse') as reverse:
+                site.cached_reverse(site.node_edit_view, kwargs={'node_pk': 3, 'tab': 'x'})
+                self.assertFalse(reverse.called)
+
+    def test_cached_reverse_uses_template(self):
+        site = self.widgy_site
+        site.cached_reverse(site.node_view, kwargs={'node_pk': 1})
+        with mock.patch.object(site, 'reverse') as reverse:
+            url = site.cached_reverse(site.node_view, kwargs={'node_pk': 2})
+            self.assertFalse(reverse.called)
+        self.assertEqual(url, site.reverse(site.node_view, kwargs={'node_pk': 2}))
+
 
 class TestFindProblems(RootNodeTestCase):
     widgy_site = widgy_site
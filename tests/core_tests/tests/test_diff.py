@@ -0,0 +1,111 @@
+from __future__ import absolute_import
+
+from django.test import TestCase
+
+from widgy.diff import diff_trees, NodeDiff
+from widgy.models import Node, VersionTracker, VersionCommit
+
+from .base import RootNodeTestCase, SwitchUserTestCase, make_a_nice_tree, refetch
+from ..models import Bucket, RawTextWidget
+from ..widgy_config import widgy_site
+
+
+class TestTreeDiff(RootNodeTestCase):
+    widgy_site = widgy_site
+
+    def setUp(self):
+        super(TestTreeDiff, self).setUp()
+        make_a_nice_tree(self.root_node)
+        self.tracker = VersionTracker.objects.create(working_copy=self.root_node)
+        self.commit = self.tracker.commit()
+
+    def diff(self):
+        return diff_trees(refetch(self.commit.root_node), refetch(self.root_node))
+
+    def working_copy_text(self, text):
+        return RawTextWidget.objects.get(
+            text=text, _nodes__is_frozen=False)
+
+    def test_unchanged(self):
+        diff = self.diff()
+        self.assertFalse(diff.has_changes)
+        self.assertEqual(diff.root.status, NodeDiff.UNCHANGED)
+
+    def test_changed(self):
+        text = self.working_copy_text('left_2')
+        text.text = 'changed'
+        text.save()
+
+        diff = self.diff()
+        self.assertTrue(diff.has_changes)
+        changed, = diff.changed
+        self.assertEqual(changed.after, text)
+        change, = changed.changes
+        self.assertEqual((change.name, change.before, change.after),
+                         ('text', 'left_2', 'changed'))
+        self.assertFalse(diff.added or diff.removed or diff.moved)
+
+    def test_added_and_removed(self):
+        refetch(self.working_copy_text('right_1').node).content.delete()
+        right = refetch(self.root_node).get_children()[1].content
+        right.add_child(self.widgy_site, Bucket)
+
+        diff = self.diff()
+        removed, = diff.removed
+        self.assertEqual(removed.before.text, 'right_1')
+        added, = diff.added
+        self.assertIsInstance(added.after, Bucket)
+        self.assertFalse(diff.changed)
+
+    def test_moved(self):
+        subbucket = refetch(self.root_node).get_children()[0].get_children()[2].content
+        right = refetch(self.root_node).get_children()[1].content
+        subbucket.reposition(self.widgy_site, parent=right)
+
+        diff = self.diff()
+        moved, = diff.moved
+        self.assertIsInstance(moved.after, Bucket)
+        self.assertEqual(moved.after.node.get_parent().content, right)
+        self.assertEqual(moved.before.node.get_parent().get_parent(), self.commit.root_node)
+        self.assertFalse(diff.added or diff.removed or diff.changed)
+        self.assertEqual([i.status for i in diff.root if i.status == NodeDiff.MOVED_AWAY],
+                         [NodeDiff.MOVED_AWAY])
+
+    def test_no_queries_for_prefetched_trees(self):
+        before = refetch(self.commit.root_node)
+        after = refetch(self.root_node)
+        Node.prefetch_trees(before, after)
+        with self.assertNumQueries(0):
+            diff_trees(before, after)
+
+
+class TestDiffView(SwitchUserTestCase, TestCase):
+    def test_diff_view(self):
+        root_node = Bucket.add_root(widgy_site).node
+        text = root_node.content.add_child(widgy_site, RawTextWidget, text='before')
+        tracker = VersionTracker.objects.create(working_copy=root_node)
+        commit = tracker.commit()
+        text.text = 'after'
+        text.save()
+
+        url = widgy_site.reverse(widgy_site.diff_view)
+        with self.as_staffuser() as user:
+            with self.with_permission(user, 'add', VersionCommit):
+                resp = self.client.get(url, {'before': commit.root_node.pk,
+                                             'after': root_node.pk})
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn('<del>before</del>', resp.content.decode('utf-8'))
+                self.assertIn('<ins>after</ins>', resp.content.decode('utf-8'))
+
+                resp = self.client.get(url, {'before': commit.root_node.pk})
+                self.assertEqual(resp.status_code, 404)
+
+                # not the tree of a tracker
+                resp = self.client.get(url, {'before': commit.root_node.pk,
+                                             'after': text.node.pk})
+                self.assertEqual(resp.status_code, 404)
+
+            # not allowed to commit
+            resp = self.client.get(url, {'before': commit.root_node.pk,
+                                         'after': root_node.pk})
+            self.assertEqual(resp.status_code, 404)
@@ -4,11 +4,14 @@ import unittest
 
 from django.test import TestCase
 from django import forms
+from django.core.cache import cache
 from django.contrib.contenttypes.models import ContentType
 from django.template import Context
+from django.utils import translation
 
 import mock
 
+from widgy.db.query import WidgyQuerySet, prefetch_widgy_trees
 from widgy.forms import WidgyFormMixin, WidgyFormField
 from widgy.models import Node, VersionTracker
 
@@ -360,3 +363,143 @@ class TestRender(TestCase):
         field = VersionedPage._meta.get_field('version_tracker')
         # doesn't matter what happens as long as it doesn't throw an exception
         field.render(page)
+
+
+class TestFragmentCache(TestCase):
+    def setUp(self):
+        cache.clear()
+        root_node = Layout.add_root(widgy_site).node
+        self.text = root_node.get_children()[1].content.add_child(
+            widgy_site, RawTextWidget, text='asdf')
+        self.page = VersionedPage.objects.create(
+            version_tracker=VersionTracker.objects.create(working_copy=root_node),
+        )
+        self.field = VersionedPage._meta.get_field('version_tracker')
+
+        patcher = mock.patch.object(widgy_site, 'fragment_cache_alias', 'default')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def change_frozen_text(self, text):
+        # bypass check_frozen, it's only to detect caching
+        commit = self.page.version_tracker.head
+        node = commit.root_node.get_children()[1].get_children()[0]
+        RawTextWidget.objects.filter(pk=node.content_id).update(text=text)
+
+    def render(self):
+        # refetch so nothing is cached on instances
+        page = VersionedPage.objects.get(pk=self.page.pk)
+        return self.field.render(page)
+
+    def test_frozen_tree_is_cached(self):
+        self.page.version_tracker.commit()
+        self.assertIn('asdf', self.render())
+
+        self.change_frozen_text('changed')
+        self.assertIn('asdf', self.render())
+
+    def test_working_copy_is_not_cached(self):
+        self.assertIn('asdf', self.render())
+
+        self.text.text = 'changed'
+        self.text.save()
+        self.assertIn('changed', self.render())
+
+    def test_disabled(self):
+        self.page.version_tracker.commit()
+        with mock.patch.object(widgy_site, 'fragment_cache_alias', None):
+            self.assertIn('asdf', self.render())
+            self.change_frozen_text('changed')
+            self.assertIn('changed', self.render())
+
+    def test_uncacheable_widget(self):
+        self.page.version_tracker.commit()
+        with mock.patch.object(RawTextWidget, 'cacheable', False):
+            self.assertIn('asdf', self.render())
+            self.change_frozen_text('changed')
+            self.assertIn('changed', self.render())
+
+    def test_varies_on_language(self):
+        self.page.version_tracker.commit()
+        with translation.override('en'):
+            self.assertIn('asdf', self.render())
+        self.change_frozen_text('changed')
+        with translation.override('en'):
+            self.assertIn('asdf', self.render())
+        with translation.override('fr'):
+            self.assertIn('changed', self.render())
+
+    def test_get_cache_vary(self):
+        self.page.version_tracker.commit()
+        vary = mock.Mock(return_value=('a',))
+        with mock.patch.object(RawTextWidget, 'get_cache_vary', vary):
+            self.assertIn('asdf', self.render())
+            self.change_frozen_text('changed')
+            self.assertIn('asdf', self.render())
+            vary.return_value = ('b',)
+            self.assertIn('changed', self.render())
+
+
+class TestPrefetchWidgyTrees(TestCase):
+    def make_page(self, text, commit=True):
+        root_node = Layout.add_root(widgy_site).node
+        root_node.get_children()[0].content.add_child(widgy_site, RawTextWidget, text=text)
+        tracker = VersionTracker.objects.create(working_copy=root_node)
+        if commit:
+            tracker.commit()
+            tracker.commit()
+        return VersionedPage.objects.create(version_tracker=tracker)
+
+    def setUp(self):
+        for i in range(3):
+            self.make_page('published %s' % i)
+        self.make_page('unpublished', commit=False)
+        VersionedPage.objects.create()
+        # fill the ContentType cache
+        for i in ContentType.objects.all():
+            ContentType.objects.get_for_id(i.pk)
+        self.field = VersionedPage._meta.get_field('version_tracker')
+
+    def assertRendersWithoutQueries(self, pages):
+        with self.assertNumQueries(0):
+            rendered = [self.field.render(i) for i in pages]
+        for i in range(3):
+            self.assertIn('published %s' % i, rendered[i])
+        self.assertIn('unpublished', rendered[3])
+        self.assertEqual(rendered[4], 'no content')
+
+    def test_prefetch_widgy_trees(self):
+        pages = list(VersionedPage.objects.order_by('pk'))
+        # - version trackers
+        # - commits
+        # - working copies of the unpublished trackers
+        # - descendants
+        # - 3 content types
+        with self.assertNumQueries(7):
+            prefetch_widgy_trees(pages, 'version_tracker')
+        self.assertRendersWithoutQueries(pages)
+
+    def test_unversioned(self):
+        owners = [
+            HasAWidgy.objects.create(widgy=Layout.add_root(widgy_site).node)
+            for i in range(3)
+        ]
+        field = HasAWidgy._meta.get_field('widgy')
+        owners = list(HasAWidgy.objects.filter(pk__in=[i.pk for i in owners]))
+        # - nodes
+        # - descendants
+        # - 2 content types
+        with self.assertNumQueries(4):
+            prefetch_widgy_trees(owners, 'widgy')
+        with self.assertNumQueries(0):
+            for owner in owners:
+                field.render(owner)
+
+    def test_queryset(self):
+        queryset = WidgyQuerySet(VersionedPage).order_by('pk').prefetch_widgy('version_tracker')
+        with self.assertNumQueries(8):
+            pages = list(queryset)
+        self.assertRendersWithoutQueries(pages)
+
+        with self.assertNumQueries(1):
+            list(queryset.values_list('pk', flat=True))
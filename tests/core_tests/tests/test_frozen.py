@@ -0,0 +1,231 @@
+from __future__ import absolute_import
+import datetime
+import decimal
+import json
+
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase
+from django.utils import timezone
+
+import mock
+
+from widgy.db.query import prefetch_widgy_trees
+from widgy.frozen import FrozenNode
+from widgy.models import Node, VersionTracker, TreeSnapshot
+
+from .base import RootNodeTestCase, make_a_nice_tree, refetch
+from ..models import (
+    Layout, RawTextWidget, VersionedPage, VariegatedFieldsWidget, ManyToManyWidget, Tag,
+)
+from ..widgy_config import widgy_site
+
+
+class TestFrozenNode(RootNodeTestCase):
+    def setUp(self):
+        super(TestFrozenNode, self).setUp()
+        make_a_nice_tree(self.root_node)
+        # fill the ContentType cache
+        for i in ContentType.objects.all():
+            ContentType.objects.get_for_id(i.pk)
+
+    def test_fetch_tree(self):
+        root_node = refetch(self.root_node)
+        # - nodes
+        # - 3 content types
+        with self.assertNumQueries(4):
+            root = FrozenNode.fetch_tree(root_node)
+
+        expected = refetch(self.root_node)
+        expected.prefetch_tree()
+        with self.assertNumQueries(0):
+            self.assertEqual([i.pk for i in root.depth_first_order()],
+                             [i.pk for i in expected.depth_first_order()])
+            self.assertEqual([i.content for i in root.depth_first_order()],
+                             [i.content for i in expected.depth_first_order()])
+            for node in root.depth_first_order():
+                self.assertIs(node.content.node, node)
+
+    def test_traversal(self):
+        root = FrozenNode.fetch_tree(refetch(self.root_node))
+
+        with self.assertNumQueries(0):
+            left, right = root.content.get_children()
+            subbucket = left.get_children()[2]
+            text = subbucket.get_children()[1]
+            self.assertEqual(text.text, 'subbucket_2')
+            self.assertEqual(text.get_ancestors(), [root.content, left, subbucket])
+            self.assertEqual(text.get_root(), root.content)
+            self.assertEqual(text.get_parent(), subbucket)
+            self.assertEqual(left.get_next_sibling(), right)
+            self.assertIsNone(right.get_next_sibling())
+            self.assertEqual(subbucket.node.get_sibling_index(), 2)
+            self.assertEqual([i.text for i in root.content.iter_depth_first(RawTextWidget)],
+                             ['left_1', 'left_2', 'subbucket_1', 'subbucket_2',
+                              'right_1', 'right_2'])
+
+    def test_subtree(self):
+        left_node = self.root_node.get_children()[0]
+        left = FrozenNode.fetch_tree(left_node)
+        self.assertEqual(len(left.depth_first_order()), 6)
+        text = left.get_children()[0].content
+        self.assertEqual(text.get_ancestors(), [self.root_node.content, left.content])
+        self.assertEqual(left.get_next_sibling(), self.root_node.get_children()[1])
+
+    def test_slots(self):
+        root = FrozenNode.fetch_tree(refetch(self.root_node))
+        self.assertFalse(hasattr(root, '__dict__'))
+
+
+class TestCompactFrozenTrees(TestCase):
+    def setUp(self):
+        root_node = Layout.add_root(widgy_site).node
+        make_a_nice_tree(root_node)
+        tracker = VersionTracker.objects.create(working_copy=root_node)
+        tracker.commit()
+        self.page = VersionedPage.objects.create(version_tracker=tracker)
+        self.field = VersionedPage._meta.get_field('version_tracker')
+
+        patcher = mock.patch.object(widgy_site, 'compact_frozen_trees', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def render(self, **kwargs):
+        page = VersionedPage.objects.get(pk=self.page.pk)
+        return self.field.render(page, **kwargs)
+
+    def test_same_output(self):
+        with mock.patch.object(widgy_site, 'compact_frozen_trees', False):
+            rendered = self.render()
+        self.assertIn('subbucket_2', rendered)
+
+        with mock.patch.object(Node, 'prefetch_tree') as prefetch_tree:
+            self.assertEqual(self.render(), rendered)
+        self.assertFalse(prefetch_tree.called)
+
+    def test_working_copy_is_not_compact(self):
+        working_copy = self.page.version_tracker.working_copy
+        self.assertIn('subbucket_2', self.render(node=working_copy))
+        self.assertIs(working_copy.content.node, working_copy)
+
+
+class TestTreeSnapshot(TestCase):
+    def setUp(self):
+        root_node = Layout.add_root(widgy_site).node
+        make_a_nice_tree(root_node)
+        self.tracker = VersionTracker.objects.create(working_copy=root_node)
+        self.page = VersionedPage.objects.create(version_tracker=self.tracker)
+        self.field = VersionedPage._meta.get_field('version_tracker')
+        # fill the ContentType cache
+        for i in ContentType.objects.all():
+            ContentType.objects.get_for_id(i.pk)
+
+        patcher = mock.patch.object(VersionTracker, 'snapshot_trees', True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def render(self):
+        page = VersionedPage.objects.select_related('version_tracker').get(pk=self.page.pk)
+        return self.field.render(page)
+
+    def test_dump_and_load(self):
+        root_node = self.tracker.commit().root_node
+        data = FrozenNode.fetch_tree(root_node).dump()
+
+        with self.assertNumQueries(0):
+            root = FrozenNode.load(data)
+            texts = list(root.content.iter_depth_first(RawTextWidget))
+        self.assertEqual([i.text for i in texts],
+                         ['left_1', 'left_2', 'subbucket_1', 'subbucket_2',
+                          'right_1', 'right_2'])
+
+        expected = FrozenNode.fetch_tree(root_node)
+        self.assertEqual([i.content.get_attributes() for i in root.depth_first_order()],
+                         [i.content.get_attributes() for i in expected.depth_first_order()])
+        self.assertEqual([i.digest for i in root.depth_first_order()],
+                         [i.digest for i in expected.depth_first_order()])
+
+    def test_dump_and_load_field_types(self):
+        bucket = self.tracker.working_copy.content.get_children()[0]
+        values = {
+            'required_name': 'name',
+            'color': 'r',
+            'date': datetime.date(2020, 2, 29),
+            'time': datetime.time(13, 37, 1, 5),
+            'datetime': timezone.now(),
+            'decimal': decimal.Decimal('12.50'),
+        }
+        bucket.add_child(widgy_site, VariegatedFieldsWidget, **values)
+        bucket.add_child(widgy_site, VariegatedFieldsWidget, required_name='empty', color='g')
+        m2m = bucket.add_child(widgy_site, ManyToManyWidget)
+        m2m.tags.add(Tag.objects.create(name='tag'))
+
+        commit = self.tracker.commit()
+        root = TreeSnapshot.objects.get(root_node=commit.root_node).load_tree()
+
+        full, empty = root.content.iter_depth_first(VariegatedFieldsWidget)
+        for name, value in values.items():
+            self.assertEqual(getattr(full, name), value)
+        self.assertIsNone(empty.date)
+        self.assertIsNone(empty.decimal)
+        # many-to-many values aren't stored, they are queried
+        m2m = next(root.content.iter_depth_first(ManyToManyWidget))
+        self.assertEqual([i.name for i in m2m.tags.all()], ['tag'])
+
+    def test_missing_field_is_deferred(self):
+        data = json.loads(FrozenNode.fetch_tree(self.tracker.commit().root_node).dump())
+        for row in data['nodes']:
+            row[-1].pop('text', None)
+        root = FrozenNode.load(json.dumps(data))
+        text = next(root.content.iter_depth_first(RawTextWidget))
+        with self.assertNumQueries(1):
+            self.assertEqual(text.text, 'left_1')
+
+    def test_commit_takes_snapshot(self):
+        commit = self.tracker.commit()
+        self.assertTrue(TreeSnapshot.objects.filter(root_node=commit.root_node).exists())
+
+        self.tracker.revert_to(commit)
+        self.assertEqual(TreeSnapshot.objects.count(), 1)
+
+    def test_render(self):
+        with mock.patch.object(VersionTracker, 'snapshot_trees', False):
+            self.tracker.commit()
+            rendered = self.render()
+        self.assertIn('subbucket_2', rendered)
+        # the missing snapshot is taken the first time
+        self.assertEqual(self.render(), rendered)
+        self.assertEqual(TreeSnapshot.objects.count(), 1)
+
+        # the page (with its tracker) and the snapshot
+        with self.assertNumQueries(2):
+            self.assertEqual(self.render(), rendered)
+
+    def test_prefetch_widgy_trees(self):
+        self.tracker.commit()
+        for i in range(2):
+            page = VersionedPage.objects.create(
+                version_tracker=VersionTracker.objects.create(
+                    working_copy=Layout.add_root(widgy_site).node))
+            page.version_tracker.commit()
+        pages = list(VersionedPage.objects.order_by('pk'))
+
+        # - version trackers
+        # - commits
+        # - snapshots
+        with self.assertNumQueries(3):
+            prefetch_widgy_trees(pages, 'version_tracker')
+        with self.assertNumQueries(0):
+            rendered = [self.field.render(i) for i in pages]
+        self.assertIn('subbucket_2', rendered[0])
+
+    def test_incompatible_snapshot(self):
+        self.tracker.commit()
+        rendered = self.render()
+        TreeSnapshot.objects.update(data='{"version": 0}')
+        self.assertEqual(self.render(), rendered)
+
+    def test_deleted_with_tree(self):
+        self.tracker.commit()
+        self.page.delete()
+        self.tracker.delete()
+        self.assertFalse(TreeSnapshot.objects.exists())
@@ -76,6 +76,36 @@ class ReviewQueueTest(RootNodeTestCase):
         self.assertEqual(tracker.get_published_node(request_factory.get('/')),
                          commit2.root_node)
 
+    def test_published_commit_approval(self):
+        user = User.objects.create()
+        tracker, commit1 = make_commit(self.widgy_site)
+        commit1.approve(user)
+        commit2 = tracker.commit(publish_at=timezone.now())
+
+        tracker = refetch(tracker)
+        self.assertEqual(tracker.get_published_node(None), commit1.root_node)
+        self.assertEqual(refetch(tracker).published_commit_id, commit1.pk)
+
+        commit2.reviewedversioncommit.approve(user)
+        tracker = refetch(tracker)
+        self.assertEqual(tracker.get_published_node(None), commit2.root_node)
+
+        commit2.reviewedversioncommit.unapprove(user)
+        tracker = refetch(tracker)
+        self.assertEqual(tracker.get_published_node(None), commit1.root_node)
+
+    def test_prefetch_histories(self):
+        user = User.objects.create()
+        tracker, commit1 = make_commit(self.widgy_site)
+        commit1.approve(user)
+        tracker.commit(publish_at=timezone.now())
+
+        tracker = refetch(tracker)
+        with self.assertNumQueries(1):
+            ReviewedVersionTracker.prefetch_histories([tracker])
+        with self.assertNumQueries(0):
+            self.assertEqual(tracker.get_published_node(None), commit1.root_node)
+
     def test_foreign_key_to_proxy_works(self):
         """
         If ReviewedVersionTracker is implemented as a proxy, ensure a
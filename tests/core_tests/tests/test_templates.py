@@ -1,10 +1,14 @@
 from __future__ import absolute_import
 import uuid
 
-from django.test import TestCase
+import mock
+
+from django.conf import settings
+from django.test import TestCase, override_settings
 from django.template import Template, Context
 
 from widgy.models import VersionTracker
+from widgy.models.base import select_template, SELECTED_TEMPLATE_CACHE
 
 from ..widgy_config import widgy_site
 from ..models import (
@@ -140,3 +144,41 @@ class TestTemplateHierarchy(TestCase):
             'widgy/widgy/test.html',
             'widgy/test.html',
         ])
+
+    def test_hierarchy_is_memoized(self):
+        kwargs = {'template_name': 'memoized_test'}
+        first = MyInvisibleBucket.get_templates_hierarchy(**kwargs)
+        with mock.patch.object(MyInvisibleBucket, 'build_templates_hierarchy') as build:
+            second = MyInvisibleBucket.get_templates_hierarchy(**kwargs)
+            self.assertFalse(build.called)
+        self.assertEqual(first, second)
+        # callers get their own copy
+        second.append('foo')
+        self.assertEqual(first, MyInvisibleBucket.get_templates_hierarchy(**kwargs))
+
+        # the cache is per class
+        self.assertNotEqual(first, WeirdPkBucket.get_templates_hierarchy(**kwargs))
+
+
+class TestSelectTemplate(TestCase):
+    def setUp(self):
+        SELECTED_TEMPLATE_CACHE.clear()
+
+    names = ['widgy/core_tests/missing.html', 'widgy/preview.html']
+
+    def test_select_template_is_memoized(self):
+        template = select_template(self.names)
+        self.assertEqual(template.origin.template_name, self.names[1])
+        with mock.patch('widgy.models.base.loader') as loader:
+            self.assertIs(select_template(self.names), template)
+            self.assertFalse(loader.select_template.called)
+
+    def test_not_memoized_in_debug(self):
+        with override_settings(DEBUG=True):
+            select_template(self.names)
+            self.assertFalse(SELECTED_TEMPLATE_CACHE)
+
+    def test_cleared_when_templates_change(self):
+        select_template(self.names)
+        with override_settings(TEMPLATES=settings.TEMPLATES):
+            self.assertFalse(SELECTED_TEMPLATE_CACHE)
@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.contrib.admin.utils import unquote
 from django.core.urlresolvers import reverse
-from django.http import HttpResponse
+from django.http import StreamingHttpResponse
 from django.shortcuts import render
 from django.utils.translation import ugettext_lazy as _
 from django.conf.urls import url
@@ -69,11 +69,11 @@ class FormAdmin(admin.ModelAdmin):
 
     def download_view(self, request, object_id, *args, **kwargs):
         obj = self.get_object(request, unquote(object_id))
-        resp = HttpResponse(content_type='text/csv; charset=utf-8')
+        if obj is None:
+            raise Http404
+        resp = StreamingHttpResponse(obj.submissions.iter_csv(),
+                                     content_type='text/csv; charset=utf-8')
         resp['Content-Disposition'] = 'attachment; filename="%s"' % self.csv_file_name(obj)
-
-        obj.submissions.to_csv(resp)
-
         return resp
 
     def submission_count(self, obj):
@@ -0,0 +1,352 @@
+"""
+Running the slow part of form success handlers outside of the request.
+
+Success handlers that talk to other servers (sending mail, reposting the
+data to another site) turn their work into :class:`Job` objects in
+:meth:`FormSuccessHandler.get_jobs
+<widgy.contrib.form_builder.models.FormSuccessHandler.get_jobs>`. A job has
+everything it needs to run, it doesn't use the request, the form or the
+database. :meth:`Form.execute <widgy.contrib.form_builder.models.Form.execute>`
+hands the jobs of all the handlers to the backend in the
+``WIDGY_FORM_HANDLER_BACKEND`` setting:
+
+- :class:`SynchronousBackend` runs them right away, in the request. This is
+  the default.
+- :class:`ThreadPoolBackend` runs them in a few threads of the web process,
+  retrying the ones that fail.
+- :class:`OutboxBackend` saves them in the database, in the same
+  transaction as the submission, and the ``process_form_handler_jobs``
+  management command runs them, retrying the ones that fail.
+
+All the mail of a batch of jobs is sent over one connection.
+"""
+import base64
+import json
+import logging
+import threading
+import time
+from datetime import timedelta
+
+import six
+from six.moves import queue
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import connection as db_connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HANDLER_BACKEND = 'widgy.contrib.form_builder.handlers.SynchronousBackend'
+
+
+class Job(object):
+    """
+    The slow part of a success handler. Subclasses implement :meth:`run`,
+    :meth:`get_payload` and :meth:`from_payload`, the payload has to be
+    serializable as JSON for :class:`OutboxBackend`.
+    """
+    # Whether run needs a mail connection.
+    sends_mail = False
+
+    def run(self, connection=None):
+        raise NotImplementedError
+
+    def get_payload(self):
+        raise NotImplementedError
+
+    @classmethod
+    def from_payload(cls, payload):
+        raise NotImplementedError
+
+    @classmethod
+    def get_kind(cls):
+        return '%s.%s' % (cls.__module__, cls.__name__)
+
+    def dump(self):
+        return self.get_kind(), json.dumps(self.get_payload())
+
+    @staticmethod
+    def load(kind, payload):
+        return import_string(kind).from_payload(json.loads(payload))
+
+
+def dump_attachment_content(content):
+    if isinstance(content, six.binary_type):
+        return {'base64': base64.b64encode(content).decode('ascii')}
+    return content
+
+
+def load_attachment_content(content):
+    if isinstance(content, dict):
+        return base64.b64decode(content['base64'])
+    return content
+
+
+class EmailJob(Job):
+    """
+    Sends an EmailMessage (or EmailMultiAlternatives) with file attachments.
+    """
+    sends_mail = True
+
+    def __init__(self, message):
+        self.message = message
+
+    def run(self, connection=None):
+        self.message.connection = connection
+        self.message.send()
+
+    def get_payload(self):
+        msg = self.message
+        return {
+            'subject': msg.subject,
+            'body': msg.body,
+            'from_email': msg.from_email,
+            'to': msg.to,
+            'cc': msg.cc,
+            'bcc': msg.bcc,
+            'reply_to': msg.reply_to,
+            'headers': msg.extra_headers,
+            'alternatives': getattr(msg, 'alternatives', []),
+            'attachments': [
+                (filename, dump_attachment_content(content), mimetype)
+                for filename, content, mimetype in msg.attachments
+            ],
+        }
+
+    @classmethod
+    def from_payload(cls, payload):
+        payload = dict(payload)
+        attachments = payload.pop('attachments')
+        payload['alternatives'] = [tuple(i) for i in payload['alternatives']]
+        msg = EmailMultiAlternatives(**payload)
+        for filename, content, mimetype in attachments:
+            msg.attach(filename, load_attachment_content(content), mimetype)
+        return cls(msg)
+
+
+class PostJob(Job):
+    """
+    POSTs `data` (already urlencoded) to `url`. An error response raises an
+    exception, so it is retried. So does a server that doesn't answer
+    within :attr:`timeout` seconds.
+    """
+    timeout = 30
+
+    def __init__(self, url, data):
+        self.url = url
+        self.data = data
+
+    def run(self, connection=None):
+        six.moves.urllib.request.urlopen(self.url, self.data.encode('ascii'), self.timeout).close()
+
+    def get_payload(self):
+        return {'url': self.url, 'data': self.data}
+
+    @classmethod
+    def from_payload(cls, payload):
+        return cls(payload['url'], payload['data'])
+
+
+def run_jobs(jobs, on_error=None):
+    """
+    Runs `jobs`, sending all their mail over one connection. An exception
+    is raised right away, unless `on_error` is given, then it is called with
+    the job and the exception and the other jobs still run.
+    """
+    connection = None
+    try:
+        for job in jobs:
+            try:
+                if job.sends_mail and connection is None:
+                    connection = get_connection()
+                    connection.open()
+                job.run(connection)
+            except Exception as e:
+                if on_error is None:
+                    raise
+                on_error(job, e)
+    finally:
+        if connection is not None:
+            connection.close()
+
+
+class SynchronousBackend(object):
+    """
+    Runs the jobs in the request, an error fails the submission.
+    """
+    def enqueue(self, jobs):
+        run_jobs(jobs)
+
+
+class ThreadPoolBackend(object):
+    """
+    Runs the jobs in a pool of daemon threads, started the first time there
+    are jobs. Jobs waiting in the queue are run together, up to
+    :attr:`batch_size`, so their mail shares a connection. Failed jobs are
+    retried :attr:`max_attempts` times, waiting :attr:`retry_delay` seconds,
+    doubled every time. Jobs still in the queue when the process exits are
+    lost, use :class:`OutboxBackend` if that matters.
+    """
+    workers = 2
+    batch_size = 100
+    max_attempts = 3
+    retry_delay = 1
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.threads = []
+        self.lock = threading.Lock()
+
+    def enqueue(self, jobs):
+        self.start()
+        for job in jobs:
+            self.queue.put(job)
+
+    def start(self):
+        with self.lock:
+            while len(self.threads) < self.workers:
+                thread = threading.Thread(target=self.work, name='widgy-form-handlers')
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+
+    def join(self):
+        """
+        Waits until all the jobs in the queue have been run (or given up
+        on).
+        """
+        self.queue.join()
+
+    def work(self):
+        while True:
+            jobs = [self.queue.get()]
+            while len(jobs) < self.batch_size:
+                try:
+                    jobs.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.run(jobs)
+            except Exception:
+                logger.exception("Error running form handler jobs")
+            finally:
+                for job in jobs:
+                    self.queue.task_done()
+
+    def run(self, jobs):
+        for attempt in range(1, self.max_attempts + 1):
+            errors = []
+            run_jobs(jobs, on_error=lambda job, e: errors.append((job, e)))
+            if not errors:
+                return
+            jobs = [job for job, e in errors]
+            if attempt < self.max_attempts:
+                time.sleep(self.retry_delay * 2 ** (attempt - 1))
+        for job, e in errors:
+            logger.error("Giving up on %r after %d attempts: %r", job, self.max_attempts, e)
+
+
+class OutboxBackend(object):
+    """
+    Saves the jobs as :class:`~widgy.contrib.form_builder.models.HandlerJob`
+    rows, for :meth:`process` (the ``process_form_handler_jobs`` management
+    command) to run. Failed jobs are retried after :attr:`retry_delay`
+    seconds, doubled every time, until they have been tried
+    :attr:`max_attempts` times. Then they are marked as failed and kept, with
+    the last error.
+
+    Jobs are claimed before they run, so more than one worker can process
+    the outbox. A claimed job isn't due again for :attr:`claim_timeout`
+    seconds, so the jobs of a worker that died are run again after that.
+    """
+    batch_size = 100
+    max_attempts = 5
+    retry_delay = 60
+    claim_timeout = 600
+
+    def enqueue(self, jobs):
+        from widgy.contrib.form_builder.models import HandlerJob
+
+        HandlerJob.objects.bulk_create(HandlerJob.from_job(job) for job in jobs)
+
+    def process(self, batch_size=None):
+        """
+        Claims up to `batch_size` of the jobs that are due and runs them.
+        No transaction is open while they run. Returns the number of jobs
+        that were run and how many of them failed.
+        """
+        from widgy.contrib.form_builder.models import HandlerJob
+
+        rows = self.claim(batch_size or self.batch_size)
+        errors = {}
+        jobs = {}
+        for row in rows:
+            try:
+                jobs[row.get_job()] = row
+            except Exception as e:
+                errors[row] = e
+        run_jobs(list(jobs), on_error=lambda job, e: errors.__setitem__(jobs[job], e))
+
+        HandlerJob.objects.filter(pk__in=[row.pk for row in rows if row not in errors]).delete()
+        now = timezone.now()
+        for row, e in errors.items():
+            HandlerJob.objects.filter(pk=row.pk).update(
+                last_error=repr(e),
+                run_after=now + timedelta(seconds=self.retry_delay * 2 ** (row.attempts - 1)),
+                failed=row.attempts >= self.max_attempts,
+            )
+        return len(rows), len(errors)
+
+    def claim(self, batch_size):
+        """
+        Takes up to `batch_size` of the jobs that are due, in a short
+        transaction, by counting an attempt and moving their run_after past
+        :attr:`claim_timeout`. Returns the claimed rows.
+        """
+        from widgy.contrib.form_builder.models import HandlerJob
+
+        features = db_connection.features
+        now = timezone.now()
+        claimed_until = now + timedelta(seconds=self.claim_timeout)
+        with transaction.atomic():
+            rows = HandlerJob.objects.due(now).order_by('run_after', 'pk')
+            if features.has_select_for_update:
+                rows = rows.select_for_update(skip_locked=features.has_select_for_update_skip_locked)
+            rows = list(rows[:batch_size])
+            if features.has_select_for_update:
+                HandlerJob.objects.filter(pk__in=[row.pk for row in rows]).update(
+                    run_after=claimed_until,
+                    attempts=F('attempts') + 1,
+                )
+            else:
+                # Without row locks, another worker may have claimed some of
+                # them since we read them. Only the rows that haven't changed
+                # are ours.
+                rows = [
+                    row for row in rows
+                    if HandlerJob.objects.filter(
+                        pk=row.pk, run_after=row.run_after, attempts=row.attempts,
+                    ).update(run_after=claimed_until, attempts=F('attempts') + 1)
+                ]
+        for row in rows:
+            row.attempts += 1
+            row.run_after = claimed_until
+        return rows
+
+
+_backends = {}
+
+
+def get_handler_backend():
+    """
+    The backend in the WIDGY_FORM_HANDLER_BACKEND setting, a dotted path to
+    a class. The instance is kept for the life of the process.
+    """
+    path = getattr(settings, 'WIDGY_FORM_HANDLER_BACKEND', DEFAULT_HANDLER_BACKEND)
+    try:
+        return _backends[path]
+    except KeyError:
+        return _backends.setdefault(path, import_string(path)())
@@ -0,0 +1,32 @@
+import io
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.encoding import force_text
+
+from widgy.contrib.form_builder.models import FormSubmission, EXPORT_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = 'Writes the submissions of a form as csv, like the download in the admin'
+
+    def add_arguments(self, parser):
+        parser.add_argument('form_ident', help='The ident (a UUID) of the form')
+        parser.add_argument('-o', '--output', help='The file to write to, instead of stdout')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE,
+                            help='How many submissions to fetch at a time')
+
+    def handle(self, *args, **options):
+        try:
+            form_ident = uuid.UUID(options['form_ident'])
+        except ValueError:
+            raise CommandError('%r is not a form ident' % options['form_ident'])
+
+        lines = FormSubmission.objects.for_form(form_ident).iter_csv(options['chunk_size'])
+        if options['output']:
+            with io.open(options['output'], 'w', encoding='utf-8', newline='') as f:
+                for line in lines:
+                    f.write(force_text(line))
+        else:
+            for line in lines:
+                self.stdout.write(force_text(line), ending='')
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from widgy.contrib.form_builder.handlers import OutboxBackend
+
+
+class Command(BaseCommand):
+    help = 'Runs the form success handler jobs that OutboxBackend saved'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=OutboxBackend.batch_size,
+                            help='How many jobs to run at a time (their mail shares a connection)')
+        parser.add_argument('--interval', type=float, default=None,
+                            help='Keep running, looking for new jobs every INTERVAL seconds')
+
+    def handle(self, *args, **options):
+        backend = OutboxBackend()
+        while True:
+            ran = failed = 0
+            while True:
+                batch_ran, batch_failed = backend.process(options['batch_size'])
+                ran += batch_ran
+                failed += batch_failed
+                if batch_ran < options['batch_size']:
+                    break
+            if ran:
+                self.stdout.write('Ran %d jobs, %d failed' % (ran, failed))
+            if options['interval'] is None:
+                break
+            time.sleep(options['interval'])
@@ -6,18 +6,22 @@ import base64
 import hashlib
 import os.path
 import six
+import threading
 import uuid
 import copy
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict, namedtuple
 
 from django.db import models, transaction
+from django.db.models import Max, Min, Q
 from django import forms
 from django.core.mail import EmailMultiAlternatives
 from django.conf import settings
+from django.core.cache import caches
 from django.utils.translation import ugettext_lazy as _, ugettext
 from django.shortcuts import redirect
 from django.dispatch import receiver
 from django.template.loader import render_to_string
+from django.utils import timezone
 from django.utils.functional import cached_property
 from django.utils.encoding import python_2_unicode_compatible, force_bytes, force_text
 from django.template.defaultfilters import truncatechars
@@ -33,6 +37,7 @@ from widgy.utils import update_context, build_url, QuerySet, unset_pks
 from widgy.contrib.page_builder.models import Bucket, Html
 from widgy.contrib.page_builder.forms import MiniCKEditorField, CKEditorField
 from .forms import PhoneNumberField
+from .handlers import Job, EmailJob, PostJob, run_jobs, get_handler_backend
 import widgy
 
 
@@ -64,10 +69,21 @@ class FormSuccessHandler(FormElement):
     class Meta:
         abstract = True
 
+    static_valid_child_of = True
+
     @classmethod
     def valid_child_of(cls, parent, obj=None):
         return isinstance(parent, SuccessHandlers)
 
+    def get_jobs(self, request, form):
+        """
+        The slow part of handling a submission, like sending mail, as a list
+        of :class:`~widgy.contrib.form_builder.handlers.Job` for the
+        WIDGY_FORM_HANDLER_BACKEND to run. None means that :meth:`execute`
+        has to be called in the request instead.
+        """
+        return None
+
 
 class FormReponseHandler(FormSuccessHandler):
     class Meta:
@@ -87,7 +103,7 @@ class SaveDataHandler(FormSuccessHandler):
     def execute(self, request, form):
         FormSubmission.objects.submit(
             form=self.parent_form,
-            data=form.cleaned_data
+            data=form.cleaned_data,
         )
 
 
@@ -120,9 +136,12 @@ class RepostHandler(BaseMappingHandler):
     class Meta:
         abstract = True
 
+    def get_jobs(self, request, form):
+        query_string = six.moves.urllib.parse.urlencode(self.get_mapping(request, form))
+        return [PostJob(self.url_to_post, query_string)]
+
     def execute(self, request, form):
-        query_string = six.moves.urllib.parse.urlencode(self.get_mapping(request, form)).encode('ascii')
-        six.moves.urllib.request.urlopen(self.url_to_post, query_string)
+        run_jobs(self.get_jobs(request, form))
 
 
 class MappingValue(FormElement):
@@ -137,6 +156,8 @@ class MappingValue(FormElement):
     class Meta:
         abstract = True
 
+    static_valid_child_of = True
+
     @classmethod
     def valid_child_of(cls, parent, obj=None):
         return isinstance(parent, BaseMappingHandler)
@@ -176,8 +197,7 @@ class FieldMappingValue(StrDisplayNameMixin, MappingValue):
             return _('{0} to {1}').format(label, self.name)
 
     def get_fields(self):
-        return [f for f in self.parent_form.depth_first_order()
-                if isinstance(f, FormField)]
+        return self.parent_form.get_descendants_of_type(FormField)
 
     def update_mapping(self, mapping, form):
         try:
@@ -191,8 +211,7 @@ class FieldMappingValue(StrDisplayNameMixin, MappingValue):
         # Dict comprehension syntax for Python <2.7
         return dict(
             (field.ident, field)
-            for field in self.parent_form.depth_first_order()
-            if isinstance(field, FormField)
+            for field in self.parent_form.get_descendants_of_type(FormField)
         )
 
 
@@ -213,6 +232,8 @@ class WebToLeadMapperHandler(RepostHandler):
         mapping.update(oid=self.oid)
         return mapping
 
+    static_valid_parent_of = True
+
     def valid_parent_of(self, cls, obj=None):
         return issubclass(cls, FieldMappingValue)
 
@@ -253,7 +274,7 @@ class EmailSuccessHandlerBase(StrDisplayNameMixin, FormSuccessHandler):
             'self': self,
         })
 
-    def execute(self, request, form):
+    def get_message(self, request, form):
         message_text = self.format_message(request, form)
         msg = EmailMultiAlternatives(
             subject=self.subject,
@@ -268,8 +289,13 @@ class EmailSuccessHandlerBase(StrDisplayNameMixin, FormSuccessHandler):
                 if isinstance(value, File):
                     value.file.seek(0)  # The file has already been read once to save to disk.
                     msg.attach(value.name, value.read(), getattr(value, 'content_type', None))
+        return msg
+
+    def get_jobs(self, request, form):
+        return [EmailJob(self.get_message(request, form))]
 
-        msg.send()
+    def execute(self, request, form):
+        run_jobs(self.get_jobs(request, form))
 
     def get_to_emails(self, form):
         raise NotImplemented
@@ -333,8 +359,8 @@ class EmailUserHandler(EmailSuccessHandlerBase):
             return [form.cleaned_data[to.get_formfield_name()]]
 
     def get_email_fields(self):
-        return [i for i in self.parent_form.depth_first_order()
-                if isinstance(i, FormInput) and i.type == 'email']
+        return [i for i in self.parent_form.iter_depth_first(FormInput)
+                if i.type == 'email']
 
     def post_create(self, site):
         email_fields = self.get_email_fields()
@@ -352,7 +378,7 @@ class SubmitButton(StrDisplayNameMixin, FormElement):
 
     @property
     def deletable(self):
-        return len([i for i in self.parent_form.depth_first_order() if isinstance(i, SubmitButton)]) > 1
+        return len(self.parent_form.get_descendants_of_type(SubmitButton)) > 1
 
     class Meta:
         verbose_name = _('submit button')
@@ -379,6 +405,8 @@ class SuccessMessageBucket(DefaultChildrenMixin, Bucket):
         verbose_name = _('success message')
         verbose_name_plural = _('success messages')
 
+    static_valid_child_of = True
+
     @classmethod
     def valid_child_of(cls, parent, obj=None):
         return isinstance(parent, FormMeta)
@@ -404,6 +432,8 @@ class SuccessHandlers(DefaultChildrenMixin, Bucket):
 
         return issubclass(cls, FormSuccessHandler)
 
+    static_valid_child_of = True
+
     @classmethod
     def valid_child_of(cls, parent, obj=None):
         return isinstance(parent, FormMeta)
@@ -419,6 +449,8 @@ class FormBody(DefaultChildrenMixin, Bucket):
         verbose_name = _('fields')
         verbose_name_plural = _('fields')
 
+    static_valid_child_of = True
+
     @classmethod
     def valid_child_of(cls, parent, obj=None):
         return isinstance(parent, Form)
@@ -435,6 +467,8 @@ class FormMeta(StrictDefaultChildrenMixin, Bucket):
         verbose_name = _('settings')
         verbose_name_plural = _('settings')
 
+    static_valid_child_of = True
+
     @classmethod
     def valid_child_of(cls, parent, obj=None):
         return isinstance(parent, Form)
@@ -455,6 +489,12 @@ def friendly_uuid(uuid):
     return profanity_filter
 
 
+# What a form class built by Form.build_form_class knows about each of its
+# FormField widgets. It doesn't keep the widgets themselves, the classes are
+# cached and shared by requests.
+FormFieldInfo = namedtuple('FormFieldInfo', 'name label ident node_pk')
+
+
 @widgy.register
 @python_2_unicode_compatible
 class Form(TabbedContainer, StrDisplayNameMixin, StrictDefaultChildrenMixin, Content):
@@ -467,6 +507,8 @@ class Form(TabbedContainer, StrDisplayNameMixin, StrictDefaultChildrenMixin, Con
     ident = models.UUIDField(default=uuid.uuid4, editable=False)
 
     editable = True
+    # Forms render CSRF tokens and bound data from the request.
+    cacheable = False
 
     default_children = [
         ('fields', FormBody, (), {}),
@@ -502,19 +544,57 @@ class Form(TabbedContainer, StrDisplayNameMixin, StrictDefaultChildrenMixin, Con
 
     def build_form_class(self):
         """
-        Returns a django.forms.Form class based on my child widgets.
+        Returns a django.forms.Form class based on my child widgets. Use
+        :meth:`get_form_class` to get a cached one.
         """
+        children = self.get_descendants_of_type(BaseFormField)
         fields = OrderedDict(
             (child.get_formfield_name(), child.get_formfield())
-            for child in self.depth_first_order() if isinstance(child, BaseFormField)
+            for child in children
         )
 
         mixins = []
-        for child in self.depth_first_order():
+        for child in self.iter_depth_first():
             if hasattr(child, 'get_form_mixins'):
                 mixins.extend(child.get_form_mixins())
 
-        return type(str('WidgyForm'), tuple(mixins + [forms.BaseForm]), {'base_fields': fields})
+        return type(str('WidgyForm'), tuple(mixins + [forms.BaseForm]), {
+            'base_fields': fields,
+            'widgy_fields': OrderedDict(
+                (child.get_formfield_name(), FormFieldInfo(
+                    name=child.get_formfield_name(),
+                    label=child.label,
+                    ident=child.ident,
+                    node_pk=child.node.pk,
+                ))
+                for child in children if isinstance(child, FormField)
+            ),
+        })
+
+    @property
+    def form_class_cache_key(self):
+        """
+        Identifies the form class that :meth:`build_form_class` returns. A
+        frozen form can't change, so its node is enough. For a working copy,
+        the digest of its tree changes with any of its widgets, and the
+        formfield names are the pks of the field nodes. None if the digest
+        is out of date.
+        """
+        node = self.node
+        if node.is_frozen:
+            return node.pk
+        if node.digest:
+            return (node.pk, node.digest, tuple(
+                i.node.pk for i in self.get_descendants_of_type(BaseFormField)
+            ))
+        return None
+
+    def get_form_class(self):
+        """
+        :meth:`build_form_class`, cached in the process by
+        :attr:`form_class_cache_key`.
+        """
+        return form_class_cache.get(self.form_class_cache_key, self.build_form_class)
 
     @property
     def context_var(self):
@@ -546,7 +626,7 @@ class Form(TabbedContainer, StrDisplayNameMixin, StrictDefaultChildrenMixin, Con
             # the existing instance back to us in the context
             form = context[self.context_var]
         else:
-            form = self.build_form_class()()
+            form = self.get_form_class()()
 
         request = context.get('request')
         action_url = build_url(
@@ -570,11 +650,18 @@ class Form(TabbedContainer, StrDisplayNameMixin, StrictDefaultChildrenMixin, Con
             request.GET['from'],
             success=self.success_key,
         ))
-        for child in self.depth_first_order():
+        jobs = []
+        for child in self.get_descendants_of_type((FormReponseHandler, FormSuccessHandler)):
             if isinstance(child, FormReponseHandler):
                 resp = child.execute(request, form)
             elif isinstance(child, FormSuccessHandler):
-                child.execute(request, form)
+                child_jobs = child.get_jobs(request, form)
+                if child_jobs is None:
+                    child.execute(request, form)
+                else:
+                    jobs.extend(child_jobs)
+        if jobs:
+            get_handler_backend().enqueue(jobs)
         return resp
 
     def make_root(self):
@@ -594,9 +681,8 @@ class Form(TabbedContainer, StrDisplayNameMixin, StrictDefaultChildrenMixin, Con
         A dictionary of formfield name -> FormField widget
         """
         ret = OrderedDict()
-        for child in self.depth_first_order():
-            if isinstance(child, FormField):
-                ret[child.get_formfield_name()] = child
+        for child in self.get_descendants_of_type(FormField):
+            ret[child.get_formfield_name()] = child
         return ret
 
     @property
@@ -604,9 +690,7 @@ class Form(TabbedContainer, StrDisplayNameMixin, StrictDefaultChildrenMixin, Con
         """
         All submissions of this logical (not just this version) form.
         """
-        return FormSubmission.objects.filter(
-            form_ident=self.ident
-        ).prefetch_related('values')
+        return FormSubmission.objects.for_form(self.ident).prefetch_related('values')
 
     @property
     def submission_count(self):
@@ -637,6 +721,7 @@ class Form(TabbedContainer, StrDisplayNameMixin, StrictDefaultChildrenMixin, Con
 
 class BaseFormField(FormElement):
     formfield_class = None
+    cacheable = False
 
     class Meta:
         abstract = True
@@ -895,12 +980,15 @@ class Uncaptcha(BaseFormField):
         # since validating an uncaptcha widget requires access to the
         # csrfmiddlewaretoken and not just our field value, create a
         # form mixin with a clean_uncaptcha method to do the validation.
+        # The form class is cached, so only close over the name.
+        name = self.get_formfield_name()
+
         def clean(form):
-            value = form.cleaned_data[self.get_formfield_name()]
+            value = form.cleaned_data[name]
             if value != form.data.get('csrfmiddlewaretoken'):
                 raise forms.ValidationError(_('Incorrect Uncaptcha value'))
         UncaptchaMixin = type(str('UncaptchaMixin'), (object,), {
-            'clean_%s' % self.get_formfield_name(): clean
+            'clean_%s' % name: clean
         })
         return [UncaptchaMixin]
 
@@ -911,7 +999,7 @@ class Uncaptcha(BaseFormField):
             return False
         if obj in parent.depth_first_order():
             return True
-        if [i for i in parent.depth_first_order() if isinstance(i, cls)]:
+        if next(parent.iter_depth_first(cls), None) is not None:
             return False
         else:
             return super(Uncaptcha, cls).valid_child_of(parent, obj)
@@ -955,6 +1043,84 @@ class ImageUpload(FileUpload):
         proxy = True
 
 
+# How many submissions FormSubmissionQuerySet.iter_dictionaries fetches at a
+# time.
+EXPORT_CHUNK_SIZE = 1000
+
+
+def get_labels_cache():
+    """
+    The cache for the field labels of forms' submissions. It is the cache
+    alias in the WIDGY_FORM_LABELS_CACHE setting, there is none unless it is
+    set. The labels are forgotten by the process that saves a submission,
+    so the cache has to be shared by all of them.
+    """
+    alias = getattr(settings, 'WIDGY_FORM_LABELS_CACHE', None)
+    return alias and caches[alias]
+
+
+def labels_cache_key(form_ident):
+    return 'widgy_form_builder.labels.%s' % form_ident
+
+
+# How many form classes form_class_cache keeps if the
+# WIDGY_FORM_CLASS_CACHE_SIZE setting isn't set.
+FORM_CLASS_CACHE_SIZE = 100
+
+
+class FormClassCache(object):
+    """
+    A least recently used cache of the form classes of forms, by
+    :attr:`Form.form_class_cache_key`. It keeps up to
+    WIDGY_FORM_CLASS_CACHE_SIZE classes, 0 disables it. The classes are shared
+    by requests (and threads), so they only keep plain metadata about the
+    fields in ``widgy_fields``, never the widgets.
+    """
+    def __init__(self):
+        self.classes = OrderedDict()
+        self.lock = threading.Lock()
+
+    @property
+    def maxsize(self):
+        return getattr(settings, 'WIDGY_FORM_CLASS_CACHE_SIZE', FORM_CLASS_CACHE_SIZE)
+
+    def get(self, key, build):
+        """
+        The class for `key`, calling `build` to make it if it isn't cached.
+        """
+        maxsize = self.maxsize
+        if key is None or not maxsize:
+            return build()
+        with self.lock:
+            if key in self.classes:
+                # move it to the end, as the most recently used
+                form_class = self.classes[key] = self.classes.pop(key)
+                return form_class
+
+        form_class = build()
+        with self.lock:
+            self.classes[key] = form_class
+            while len(self.classes) > maxsize:
+                self.classes.popitem(last=False)
+        return form_class
+
+    def clear(self):
+        with self.lock:
+            self.classes.clear()
+
+
+form_class_cache = FormClassCache()
+
+
+class EchoBuffer(object):
+    """
+    A file-like object that returns what is written to it, so csv.writer
+    can be used to make lines one at a time.
+    """
+    def write(self, value):
+        return value
+
+
 class FormSubmission(models.Model):
     """
     Holds the data from one submission of a Form.
@@ -965,27 +1131,69 @@ class FormSubmission(models.Model):
     form_ident = models.UUIDField()
 
     class FormSubmissionQuerySet(QuerySet):
+        # Set by for_form, and only kept until the queryset is filtered
+        # again, see get_formfield_labels.
+        _form_ident = None
+
+        def _clone(self, *args, **kwargs):
+            clone = super(FormSubmission.FormSubmissionQuerySet, self)._clone(*args, **kwargs)
+            clone._form_ident = self._form_ident
+            return clone
+
+        def _filter_or_exclude(self, *args, **kwargs):
+            clone = super(FormSubmission.FormSubmissionQuerySet, self)._filter_or_exclude(*args, **kwargs)
+            clone._form_ident = None
+            return clone
+
+        def for_form(self, form_ident):
+            """
+            The submissions of the form whose ident is `form_ident`. The
+            field labels of all of a form's submissions can be cached until
+            one is added or deleted, see :func:`get_labels_cache`.
+            """
+            clone = self.filter(form_ident=form_ident)
+            clone._form_ident = form_ident
+            return clone
+
         def get_formfield_labels(self):
             """
             A dictionary of field uuid to field label. We use the label of the
             field that was used by the most recent submission. Note that this
             means only fields that have been submitted will show up here.
             """
-
-            uuids = FormValue.objects.filter(
-                submission__in=self,
-            ).values('field_ident').distinct().order_by('field_node__path').values_list('field_ident', flat=True)
+            cache = get_labels_cache()
+            key = self._form_ident and labels_cache_key(self._form_ident)
+            labels = cache and key and cache.get(key)
+            if labels is None:
+                labels = self._get_formfield_labels()
+                if cache and key:
+                    cache.set(key, labels)
 
             ret = OrderedDict([
                 ('created_at', ugettext('Created at')),
             ])
-            for field_uuid in uuids:
-                latest_value = FormValue.objects.filter(
-                    field_ident=field_uuid,
-                ).order_by('-submission__created_at', '-pk').select_related('field_node')[0]
-                ret[field_uuid] = latest_value.get_label()
+            ret.update(labels)
             return ret
 
+        def _get_formfield_labels(self):
+            # The idents and the latest value of each field in one query,
+            # ordered by the first place the field appeared in a form.
+            fields = FormValue.objects.filter(
+                submission__in=self,
+            ).order_by().values('field_ident').annotate(
+                latest_pk=Max('pk'),
+                path=Min('field_node__path'),
+            ).order_by('path', 'latest_pk')
+            fields = [(i['field_ident'], i['latest_pk']) for i in fields]
+            latest_values = FormValue.objects.select_related('field_node').in_bulk(
+                [pk for _, pk in fields])
+            # the contents of the fields, one query per content type
+            Node.attach_content_instances(
+                [i.field_node for i in latest_values.values() if i.field_node])
+
+            return [(field_uuid, force_text(latest_values[latest_pk].get_label()))
+                    for field_uuid, latest_pk in fields]
+
         def as_dictionaries(self):
             return (i.as_dict() for i in self.all())
 
@@ -994,15 +1202,58 @@ class FormSubmission(models.Model):
                 yield OrderedDict((ident, submission.get(ident, ''))
                                   for ident in order)
 
-        def to_csv(self, output):
+        def iter_dictionaries(self, chunk_size=EXPORT_CHUNK_SIZE):
             """
-            Write out our submissions as csv to output, a file-like object.
+            Like :meth:`as_dictionaries`, newest first, but the submissions
+            and their values are fetched `chunk_size` submissions at a time.
+            Each chunk starts after the last submission of the previous one
+            instead of at an offset, so every chunk is as fast as the first
+            and the whole queryset is never in memory.
             """
-
-            values = self.as_dictionaries()
-            headers = self.get_formfield_labels()
-
-            writer = csv.DictWriter(output, list(headers))
+            qs = self.prefetch_related(None).order_by('-created_at', '-pk')
+            last = None
+            while True:
+                chunk = qs
+                if last is not None:
+                    last_pk, last_created_at = last
+                    chunk = chunk.filter(
+                        Q(created_at__lt=last_created_at) |
+                        Q(created_at=last_created_at, pk__lt=last_pk)
+                    )
+                rows = list(chunk.values_list('pk', 'created_at')[:chunk_size])
+                if not rows:
+                    return
+
+                values = defaultdict(dict)
+                for submission_id, field_ident, value in FormValue.objects.filter(
+                        submission__in=[pk for pk, _ in rows]).values_list(
+                            'submission_id', 'field_ident', 'value'):
+                    values[submission_id][field_ident] = value
+                for pk, created_at in rows:
+                    ret = values.pop(pk, {})
+                    ret['created_at'] = created_at
+                    yield ret
+
+                if len(rows) < chunk_size:
+                    return
+                last = rows[-1]
+
+        def iter_csv(self, chunk_size=EXPORT_CHUNK_SIZE):
+            """
+            Yields our submissions as csv, one line at a time, for a
+            StreamingHttpResponse.
+            """
+            # The header is made from the submissions that are exported, not
+            # from the cached labels of the form, which can be missing the
+            # fields of a newer submission. Submissions added after that
+            # aren't exported, so every value has a column.
+            last_pk = self.aggregate(last_pk=Max('pk'))['last_pk']
+            if last_pk is None:
+                submissions = self.none()
+            else:
+                submissions = self.filter(pk__lte=last_pk)
+            headers = submissions.get_formfield_labels()
+            writer = csv.DictWriter(EchoBuffer(), list(headers))
 
             # python2 csv expects bytes, but python3's works in unicode
             if six.PY2:
@@ -1014,25 +1265,41 @@ class FormSubmission(models.Model):
                 def encode(d):
                     return d
 
-            writer.writerow(encode(headers))
+            yield writer.writerow(encode(headers))
+            for row in submissions.iter_dictionaries(chunk_size):
+                yield writer.writerow(encode(row))
 
-            for row in values:
-                writer.writerow(encode(row))
+        def to_csv(self, output):
+            """
+            Write out our submissions as csv to output, a file-like object.
+            """
+            for line in self.iter_csv():
+                output.write(line)
 
-        def submit(self, form, data):
+        @transaction.atomic
+        def submit(self, form, data, fields=None):
+            """
+            Saves a submission of `form` with the cleaned `data`. `fields`
+            is the result of ``form.get_fields()``, the widgets of this
+            request's tree.
+            """
+            if fields is None:
+                fields = form.get_fields()
             submission = self.create(
                 form_node=form.node,
                 form_ident=form.ident,
             )
 
-            for name, field in form.get_fields().items():
-                value = field.serialize_value(data[name])
-                submission.values.create(
+            FormValue.objects.bulk_create([
+                FormValue(
+                    submission=submission,
                     field_node=field.node,
                     field_name=field.label,
                     field_ident=field.ident,
-                    value=value,
+                    value=field.serialize_value(data[name]),
                 )
+                for name, field in fields.items()
+            ])
             return submission
 
     objects = FormSubmissionQuerySet.as_manager()
@@ -1073,10 +1340,71 @@ class FormValue(models.Model):
             return self.field_name
 
 
+class HandlerJob(models.Model):
+    """
+    A success handler job waiting to be run, see
+    :class:`widgy.contrib.form_builder.handlers.OutboxBackend`.
+    """
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    run_after = models.DateTimeField(default=timezone.now, db_index=True)
+
+    # the dotted path of the Job class, and its payload as JSON
+    kind = models.CharField(max_length=255)
+    payload = models.TextField()
+
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    # set when the job has failed too many times to be retried
+    failed = models.BooleanField(default=False)
+
+    class HandlerJobQuerySet(QuerySet):
+        def due(self, now=None):
+            return self.filter(failed=False, run_after__lte=now or timezone.now())
+
+    objects = HandlerJobQuerySet.as_manager()
+
+    @classmethod
+    def from_job(cls, job):
+        kind, payload = job.dump()
+        return cls(kind=kind, payload=payload)
+
+    def get_job(self):
+        return Job.load(self.kind, self.payload)
+
+
+def forget_form_labels(form_ident):
+    cache = get_labels_cache()
+    if cache:
+        key = labels_cache_key(form_ident)
+        cache.delete(key)
+        # in case the labels were cached again before the change was
+        # committed
+        transaction.on_commit(lambda: cache.delete(key))
+
+
+@receiver(models.signals.post_save, sender=FormSubmission)
+def forget_formfield_labels(sender, instance, created, raw, **kwargs):
+    """
+    A new submission can add fields or change their labels.
+    """
+    if created:
+        forget_form_labels(instance.form_ident)
+
+
+@receiver(models.signals.post_delete, sender=FormSubmission)
+def forget_deleted_formfield_labels(sender, instance, **kwargs):
+    """
+    Without a submission, its fields can disappear or go back to an older
+    label. Queryset deletes send this for every submission too.
+    """
+    forget_form_labels(instance.form_ident)
+
+
 @receiver(pre_delete_widget, sender=FormInput)
 def protect_emailuserhandler_to_ident_field(sender, instance, raw, **kwargs):
     from django.db.models import ProtectedError
 
-    for child in instance.parent_form.depth_first_order():
-        if isinstance(child, EmailUserHandler) and child.to_ident == instance.ident:
+    for child in instance.parent_form.iter_depth_first(EmailUserHandler):
+        if child.to_ident == instance.ident:
             raise ProtectedError("This cannot be deleted because it is being referenced by a %s." % (child.display_name,), [child])
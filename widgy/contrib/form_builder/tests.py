@@ -1,38 +1,70 @@
 from __future__ import unicode_literals
 
 import contextlib
+import datetime
+import gc
+import threading
 import unittest
 import uuid
+import weakref
 import os.path
 
 from six.moves import StringIO
+from six.moves.BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
 
 from django.test import TestCase, override_settings
 from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext
 from django import forms
 from django.utils import timezone
 from django.utils.encoding import force_text
 from django.core import mail
+from django.core.mail.backends import locmem
 from django.db import connection
 from django.core.files.base import ContentFile
 from django.core.files.uploadedfile import TemporaryUploadedFile
 from django.conf import settings
+from django.core.management import call_command, CommandError
 
 import mock
 
 from widgy.contrib.form_builder.forms import PhoneNumberField
+from widgy.contrib.form_builder.handlers import (
+    EmailJob, PostJob, Job, ThreadPoolBackend, OutboxBackend, get_handler_backend
+)
 from widgy.contrib.form_builder.models import (
     Form, FormInput, Textarea, FormSubmission, FormField, Uncaptcha,
-    EmailUserHandler, EmailSuccessHandler, FileUpload, friendly_uuid
+    EmailUserHandler, EmailSuccessHandler, FileUpload, SaveDataHandler, friendly_uuid,
+    HandlerJob, WebToLeadMapperHandler, form_class_cache, FormFieldInfo,
 )
 from widgy.exceptions import ParentChildRejection
 from widgy.utils import build_url
-from widgy.models import VersionTracker
+from widgy.models import Node, VersionTracker
 from widgy.site import WidgySite
 
 widgy_site = WidgySite()
 
 
+class TestDefaultChildren(TestCase):
+    def test_subtree(self):
+        form = Form.add_root(widgy_site)
+        self.assertEqual([type(i).__name__ for i in form.depth_first_order()], [
+            'Form', 'FormBody', 'SubmitButton', 'FormMeta', 'SuccessMessageBucket',
+            'Html', 'SuccessHandlers', 'SaveDataHandler',
+        ])
+        self.assertEqual(form.children['meta'].children['message'].get_children()[0].content,
+                         'Thank you.')
+        self.assertFalse(any(Node.find_problems()))
+
+    def test_fewer_queries(self):
+        Form.add_root(widgy_site)
+        with CaptureQueriesContext(connection) as queries:
+            Form.add_root(widgy_site)
+        # It used to take over a hundred. There are less when the database
+        # can insert the contents of each class at once.
+        self.assertLessEqual(len(queries), 26)
+
+
 class GetFormTest(TestCase):
     def setUp(self):
         self.form = Form.add_root(widgy_site)
@@ -114,6 +146,23 @@ class TestForm(TestCase):
     def setUp(self):
         self.form, self.fields = self.make_form()
 
+    def test_prefetched_tree_is_walked_once(self):
+        node = Node.objects.get(pk=self.form.node.pk)
+        node.prefetch_tree()
+        form = node.content
+
+        with self.assertNumQueries(0):
+            form_class = form.build_form_class()
+            fields = form.get_fields()
+        self.assertEqual(list(form_class.base_fields), list(fields))
+        self.assertEqual(list(fields.values()), self.fields)
+
+        with mock.patch.object(Node, 'iter_depth_first') as iter_depth_first:
+            form.get_fields()
+            form.build_form_class().base_fields
+        # only for the mixins, the fields are remembered
+        self.assertEqual(iter_depth_first.call_count, 1)
+
     def test_friendly_uuid_python2_python3_plays_nice(self):
         """
         Regression test for friendly UUID.
@@ -159,6 +208,31 @@ class TestForm(TestCase):
         }
         self.assertEqual(expected, submission.as_dict())
 
+    def test_submit_queries(self):
+        fields = self.form.get_fields()
+        data = dict((name, 'x') for name in fields)
+
+        with CaptureQueriesContext(connection) as queries:
+            submission = FormSubmission.objects.submit(self.form, data, fields)
+        inserts = [i for i in queries.captured_queries if i['sql'].startswith('INSERT')]
+        # the submission and all of its values
+        self.assertEqual(len(inserts), 2)
+        self.assertEqual(submission.as_dict(), dict(
+            [('created_at', submission.created_at)] +
+            [(i.ident, 'x') for i in self.fields]
+        ))
+
+    def test_save_data_handler(self):
+        handler = [i for i in self.form.depth_first_order() if isinstance(i, SaveDataHandler)][0]
+        form_obj = self.form.get_form_class()(dict(
+            (i.get_formfield_name(), 'x') for i in self.fields))
+        self.assertTrue(form_obj.is_valid())
+        handler.execute(None, form_obj)
+        self.assertEqual(self.form.submissions.get().as_dict(), dict(
+            [('created_at', self.form.submissions.get().created_at)] +
+            [(i.ident, 'x') for i in self.fields]
+        ))
+
     def test_field_names(self):
         self.submit('a', 'b', 'c')
         field_names = FormSubmission.objects.get_formfield_labels()
@@ -327,6 +401,115 @@ class TestForm(TestCase):
             "%s,\N{SNOWMAN},2,3\r\n" % (now,))
         )
 
+    def test_iter_dictionaries(self):
+        # some submissions at the same time, at the edges of the chunks
+        with mock_now() as now:
+            self.submit('a', 'b', 'c')
+            self.submit('d', 'e', 'f')
+        with mock.patch('django.utils.timezone.now', return_value=now + datetime.timedelta(seconds=1)):
+            for i in range(3):
+                self.submit(str(i), '', '')
+
+        expected = [i.as_dict() for i in self.form.submissions.order_by('-created_at', '-pk')]
+        # 3 chunks of submissions and their values
+        with self.assertNumQueries(6):
+            self.assertEqual(list(self.form.submissions.iter_dictionaries(chunk_size=2)), expected)
+        self.assertEqual(list(self.form.submissions.iter_dictionaries()), expected)
+
+    def test_iter_csv(self):
+        self.submit('a', 'b', 'c')
+        self.submit('1', '2', '3')
+
+        csv_output = StringIO()
+        self.form.submissions.to_csv(csv_output)
+        self.assertEqual(''.join(force_text(i) for i in self.form.submissions.iter_csv(chunk_size=1)),
+                         force_text(csv_output.getvalue()))
+        self.assertEqual(len(csv_output.getvalue().splitlines()), 3)
+
+    @override_settings(WIDGY_FORM_LABELS_CACHE='default')
+    def test_iter_csv_uses_exported_fields(self):
+        self.submit('a', 'b', 'c')
+        self.form.submissions.get_formfield_labels()
+        # the cached labels are behind
+        self.form.children['fields'].add_child(widgy_site, FormInput, label='field 4', type='text')
+        fields = self.form.get_fields()
+        with mock.patch('widgy.contrib.form_builder.models.forget_form_labels'):
+            FormSubmission.objects.submit(form=self.form, data=dict(
+                (name, 'x') for name in fields))
+        self.assertEqual(len(self.form.submissions.get_formfield_labels()), 4)
+
+        lines = [force_text(i) for i in self.form.submissions.iter_csv()]
+        self.assertEqual(lines[0], "Created at,field 1,field 2,field 3,field 4\r\n")
+        self.assertTrue(lines[1].endswith(",x,x,x,x\r\n"))
+
+    @override_settings(WIDGY_FORM_LABELS_CACHE='default')
+    def test_formfield_labels_queries(self):
+        for i in range(3):
+            self.submit('a', 'b', 'c')
+        # - the fields and their latest values
+        # - FormInput and Textarea contents
+        with self.assertNumQueries(4):
+            labels = self.form.submissions.get_formfield_labels()
+        self.assertEqual(list(labels.values()), ['Created at', 'field 1', 'field 2', 'field 3'])
+
+        # cached for the form
+        with self.assertNumQueries(0):
+            self.assertEqual(self.form.submissions.get_formfield_labels(), labels)
+        # but not for other querysets
+        with self.assertNumQueries(4):
+            self.assertEqual(self.form.submissions.filter(pk__gt=0).get_formfield_labels(), labels)
+        with self.assertNumQueries(4):
+            FormSubmission.objects.get_formfield_labels()
+
+    @override_settings(WIDGY_FORM_LABELS_CACHE='default')
+    def test_formfield_labels_new_submission(self):
+        self.submit('a', 'b', 'c')
+        self.form.submissions.get_formfield_labels()
+
+        new_field = self.form.children['fields'].add_child(widgy_site, FormInput,
+                                                           label='field 4', type='text')
+        fields = self.form.get_fields()
+        FormSubmission.objects.submit(form=self.form, data=dict(
+            (name, 'x') for name in fields))
+        self.assertEqual(list(self.form.submissions.get_formfield_labels().values()),
+                         ['Created at', 'field 1', 'field 2', 'field 3', 'field 4'])
+        self.assertIn(new_field.ident, self.form.submissions.get_formfield_labels())
+
+    @override_settings(WIDGY_FORM_LABELS_CACHE='default')
+    def test_formfield_labels_deleted_submission(self):
+        self.submit('a', 'b', 'c')
+        self.form.children['fields'].add_child(widgy_site, FormInput, label='field 4', type='text')
+        fields = self.form.get_fields()
+
+        def submit_and_delete(delete):
+            submission = FormSubmission.objects.submit(form=self.form, data=dict(
+                (name, 'x') for name in fields))
+            self.assertEqual(len(self.form.submissions.get_formfield_labels()), 5)
+            delete(submission)
+            self.assertEqual(list(self.form.submissions.get_formfield_labels().values()),
+                             ['Created at', 'field 1', 'field 2', 'field 3'])
+
+        submit_and_delete(lambda submission: submission.delete())
+        submit_and_delete(lambda submission: FormSubmission.objects.filter(pk=submission.pk).delete())
+
+    def test_formfield_labels_not_cached_by_default(self):
+        self.submit('a', 'b', 'c')
+        self.form.submissions.get_formfield_labels()
+        with self.assertNumQueries(4):
+            self.form.submissions.get_formfield_labels()
+
+    def test_export_command(self):
+        self.submit('a', 'b', 'c')
+
+        csv_output = StringIO()
+        self.form.submissions.to_csv(csv_output)
+        out = StringIO()
+        call_command('export_form_submissions', str(self.form.ident), stdout=out)
+        self.assertEqual(force_text(out.getvalue()), force_text(csv_output.getvalue()))
+
+        with self.assertRaises(CommandError):
+            call_command('export_form_submissions', 'not-a-uuid', stdout=out)
+
     def test_clone_new_page(self):
         self.submit('a', 'b', 'c')
         new_form = self.form.node.clone_tree(freeze=False, new_page=True).content
@@ -419,6 +602,243 @@ class TestFormHandler(TestCase):
         self.assertEqual(email_handler2.to_ident, self.to_field.ident)
 
 
+class ConnectionCountingBackend(locmem.EmailBackend):
+    opened = 0
+
+    def open(self):
+        ConnectionCountingBackend.opened += 1
+        return super(ConnectionCountingBackend, self).open()
+
+
+@contextlib.contextmanager
+def http_server(statuses):
+    """
+    Runs a local HTTP server that answers POSTs with `statuses`, one after
+    the other, the last one for the rest. Yields its url and the list of the
+    bodies it got.
+    """
+    bodies = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            bodies.append(self.rfile.read(int(self.headers['Content-Length'])))
+            self.send_response(statuses.pop(0) if len(statuses) > 1 else statuses[0])
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        yield 'http://127.0.0.1:%d/' % server.server_port, bodies
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@override_settings(EMAIL_BACKEND='widgy.contrib.form_builder.tests.ConnectionCountingBackend')
+class TestHandlerBackends(TestCase):
+    def setUp(self):
+        self.form = form = Form.add_root(widgy_site)
+        to_field = form.children['fields'].add_child(widgy_site, FormInput, type='email', label='email')
+        handlers = form.children['meta'].children['handlers']
+        handlers.add_child(widgy_site, EmailUserHandler, to_ident=to_field.ident, subject='thanks')
+        handlers.add_child(widgy_site, EmailSuccessHandler, to='admin@example.com', subject='new')
+
+        self.request = RequestFactory().post(build_url('/', **{'from': '/'}), {
+            to_field.get_formfield_name(): 'user@example.com',
+        })
+        self.form_obj = form.build_form_class()(self.request.POST)
+        assert self.form_obj.is_valid()
+        ConnectionCountingBackend.opened = 0
+
+    def execute(self):
+        resp = self.form.execute(self.request, self.form_obj)
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(FormSubmission.objects.count(), 1)
+
+    def assertMailSent(self):
+        self.assertEqual(sorted(i.to for i in mail.outbox), [['admin@example.com'], ['user@example.com']])
+        self.assertEqual(ConnectionCountingBackend.opened, 1)
+
+    def test_synchronous_backend(self):
+        self.execute()
+        self.assertMailSent()
+
+    @override_settings(WIDGY_FORM_HANDLER_BACKEND='widgy.contrib.form_builder.handlers.ThreadPoolBackend')
+    def test_thread_pool_backend(self):
+        with mock.patch.object(ThreadPoolBackend, 'start'):
+            # nothing runs until the threads are started
+            self.execute()
+            self.assertEqual(mail.outbox, [])
+        backend = get_handler_backend()
+        backend.start()
+        backend.join()
+        self.assertMailSent()
+
+    def test_thread_pool_backend_retries(self):
+        backend = ThreadPoolBackend()
+        backend.retry_delay = 0
+        with http_server([500, 500, 200]) as (url, bodies):
+            backend.enqueue([PostJob(url, 'a=1')])
+            backend.join()
+        self.assertEqual(bodies, [b'a=1'] * 3)
+
+    @override_settings(WIDGY_FORM_HANDLER_BACKEND='widgy.contrib.form_builder.handlers.OutboxBackend')
+    def test_outbox_backend(self):
+        self.execute()
+        self.assertEqual(mail.outbox, [])
+        self.assertEqual(HandlerJob.objects.count(), 2)
+
+        out = StringIO()
+        call_command('process_form_handler_jobs', stdout=out)
+        self.assertEqual(out.getvalue(), 'Ran 2 jobs, 0 failed\n')
+        self.assertMailSent()
+        self.assertFalse(HandlerJob.objects.exists())
+
+    def test_outbox_backend_retries(self):
+        backend = OutboxBackend()
+        backend.max_attempts = 2
+        with http_server([500]) as (url, bodies):
+            backend.enqueue([PostJob(url, 'a=1')])
+            self.assertEqual(backend.process(), (1, 1))
+            job = HandlerJob.objects.get()
+            self.assertEqual(job.attempts, 1)
+            self.assertIn('500', job.last_error)
+            self.assertGreater(job.run_after, timezone.now())
+            # not due yet
+            self.assertEqual(backend.process(), (0, 0))
+
+            HandlerJob.objects.update(run_after=timezone.now())
+            self.assertEqual(backend.process(), (1, 1))
+            self.assertTrue(HandlerJob.objects.get().failed)
+            HandlerJob.objects.update(run_after=timezone.now())
+            self.assertEqual(backend.process(), (0, 0))
+        self.assertEqual(len(bodies), 2)
+
+    def test_outbox_backend_claims_jobs(self):
+        backend = OutboxBackend()
+        other_worker = []
+
+        savepoints = len(connection.savepoint_ids)
+
+        def run(job, mail_connection=None):
+            # the job is claimed, and no transaction is open while it runs
+            self.assertEqual(HandlerJob.objects.get().attempts, 1)
+            self.assertEqual(len(connection.savepoint_ids), savepoints)
+            other_worker.append(backend.process())
+
+        backend.enqueue([PostJob('http://example.com/', 'a=1')])
+        with mock.patch.object(PostJob, 'run', autospec=True, side_effect=run):
+            self.assertEqual(backend.process(), (1, 0))
+        self.assertEqual(other_worker, [(0, 0)])
+        self.assertFalse(HandlerJob.objects.exists())
+
+    def test_post_job_timeout(self):
+        with mock.patch('six.moves.urllib.request.urlopen') as urlopen:
+            PostJob('http://example.com/', 'a=1').run()
+        urlopen.assert_called_once_with('http://example.com/', b'a=1', PostJob.timeout)
+
+    def test_email_job_payload(self):
+        msg = self.form.children['meta'].children['handlers'].get_children()[2].get_message(
+            self.request, self.form_obj)
+        msg.attach('a.bin', b'\x00\xff', 'application/octet-stream')
+        msg.attach('a.txt', 'text', 'text/plain')
+
+        loaded = Job.load(*EmailJob(msg).dump()).message
+        for attr in ('subject', 'body', 'from_email', 'to', 'alternatives', 'attachments'):
+            self.assertEqual(getattr(loaded, attr), getattr(msg, attr))
+
+    def test_repost_handler(self):
+        handler = self.form.children['meta'].children['handlers'].add_child(
+            widgy_site, WebToLeadMapperHandler, oid='abc')
+        job, = handler.get_jobs(self.request, self.form_obj)
+        self.assertEqual(job.url, WebToLeadMapperHandler.url_to_post)
+        self.assertEqual(job.data, 'oid=abc')
+
+        with http_server([200]) as (url, bodies):
+            handler.url_to_post = url
+            handler.execute(self.request, self.form_obj)
+        self.assertEqual(bodies, [b'oid=abc'])
+
+
+class TestFormClassCache(TestCase):
+    def setUp(self):
+        form_class_cache.clear()
+        self.form = Form.add_root(widgy_site)
+        self.field = self.form.children['fields'].add_child(widgy_site, FormInput, label='a')
+        self.form.node.refresh_digests()
+
+    def get_form(self, node=None):
+        node = Node.objects.get(pk=(node or self.form.node).pk)
+        node.prefetch_tree()
+        return node.content
+
+    def test_frozen(self):
+        tracker = VersionTracker.objects.create(working_copy=self.form.node)
+        root_node = tracker.commit().root_node
+        form_class = self.get_form(root_node).get_form_class()
+
+        with mock.patch.object(Form, 'build_form_class') as build_form_class:
+            self.assertIs(self.get_form(root_node).get_form_class(), form_class)
+        self.assertFalse(build_form_class.called)
+
+    def test_working_copy(self):
+        form_class = self.get_form().get_form_class()
+        self.assertIs(self.get_form().get_form_class(), form_class)
+
+        self.field.label = 'b'
+        self.field.save()
+        new_form_class = self.get_form().get_form_class()
+        self.assertEqual(new_form_class.base_fields[self.field.get_formfield_name()].label, 'b')
+        self.assertIs(self.get_form().get_form_class(), new_form_class)
+
+    def test_stale_digest(self):
+        self.form.node.invalidate_digests()
+        form = self.get_form()
+        self.assertIsNone(form.form_class_cache_key)
+        self.assertIsNot(form.get_form_class(), form.get_form_class())
+
+    def test_eviction(self):
+        other = Form.add_root(widgy_site)
+        other.node.refresh_digests()
+        with override_settings(WIDGY_FORM_CLASS_CACHE_SIZE=1):
+            form_class = self.get_form().get_form_class()
+            self.get_form(other.node).get_form_class()
+            self.assertIsNot(self.get_form().get_form_class(), form_class)
+
+        with override_settings(WIDGY_FORM_CLASS_CACHE_SIZE=0):
+            self.assertIsNot(self.get_form().get_form_class(), self.get_form().get_form_class())
+
+    def test_doesnt_keep_widgets(self):
+        fields = self.form.children['fields']
+        fields.add_child(widgy_site, Uncaptcha)
+        self.form.node.refresh_digests()
+        form = self.get_form()
+        form_ref = weakref.ref(form)
+        form_class = form.get_form_class()
+        del form
+        gc.collect()
+        self.assertIsNone(form_ref())
+
+        name = self.field.get_formfield_name()
+        self.assertEqual(form_class.widgy_fields[name], FormFieldInfo(
+            name=name,
+            label=self.field.label,
+            ident=self.field.ident,
+            node_pk=self.field.node.pk,
+        ))
+
+    def test_submit(self):
+        form = self.get_form()
+        form.get_form_class()
+        FormSubmission.objects.submit(form, {self.field.get_formfield_name(): 'x'})
+        self.assertEqual(form.submissions.get().as_dict()[self.field.ident], 'x')
+
+
 class TestFormCompatibility(TestCase):
     @unittest.expectedFailure
     def test_uncaptcha_compatibility(self):
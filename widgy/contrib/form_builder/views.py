@@ -28,7 +28,7 @@ class HandleFormMixin(FormMixin):
 
     def get_form_class(self):
         self.form_node = self.get_form_node()
-        return self.form_node.content.build_form_class()
+        return self.form_node.content.get_form_class()
 
     def get_form(self, form_class=None):
         # Django now calls get_form in get_context_data, but HandleFormMixin
@@ -18,7 +18,7 @@ from widgy.models.links import LinkField, LinkFormField, LinkFormMixin
 from widgy.db.fields import WidgyField
 from widgy.contrib.page_builder.db.fields import MarkdownField, VideoField, ImageField
 from widgy.contrib.page_builder.forms import CKEditorField
-from widgy.signals import pre_delete_widget
+from widgy.signals import pre_delete_widgets
 from widgy.utils import build_url, SelectRelatedManager
 import widgy
 
@@ -33,6 +33,8 @@ class BaseLayout(StrictDefaultChildrenMixin, Content):
     draggable = False
     deletable = False
 
+    static_valid_child_of = True
+
     @classmethod
     def valid_child_of(cls, content, obj=None):
         return False
@@ -57,9 +59,13 @@ class Bucket(Content):
 
 @widgy.register
 class MainContent(Bucket):
+    static_valid_parent_of = True
+
     def valid_parent_of(self, cls, obj=None):
         return not issubclass(cls, (MainContent, Sidebar))
 
+    static_valid_child_of = True
+
     @classmethod
     def valid_child_of(cls, parent, obj=None):
         return isinstance(parent, BaseLayout)
@@ -73,9 +79,13 @@ class MainContent(Bucket):
 class Sidebar(Bucket):
     pop_out = 1
 
+    static_valid_parent_of = True
+
     def valid_parent_of(self, cls, obj=None):
         return not issubclass(cls, (MainContent, Sidebar))
 
+    static_valid_child_of = True
+
     @classmethod
     def valid_child_of(cls, parent, obj=None):
         return isinstance(parent, BaseLayout)
@@ -148,10 +158,14 @@ class UnsafeHtml(Content):
 
 @widgy.register
 class CalloutBucket(Bucket):
+    static_valid_child_of = True
+
     @classmethod
     def valid_child_of(cls, parent, obj=None):
         return False
 
+    static_valid_parent_of = True
+
     def valid_parent_of(self, cls, obj=None):
         return issubclass(cls, (Markdown, Button, Html))
 
@@ -190,6 +204,8 @@ class CalloutWidget(StrDisplayNameMixin, Content):
     editable = True
     tooltip = _("Callouts are a way to call a user's attention to something."
                 " Callouts can be shared across pages.")
+    # The callout's tree isn't frozen along with the page.
+    cacheable = False
 
     objects = SelectRelatedManager(select_related=['callout__root_node'])
 
@@ -202,6 +218,8 @@ class CalloutWidget(StrDisplayNameMixin, Content):
             return self.callout.name
         return ''
 
+    static_valid_child_of = True
+
     @classmethod
     def valid_child_of(cls, parent, obj=None):
         return isinstance(parent, Sidebar)
@@ -215,6 +233,8 @@ class Accordion(DefaultChildrenMixin, Bucket):
                 " good use for accordions is an FAQ page. Use the Section"
                 " widget to separate each section of content in the Accordion.")
 
+    static_valid_parent_of = True
+
     def valid_parent_of(self, cls, obj=None):
         return issubclass(cls, Section)
 
@@ -260,6 +280,8 @@ class Section(StrDisplayNameMixin, Content):
     tooltip = _("Use Section to split up your content into more consumable"
                 " chunks.")
 
+    static_valid_child_of = True
+
     @classmethod
     def valid_child_of(cls, parent, obj=None):
         return isinstance(parent, Accordion)
@@ -302,7 +324,7 @@ class TableElement(Content):
 
     @property
     def sibling_index(self):
-        return self.get_siblings().index(self)
+        return self.node.get_sibling_index()
 
 
 @widgy.register
@@ -311,10 +333,14 @@ class TableRow(TableElement):
 
     tooltip = _("Add a row to your table.")
 
+    static_valid_child_of = True
+
     @classmethod
     def valid_child_of(cls, parent, obj=None):
         return isinstance(parent, TableBody)
 
+    static_valid_parent_of = True
+
     def valid_parent_of(self, cls, obj=None):
         return issubclass(cls, TableData)
 
@@ -382,10 +408,15 @@ class TableHeaderData(TableElement):
         verbose_name_plural = _('columns')
 
 
-@receiver(pre_delete_widget, sender=TableHeaderData)
-def delete_column(sender, instance, raw, **kwargs):
-    if not raw:
-        instance.delete_column()
+@receiver(pre_delete_widgets, sender=TableHeaderData)
+def delete_columns(sender, instances, raw, **kwargs):
+    if raw:
+        return
+    # Find the cells of every column before deleting any, deleting a column
+    # changes the indexes of the ones after it.
+    cells = [cell for i in instances for cell in i.table.cells_at_index(i.sibling_index)]
+    for cell in cells:
+        cell.node.delete()
 
 
 @widgy.register
@@ -441,6 +472,8 @@ class TableBody(InvisibleMixin, TableElement):
     draggable = False
     deletable = False
 
+    static_valid_child_of = True
+
     @classmethod
     def valid_child_of(cls, parent, obj=None):
         return isinstance(parent, Table)
@@ -1,14 +1,21 @@
+import io
 import unittest
 
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.base import ContentFile
+from django.template import Context
 from django.test import TestCase
+from PIL import Image as PILImage
+from filer.models import Image as FilerImage
+import mock
 
 from widgy.site import WidgySite
-from widgy.models import Node
+from widgy.models import Node, VersionTracker, TreeSnapshot
 from widgy.exceptions import ParentChildRejection
 
 from widgy.contrib.page_builder.models import (
-    Table, TableRow, TableHeaderData, TableHeader, TableBody,
-    Accordion, Video, MainContent
+    Table, TableRow, TableHeaderData, TableHeader, TableBody, TableData,
+    Accordion, Video, MainContent, Image
 )
 from widgy.contrib.page_builder.forms import CKEditorField
 
@@ -91,6 +98,14 @@ class TestTableWidget(TestCase):
 
         self.assertEqual(len(self.table.body.get_children()[1].get_children()), 2)
 
+    def test_add_rows(self):
+        self.table.header.add_child(widgy_site, TableHeaderData)
+        self.table.header.add_child(widgy_site, TableHeaderData)
+        # TableRow.post_create runs after the rows have been added
+        rows = self.table.body.add_children(widgy_site, [(TableRow, {}), (TableRow, {})])
+        self.assertEqual([len(refetch(i).get_children()) for i in rows], [2, 2])
+        self.assertFalse(any(Node.find_problems()))
+
     def test_reorder(self):
         th1 = self.table.header.add_child(widgy_site, TableHeaderData)
         th2 = self.table.header.add_child(widgy_site, TableHeaderData)
@@ -141,6 +156,15 @@ class TestTableWidget(TestCase):
         self.assertEqual(len(first_row.get_children()), 1)
         self.assertEqual(len(second_row.get_children()), 1)
 
+    def test_delete_table(self):
+        self.table.header.add_child(widgy_site, TableHeaderData)
+        self.table.header.add_child(widgy_site, TableHeaderData)
+        self.table.body.add_children(widgy_site, [(TableRow, {}), (TableRow, {})])
+
+        refetch(self.table).delete()
+        self.assertFalse(Node.objects.exists())
+        self.assertFalse(TableData.objects.exists())
+
     def test_compatibility(self):
         def invalid(parent, child_class):
             with self.assertRaises(ParentChildRejection):
@@ -228,6 +252,7 @@ class TestAccordionAutomaticallyAdds2Sections(TestCase):
         self.assertEqual(len(tabs.get_children()), 2)
         self.assertEqual(tabs.get_children()[0].title, 'Title 1')
         self.assertEqual(tabs.get_children()[1].title, 'Title 2')
+        self.assertEqual(refetch(tabs).node.numchild, 2)
 
 
 class TestVideoWidget(TestCase):
@@ -243,3 +268,33 @@ class TestVideoWidget(TestCase):
 
         video = content.get_children()[0]
         self.assertEqual(video.video.embed_url, '//youtube.com/embed/dQw4w9WgXcQ')
+
+
+class TestImageSnapshot(TestCase):
+    def make_image(self, name):
+        f = io.BytesIO()
+        PILImage.new('RGB', (4, 4)).save(f, 'PNG')
+        return FilerImage.objects.create(file=ContentFile(f.getvalue(), name), original_filename=name)
+
+    def test_render_from_snapshot(self):
+        content = MainContent.add_root(widgy_site)
+        content.add_child(widgy_site, Image, image=self.make_image('a.png'))
+        content.add_child(widgy_site, Image, image=self.make_image('b.png'))
+        tracker = VersionTracker.objects.create(working_copy=content.node)
+        with mock.patch.object(VersionTracker, 'snapshot_trees', True):
+            commit = tracker.commit()
+        snapshot = TreeSnapshot.objects.get(root_node=commit.root_node)
+        # fill the ContentType cache
+        for i in ContentType.objects.all():
+            ContentType.objects.get_for_id(i.pk)
+
+        def get_thumbnail(file_, geometry, **options):
+            return mock.Mock(url=file_)
+
+        # the images, with their filer images
+        with mock.patch('sorl.thumbnail.templatetags.thumbnail.get_thumbnail', get_thumbnail):
+            with self.assertNumQueries(1):
+                root = snapshot.load_tree()
+                rendered = [i.content.render(Context()) for i in root.get_children()]
+        self.assertIn('a.png', rendered[0])
+        self.assertIn('b.png', rendered[1])
@@ -45,6 +45,14 @@ class ReviewedVersionCommit(VersionCommit):
         if commit:
             self.save()
 
+    def get_tracker(self):
+        # A commit that was fetched by itself has a plain VersionTracker, which
+        # would publish it without it being approved.
+        tracker = getattr(self, self._meta.get_field('tracker').get_cache_name(), None)
+        if isinstance(tracker, ReviewedVersionTracker):
+            return tracker
+        return ReviewedVersionTracker(pk=self.tracker_id)
+
 
 class ReviewedVersionTracker(VersionTracker):
     commit_model = ReviewedVersionCommit
@@ -68,6 +76,17 @@ class ReviewedVersionTracker(VersionTracker):
     def commit_is_ready(self, commit):
         return commit.is_published and commit.reviewedversioncommit.is_approved
 
+    @classmethod
+    def get_commit_queryset(cls):
+        return super(ReviewedVersionTracker, cls).get_commit_queryset() \
+            .select_related('reviewedversioncommit')
+
+    def get_publishable_commits(self):
+        return super(ReviewedVersionTracker, self).get_publishable_commits().filter(
+            reviewedversioncommit__approved_by__isnull=False,
+            reviewedversioncommit__approved_at__isnull=False,
+        )
+
     @property
     def commits(self):
         # XXX: This select_related is overriden in get_history_list.
@@ -58,6 +58,8 @@ class I18NLayout(I18NChild, Layout):
     This is a layout for a specific language that lives inside a
     I18NLayoutContainer.
     """
+    static_valid_child_of = True
+
     @classmethod
     def valid_child_of(cls, content, obj=None):
         return isinstance(content, I18NLayoutContainer)
@@ -80,6 +82,8 @@ class I18NLayoutContainer(StrictDefaultChildrenMixin, I18NTabbedContainer):
             for l in settings.LANGUAGES
         ]
 
+    static_valid_child_of = True
+
     @classmethod
     def valid_child_of(self, content, obj=None):
         return False
@@ -1,6 +1,7 @@
 import six
 
 from django.db import models
+from django.db.models import prefetch_related_objects
 from django.apps import apps
 from django.contrib.contenttypes.models import ContentType
 from django.utils.functional import SimpleLazyObject
@@ -135,12 +136,25 @@ class WidgyField(models.ForeignKey):
     def get_render_node(self, model_instance, context):
         return getattr(model_instance, self.name)
 
+    def get_render_nodes(self, model_instances, context=None):
+        """
+        Like :meth:`get_render_node`, but for many instances at once. Fetches
+        the related objects of all of the instances together.
+        """
+        prefetch_related_objects(model_instances, self.name)
+        return [self.get_render_node(i, context) for i in model_instances]
+
     def render(self, model_instance, context=None, node=None):
         root_node = node or self.get_render_node(model_instance, context)
         if not root_node:
             return 'no content'
 
-        root_node.prefetch_tree()
+        if self.site.compact_frozen_trees and root_node.is_frozen \
+                and not hasattr(root_node, '_children'):
+            from widgy.frozen import FrozenNode
+            root_node = FrozenNode.fetch_tree(root_node)
+        else:
+            root_node.maybe_prefetch_tree()
         env = {
             'widgy': {
                 'site': self.site,
@@ -150,7 +164,7 @@ class WidgyField(models.ForeignKey):
             },
         }
         with update_context(context, env) as context:
-            return root_node.render(context)
+            return root_node.cached_render(context)
 
     def validate(self, value, model_instance):
         # `value` is our root node's pk. If we're currently creating
@@ -186,9 +200,24 @@ class VersionedWidgyField(WidgyField):
     def get_render_node(self, model_instance, context):
         version_tracker = getattr(model_instance, self.name)
         if version_tracker:
-            node = version_tracker.get_published_node(context and context.get('request'))
+            request = context and context.get('request')
+            node = version_tracker.get_published_snapshot(request)
+            if node is None:
+                node = version_tracker.get_published_node(request)
             if node is None:
                 node = version_tracker.working_copy
             return node
         else:
             return None
+
+    def get_render_nodes(self, model_instances, context=None):
+        prefetch_related_objects(model_instances, self.name)
+        version_trackers = [i for i in (getattr(j, self.name) for j in model_instances) if i]
+        self.remote_field.model.prefetch_histories(version_trackers)
+        self.remote_field.model.prefetch_snapshots(version_trackers)
+
+        request = context and context.get('request')
+        unpublished = [i for i in version_trackers if i.get_published_node(request) is None]
+        prefetch_related_objects(unpublished, 'working_copy')
+
+        return [self.get_render_node(i, context) for i in model_instances]
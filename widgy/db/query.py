@@ -0,0 +1,61 @@
+from django.db.models.query import ModelIterable
+
+from widgy.utils import QuerySet
+
+
+def prefetch_widgy_trees(model_instances, field_name, context=None):
+    """
+    Prefetches the trees that :meth:`WidgyField.render
+    <widgy.db.fields.WidgyField.render>` would render for each of
+    `model_instances`. The number of queries doesn't depend on the number of
+    instances: one (or a few, for a
+    :class:`~widgy.db.fields.VersionedWidgyField`) to find the root nodes,
+    one for all of their descendants, and one per content type.
+    """
+    from widgy.models import Node
+
+    model_instances = list(model_instances)
+    if not model_instances:
+        return
+    field = model_instances[0]._meta.get_field(field_name)
+
+    root_nodes = {}
+    for node in field.get_render_nodes(model_instances, context):
+        # trees loaded from a snapshot are already complete
+        if isinstance(node, Node):
+            root_nodes[id(node)] = node
+    Node.prefetch_trees(*root_nodes.values())
+
+
+class WidgyQuerySetMixin(object):
+    """
+    Adds :meth:`prefetch_widgy` to a QuerySet.
+    """
+    _prefetch_widgy_fields = ()
+    _prefetch_widgy_done = False
+
+    def prefetch_widgy(self, *field_names):
+        """
+        Like ``prefetch_related``, but for the trees of WidgyFields. See
+        :func:`prefetch_widgy_trees`.
+        """
+        clone = self._clone()
+        clone._prefetch_widgy_fields = self._prefetch_widgy_fields + field_names
+        return clone
+
+    def _clone(self, *args, **kwargs):
+        clone = super(WidgyQuerySetMixin, self)._clone(*args, **kwargs)
+        clone._prefetch_widgy_fields = self._prefetch_widgy_fields
+        return clone
+
+    def _fetch_all(self):
+        super(WidgyQuerySetMixin, self)._fetch_all()
+        if self._prefetch_widgy_fields and not self._prefetch_widgy_done:
+            if issubclass(self._iterable_class, ModelIterable):
+                for field_name in self._prefetch_widgy_fields:
+                    prefetch_widgy_trees(self._result_cache, field_name)
+            self._prefetch_widgy_done = True
+
+
+class WidgyQuerySet(WidgyQuerySetMixin, QuerySet):
+    pass
@@ -0,0 +1,246 @@
+"""
+Structural diffs between two widgy trees.
+
+Nodes don't keep an identity across versions (cloning a tree creates new
+contents), so the trees are matched structurally instead. Subtrees with equal
+digests are unchanged. Between those, children are paired up by content type,
+in order. A subtree that was removed in one place and added, unchanged, in
+another is reported as moved.
+"""
+from difflib import SequenceMatcher
+
+from django.core.exceptions import FieldDoesNotExist
+from django.utils.encoding import force_text
+
+from widgy.models import Node
+
+
+class FieldChange(object):
+    def __init__(self, name, label, before, after):
+        self.name = name
+        self.label = label
+        self.before = before
+        self.after = after
+
+    def __repr__(self):
+        return '<FieldChange %s: %r -> %r>' % (self.name, self.before, self.after)
+
+
+class NodeDiff(object):
+    """
+    One widget in the diff. ``before`` and ``after`` are the Content
+    instances in each tree, one of them is None for added and removed
+    widgets.
+
+    ``status`` is one of
+
+        - ``'unchanged'``: the widget's attributes are the same, but its
+          descendants may have changed.
+        - ``'changed'``: the widget's attributes changed, see ``changes``.
+        - ``'added'``, ``'removed'``
+        - ``'moved'``: the widget (and its descendants) was moved here, without
+          any changes. ``before`` is where it was.
+        - ``'moved_away'``: where a moved widget used to be. ``after`` is where
+          it went.
+    """
+    UNCHANGED = 'unchanged'
+    CHANGED = 'changed'
+    ADDED = 'added'
+    REMOVED = 'removed'
+    MOVED = 'moved'
+    MOVED_AWAY = 'moved_away'
+
+    def __init__(self, status, before=None, after=None, changes=(), children=()):
+        self.status = status
+        self.before = before
+        self.after = after
+        self.changes = list(changes)
+        self.children = list(children)
+
+    @property
+    def content(self):
+        return self.after if self.after is not None else self.before
+
+    @property
+    def has_changes(self):
+        return self.status != self.UNCHANGED or any(i.has_changes for i in self.children)
+
+    def __iter__(self):
+        """
+        Iterates over me and all my descendants, depth first.
+        """
+        stack = [self]
+        while stack:
+            diff = stack.pop()
+            yield diff
+            stack.extend(reversed(diff.children))
+
+    def __repr__(self):
+        return '<NodeDiff %s %s>' % (self.status, self.content)
+
+
+class TreeDiff(object):
+    def __init__(self, root):
+        self.root = root
+
+    def _with_status(self, status):
+        return [i for i in self.root if i.status == status]
+
+    @property
+    def added(self):
+        return self._with_status(NodeDiff.ADDED)
+
+    @property
+    def removed(self):
+        return self._with_status(NodeDiff.REMOVED)
+
+    @property
+    def moved(self):
+        return self._with_status(NodeDiff.MOVED)
+
+    @property
+    def changed(self):
+        return self._with_status(NodeDiff.CHANGED)
+
+    @property
+    def has_changes(self):
+        return self.root.has_changes
+
+
+def get_digests(root_node):
+    """
+    The digest of every node in a prefetched tree, by id(). Frozen trees
+    never change, so their stored digests can be used. Others are computed
+    in memory, because the instances may be older than the database.
+    """
+    digests = {}
+    for node in reversed(root_node.depth_first_order()):
+        if node.is_frozen and node.digest:
+            digests[id(node)] = node.digest
+        else:
+            digests[id(node)] = node.compute_digest(
+                digests[id(child)] for child in node.get_children())
+    return digests
+
+
+def get_field_changes(before, after):
+    """
+    The attributes that differ between two contents of the same class.
+    """
+    before_attributes = before.get_attributes()
+    after_attributes = after.get_attributes()
+    changes = []
+    for name in sorted(set(before_attributes) | set(after_attributes)):
+        a, b = before_attributes.get(name), after_attributes.get(name)
+        if a != b:
+            try:
+                label = force_text(after._meta.get_field(name).verbose_name)
+            except FieldDoesNotExist:
+                label = name
+            changes.append(FieldChange(name, label, a, b))
+    return changes
+
+
+class TreeDiffer(object):
+    def __init__(self, before, after):
+        self.before = before
+        self.after = after
+
+    def diff(self):
+        Node.prefetch_trees(self.before, self.after)
+        self.digests = get_digests(self.before)
+        self.digests.update(get_digests(self.after))
+
+        root = self.diff_nodes(self.before, self.after)
+        self.detect_moves(root)
+        return TreeDiff(root)
+
+    def digest(self, node):
+        return self.digests[id(node)]
+
+    def unchanged(self, node):
+        return NodeDiff(NodeDiff.UNCHANGED, node.content, node.content,
+                        children=[self.unchanged(i) for i in node.get_children()])
+
+    def only_in_one(self, node, status):
+        kwargs = {'before' if status == NodeDiff.REMOVED else 'after': node.content}
+        return NodeDiff(status, children=[self.only_in_one(i, status) for i in node.get_children()],
+                        **kwargs)
+
+    def diff_nodes(self, before, after):
+        """
+        Diffs two nodes that are in the same place in both trees.
+        """
+        if self.digest(before) == self.digest(after):
+            return self.unchanged(after)
+
+        if before.content_type_id == after.content_type_id:
+            changes = get_field_changes(before.content, after.content)
+        else:
+            changes = [FieldChange('class', 'class', before.content.display_name,
+                                   after.content.display_name)]
+        status = NodeDiff.CHANGED if changes else NodeDiff.UNCHANGED
+        return NodeDiff(status, before.content, after.content, changes,
+                        self.diff_children(before.get_children(), after.get_children()))
+
+    def diff_children(self, before, after):
+        diffs = []
+        matcher = SequenceMatcher(None, [self.digest(i) for i in before],
+                                  [self.digest(i) for i in after], autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == 'equal':
+                diffs.extend(self.unchanged(i) for i in after[j1:j2])
+            else:
+                diffs.extend(self.diff_replaced(before[i1:i2], after[j1:j2]))
+        return diffs
+
+    def diff_replaced(self, before, after):
+        """
+        Pairs up changed children by content type.
+        """
+        matcher = SequenceMatcher(None, [i.content_type_id for i in before],
+                                  [i.content_type_id for i in after], autojunk=False)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == 'equal':
+                for a, b in zip(before[i1:i2], after[j1:j2]):
+                    yield self.diff_nodes(a, b)
+            else:
+                for node in before[i1:i2]:
+                    yield self.only_in_one(node, NodeDiff.REMOVED)
+                for node in after[j1:j2]:
+                    yield self.only_in_one(node, NodeDiff.ADDED)
+
+    def detect_moves(self, root):
+        """
+        Turns removed and added subtrees that are equal into moves.
+        """
+        removed = {}
+        added = []
+        stack = [root]
+        while stack:
+            diff = stack.pop()
+            if diff.status == NodeDiff.REMOVED:
+                removed.setdefault(self.digest(diff.before.node), []).append(diff)
+            elif diff.status == NodeDiff.ADDED:
+                added.append(diff)
+            else:
+                stack.extend(diff.children)
+
+        for diff in added:
+            candidates = removed.get(self.digest(diff.after.node))
+            if candidates:
+                source = candidates.pop(0)
+                source.status = NodeDiff.MOVED_AWAY
+                source.after = diff.after
+                source.children = []
+                diff.status = NodeDiff.MOVED
+                diff.before = source.before
+                diff.children = self.unchanged(diff.after.node).children
+
+
+def diff_trees(before, after):
+    """
+    Compares the trees of the `before` and `after` nodes and returns a
+    :class:`TreeDiff`.
+    """
+    return TreeDiffer(before, after).diff()
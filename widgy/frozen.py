@@ -0,0 +1,285 @@
+"""
+A compact, read-only representation of frozen trees for rendering.
+
+Rendering a published tree only needs the shape of the tree and the content
+instances. :class:`FrozenNode` keeps just the columns of a node in slots, and
+the whole tree is built from one ``values_list`` query, so a big tree doesn't
+need a model instance (with its ``_state`` and field machinery) for every
+node. The contents are fetched and attached like
+:meth:`Node.attach_content_instances <widgy.models.Node.attach_content_instances>`
+does, so widgets can't tell the difference as long as they only use the
+traversal API.
+
+A frozen tree can also be dumped to a single JSON document, with the field
+values of every content (but not their many-to-many relations), and loaded
+back without touching the content tables. :class:`widgy.models.TreeSnapshot` stores these documents.
+The contents of the classes whose manager selects or prefetches related
+objects are still fetched, with a query per class, so using those objects
+doesn't take a query per widget.
+
+Frozen nodes can't be saved, moved, or serialized for the editor.
+"""
+import json
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import router
+from django.utils.encoding import force_text, python_2_unicode_compatible
+
+from widgy.models import Node, UnknownWidget
+
+# Bumped when the format of FrozenNode.dump changes.
+SNAPSHOT_VERSION = 1
+
+
+def dump_content(content):
+    """
+    The values of the concrete fields of `content` as text (or None), so
+    they can be stored as JSON. Many-to-many values aren't stored, using
+    them queries the database like for a fetched instance.
+    """
+    ret = {}
+    for field in content._meta.concrete_fields:
+        if field.value_from_object(content) is None:
+            ret[field.attname] = None
+        else:
+            ret[field.attname] = field.value_to_string(content)
+    return ret
+
+
+def fetches_related(model_class):
+    """
+    Does the manager that contents are fetched with select or prefetch
+    related objects (like ``SelectRelatedManager``)? Those objects aren't in
+    snapshots.
+    """
+    qs = model_class.objects.all()
+    return bool(qs.query.select_related or qs._prefetch_related_lookups)
+
+
+def load_content(content_type_id, content_id, values):
+    """
+    Instantiates the content that :func:`dump_content` stored, as if it was
+    fetched from the database.
+    """
+    model_class = ContentType.objects.get_for_id(content_type_id).model_class()
+    if model_class is None:
+        ret = UnknownWidget(ContentType.objects.get(id=content_type_id), content_id)
+        ret.warn()
+        return ret
+    fields = [f for f in model_class._meta.concrete_fields if f.attname in values]
+    return model_class.from_db(
+        router.db_for_read(model_class),
+        [f.attname for f in fields],
+        [f.to_python(values[f.attname]) for f in fields],
+    )
+
+
+@python_2_unicode_compatible
+class FrozenNode(object):
+    __slots__ = (
+        'pk', 'path', 'depth', 'numchild', 'content_type_id', 'content_id', 'digest',
+        '_content_cache', '_parent', '_children', '_sibling_index', '_descendants_memo',
+    )
+
+    # The columns fetched for every node, in the order of __init__'s
+    # arguments.
+    fields = ('pk', 'path', 'depth', 'numchild', 'content_type_id', 'content_id', 'digest')
+
+    is_frozen = True
+    steplen = Node.steplen
+
+    def __init__(self, pk, path, depth, numchild, content_type_id, content_id, digest):
+        self.pk = pk
+        self.path = path
+        self.depth = depth
+        self.numchild = numchild
+        self.content_type_id = content_type_id
+        self.content_id = content_id
+        self.digest = digest
+        self._children = []
+
+    @classmethod
+    def fetch_tree(cls, root_node):
+        """
+        Builds the whole subtree of `root_node` (a :class:`Node`), with the
+        contents attached, and returns its root. It takes one query for the
+        nodes and one for each content type.
+        """
+        rows = Node.objects.filter(
+            path__startswith=root_node.path,
+            depth__gte=root_node.depth,
+        ).order_by('path').values_list(*cls.fields)
+        nodes = cls.build_tree(rows)
+
+        contents = Node.fetch_content_instances(nodes)
+        for node in nodes:
+            node.content = contents[node.content_type_id][node.content_id]
+        return nodes[0]
+
+    @classmethod
+    def build_tree(cls, rows):
+        """
+        Makes a node for each row of :attr:`fields` and links them into a
+        tree. The rows must be a whole subtree in path order. Returns the
+        nodes in the same order, the first one is the root.
+        """
+        nodes = []
+        stack = []
+        for row in rows:
+            node = cls(*row)
+            while stack and stack[-1].depth >= node.depth:
+                stack.pop()
+            if stack:
+                parent = stack[-1]
+                node._parent = parent
+                node._sibling_index = len(parent._children)
+                parent._children.append(node)
+            stack.append(node)
+            nodes.append(node)
+
+        root = nodes[0]
+        if root.depth == 1:
+            root._parent = None
+            root._sibling_index = 0
+        return nodes
+
+    def dump(self):
+        """
+        Serializes my subtree, with the field values of every content, to a
+        JSON string that :meth:`load` turns back into a tree without any
+        queries.
+        """
+        return json.dumps({
+            'version': SNAPSHOT_VERSION,
+            'nodes': [
+                [getattr(node, f) for f in self.fields] + [dump_content(node.content)]
+                for node in self.iter_depth_first()
+            ],
+        }, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, data):
+        """
+        Builds a tree from the output of :meth:`dump`. The contents are
+        instantiated from the stored field values. Fields that didn't
+        exist when the tree was dumped are deferred, so they are fetched if
+        they are used. The contents of classes that fetch related objects
+        (see :func:`fetches_related`) are fetched like :meth:`fetch_tree`
+        does, so they come with those objects.
+        """
+        data = json.loads(data)
+        if data.get('version') != SNAPSHOT_VERSION:
+            raise ValueError("Unknown snapshot version: %r" % data.get('version'))
+        rows = data['nodes']
+        nodes = cls.build_tree(row[:-1] for row in rows)
+
+        to_fetch = set()
+        for content_type_id in set(node.content_type_id for node in nodes):
+            model_class = ContentType.objects.get_for_id(content_type_id).model_class()
+            if model_class is not None and fetches_related(model_class):
+                to_fetch.add(content_type_id)
+        contents = Node.fetch_content_instances(
+            [node for node in nodes if node.content_type_id in to_fetch])
+
+        for node, row in zip(nodes, rows):
+            if node.content_type_id in to_fetch:
+                node.content = contents[node.content_type_id][node.content_id]
+            else:
+                node.content = load_content(node.content_type_id, node.content_id, row[-1])
+        return nodes[0]
+
+    @property
+    def id(self):
+        return self.pk
+
+    @property
+    def content(self):
+        return self._content_cache
+
+    @content.setter
+    def content(self, value):
+        self._content_cache = value
+        value.node = self
+
+    def __str__(self):
+        return force_text(self.content)
+
+    def __repr__(self):
+        return '<FrozenNode: %s>' % self.pk
+
+    def __eq__(self, other):
+        return isinstance(other, FrozenNode) and self.pk == other.pk
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.pk)
+
+    def is_root(self):
+        return self.depth == 1
+
+    def is_leaf(self):
+        return self.numchild == 0
+
+    def get_children(self):
+        return self._children
+
+    def get_parent(self):
+        try:
+            return self._parent
+        except AttributeError:
+            # the top of a subtree that isn't a whole tree
+            return Node.objects.get(path=self.path[:-self.steplen])
+
+    def get_sibling_index(self):
+        try:
+            return self._sibling_index
+        except AttributeError:
+            return Node.objects.get(pk=self.pk).get_sibling_index()
+
+    def get_next_sibling(self):
+        if not hasattr(self, '_parent'):
+            return Node.objects.get(pk=self.pk).get_next_sibling()
+        if self._parent is None:
+            return None
+        siblings = self._parent._children
+        index = self._sibling_index + 1
+        return siblings[index] if index < len(siblings) else None
+
+    def get_ancestors(self):
+        ancestors = []
+        node = self
+        while hasattr(node, '_parent'):
+            node = node._parent
+            if node is None:
+                break
+            ancestors.append(node)
+        else:
+            ancestors.extend(reversed(list(Node.objects.get(pk=node.pk).get_ancestors())))
+        ancestors.reverse()
+        return ancestors
+
+    def get_root(self):
+        ancestors = self.get_ancestors()
+        return ancestors[0] if ancestors else self
+
+    def iter_depth_first(self):
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node._children))
+
+    def depth_first_order(self):
+        return list(self.iter_depth_first())
+
+    def maybe_prefetch_tree(self):
+        # always prefetched
+        pass
+
+    def render(self, *args, **kwargs):
+        return self.content.render(*args, **kwargs)
+
+    def cached_render(self, *args, **kwargs):
+        return self.content.cached_render(*args, **kwargs)
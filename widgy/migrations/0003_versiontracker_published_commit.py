@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('widgy', '0002_node_digest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='versiontracker',
+            name='published_commit',
+            field=models.ForeignKey(related_name='+', on_delete=django.db.models.deletion.SET_NULL, blank=True, editable=False, to='widgy.VersionCommit', null=True),
+        ),
+        migrations.AddField(
+            model_name='versiontracker',
+            name='published_commit_expires_at',
+            field=models.DateTimeField(null=True, editable=False, blank=True),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('widgy', '0003_versiontracker_published_commit'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TreeSnapshot',
+            fields=[
+                ('root_node', models.OneToOneField(related_name='snapshot', primary_key=True, on_delete=django.db.models.deletion.CASCADE, serialize=False, to='widgy.Node')),
+                ('data', models.TextField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 14:05
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('widgy', '0004_treesnapshot'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='node',
+            index_together=set([('content_type', 'content_id')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='node',
+            unique_together=set([]),
+        ),
+    ]
@@ -1,2 +1,2 @@
 from widgy.models.base import Node, Content, UnknownWidget
-from widgy.models.versioning import VersionTracker, VersionCommit
+from widgy.models.versioning import VersionTracker, VersionCommit, TreeSnapshot
@@ -2,22 +2,32 @@
 Classes in this module supply the abstract models used to create new widgy
 objects.
 """
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from functools import partial
+import hashlib
+import json
 import logging
 import itertools
+import operator
 import copy
 
-from django.db import models, transaction
+import six
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connections, models, router, transaction
 from django import forms
+from django.dispatch import receiver
 from django.forms.models import modelform_factory, ModelForm
 from django.contrib.contenttypes.models import ContentType
 from django.template import RequestContext
-from django.template.loader import render_to_string
+from django.template import loader
 from django.contrib.admin import widgets
+from django.core.serializers.json import DjangoJSONEncoder
 from django.template.defaultfilters import capfirst
-from django.utils.encoding import force_text, python_2_unicode_compatible
+from django.utils.encoding import force_bytes, force_text, python_2_unicode_compatible
 
+from treebeard.exceptions import PathOverflow
 from treebeard.mp_tree import MP_Node
 
 from widgy.exceptions import (
@@ -26,13 +36,53 @@ from widgy.exceptions import (
     ParentChildRejection,
     RootDisplacementError
 )
-from widgy.signals import pre_delete_widget
+from widgy.signals import pre_delete_widget, pre_delete_widgets
 from widgy.generic import WidgyGenericForeignKey, ProxyGenericRelation
 from widgy.utils import exception_to_bool, update_context, unset_pks
 from widgy.widgets import DateTimeWidget, DateWidget, TimeWidget
 
 logger = logging.getLogger(__name__)
 
+# How many trees Node.fetch_descendants fetches in one query. Every tree adds
+# a condition to the WHERE clause, and some databases limit how many there
+# can be.
+PREFETCH_TREES_BATCH_SIZE = 200
+
+# How many contents delete_trees deletes in one query, for the same reason.
+DELETE_BATCH_SIZE = 500
+
+# Content.get_templates_hierarchy results by class and arguments, and the
+# templates selected from those lists. Templates can change on disk while
+# DEBUG is on, so they are only remembered when it is off.
+TEMPLATES_HIERARCHY_CACHE = {}
+SELECTED_TEMPLATE_CACHE = {}
+
+
+def select_template(template_names):
+    """
+    Like :func:`django.template.loader.select_template`, but remembers which
+    template was selected for each list of names. `template_names` can also
+    be a single name.
+    """
+    if isinstance(template_names, six.string_types):
+        template_names = (template_names,)
+    if settings.DEBUG:
+        return loader.select_template(template_names)
+
+    key = tuple(template_names)
+    try:
+        return SELECTED_TEMPLATE_CACHE[key]
+    except KeyError:
+        template = SELECTED_TEMPLATE_CACHE[key] = loader.select_template(template_names)
+        return template
+
+
+@receiver(setting_changed)
+def clear_selected_templates(setting, **kwargs):
+    if setting in ('TEMPLATES', 'DEBUG'):
+        SELECTED_TEMPLATE_CACHE.clear()
+
+
 # TODO: Don't use the Admin widgets.
 FORMFIELD_FOR_DBFIELD_DEFAULTS = {
     models.DateTimeField: {
@@ -65,20 +115,44 @@ class Node(MP_Node):
     content_id = models.PositiveIntegerField()
     content = WidgyGenericForeignKey('content_type', 'content_id')
     is_frozen = models.BooleanField(default=False)
+    # A hash of the subtree: the content type and attributes of every
+    # widget, in tree order. Empty means it has to be recomputed, see
+    # refresh_digests.
+    digest = models.CharField(max_length=40, blank=True, default='', editable=False)
 
     class Meta:
         app_label = 'widgy'
-        unique_together = [('content_type', 'content_id')]
+        # Not unique: the frozen trees of commits can share contents, see
+        # clone_tree's share_with.
+        index_together = [('content_type', 'content_id')]
 
     def __str__(self):
         return force_text(self.content)
 
-    def to_json(self, site):
-        children = [c.to_json(site) for c in self.get_children()]
+    def to_json(self, site, depth=None, preview=True):
+        """
+        Serializes me and my descendants for the editor. When `depth` is
+        given, only that many levels of descendants are included. Nodes at
+        the limit that have children are ``collapsed``, their ``children``
+        are None. Without `preview`, the preview templates are left out, see
+        :class:`widgy.views.api.PreviewsView`.
+        """
+        if depth is not None and depth <= 0 and self.numchild:
+            children = None
+        else:
+            child_depth = depth if depth is None else depth - 1
+            children = [c.to_json(site, child_depth, preview) for c in self.get_children()]
+        if preview:
+            # Widgets that override to_json may not take preview yet.
+            content = self.content.to_json(site)
+        else:
+            content = self.content.to_json(site, preview=False)
         json = {
             'url': self.get_api_url(site),
-            'content': self.content.to_json(site),
+            'content': content,
             'children': children,
+            'collapsed': children is None,
+            'digest': self.digest or None,
             'available_children_url': self.get_available_children_url(site),
             'possible_parents_url': self.get_possible_parents_url(site),
         }
@@ -97,6 +171,12 @@ class Node(MP_Node):
         """
         return self.content.render(*args, **kwargs)
 
+    def cached_render(self, *args, **kwargs):
+        """
+        Delegates the cached_render call to the content instance.
+        """
+        return self.content.cached_render(*args, **kwargs)
+
     def get_children(self):
         if hasattr(self, '_children'):
             return self._children
@@ -109,31 +189,51 @@ class Node(MP_Node):
 
     def get_next_sibling(self):
         if hasattr(self, '_parent'):
-            if self._parent:
-                siblings = list(self._parent.get_children())
-            else:
-                siblings = [self]
-            try:
-                return siblings[siblings.index(self) + 1]
-            except IndexError:
+            if not self._parent:
                 return None
+            siblings = self._parent.get_children()
+            index = self.get_sibling_index() + 1
+            return siblings[index] if index < len(siblings) else None
         return super(Node, self).get_next_sibling()
 
-    def get_ancestors(self):
+    def get_sibling_index(self):
+        """
+        My position among my siblings. Prefetched trees remember it,
+        otherwise the siblings to my left are counted.
+        """
+        if hasattr(self, '_sibling_index'):
+            return self._sibling_index
         if hasattr(self, '_parent'):
-            if self._parent:
-                return list(self._parent.get_ancestors()) + [self._parent]
-            else:
-                return []
-        return super(Node, self).get_ancestors()
+            if not self._parent:
+                return 0
+            return self._parent.get_children().index(self)
+        return self.get_siblings().filter(path__lt=self.path).count()
+
+    def get_ancestors(self):
+        if not hasattr(self, '_parent'):
+            return super(Node, self).get_ancestors()
+        ancestors = []
+        node = self
+        while hasattr(node, '_parent'):
+            node = node._parent
+            if node is None:
+                break
+            ancestors.append(node)
+        else:
+            # The top of a prefetched subtree that isn't a whole tree.
+            ancestors.extend(reversed(list(super(Node, node).get_ancestors())))
+        ancestors.reverse()
+        return ancestors
 
     def get_root(self):
-        if hasattr(self, '_parent'):
-            if self._parent:
-                return self._parent.get_root()
-            else:
-                return self
-        return super(Node, self).get_root()
+        if not hasattr(self, '_parent'):
+            return super(Node, self).get_root()
+        node = self
+        while hasattr(node, '_parent'):
+            if node._parent is None:
+                return node
+            node = node._parent
+        return super(Node, node).get_root()
 
     def maybe_prefetch_tree(self):
         """
@@ -142,17 +242,28 @@ class Node(MP_Node):
         if not hasattr(self, '_children'):
             self.prefetch_tree()
 
-    def depth_first_order(self):
+    def iter_depth_first(self):
         """
-        All of the nodes in my tree (including myself) in depth-first order.
+        Iterates over all of the nodes in my tree (including myself) in
+        depth-first order. A prefetched tree is walked with a stack instead
+        of building a list for every subtree.
         """
         if hasattr(self, '_children'):
-            ret = [self]
-            for child in self.get_children():
-                ret.extend(child.depth_first_order())
-            return ret
+            stack = [self]
+            while stack:
+                node = stack.pop()
+                yield node
+                stack.extend(reversed(node.get_children()))
         else:
-            return [self] + list(self.get_descendants().order_by('path'))
+            yield self
+            for node in self.get_descendants().order_by('path'):
+                yield node
+
+    def depth_first_order(self):
+        """
+        All of the nodes in my tree (including myself) in depth-first order.
+        """
+        return list(self.iter_depth_first())
 
     @staticmethod
     def fetch_content_instances(nodes):
@@ -194,26 +305,79 @@ class Node(MP_Node):
         """
         Given a list of nodes, attach each one's Content. Efficiently.
         """
-        needed_nodes = [i for i in nodes if '_content_cache' not in i.__dict__]
+        needed_nodes = [i for i in nodes if not hasattr(i, '_content_cache')]
         contents = cls.fetch_content_instances(needed_nodes)
+        seen = set()
         for node in needed_nodes:
-            node.content = contents[node.content_type_id][node.content_id]
+            content = contents[node.content_type_id][node.content_id]
+            if id(content) in seen:
+                # the trees of commits share contents, every node gets its
+                # own instance
+                content = copy.copy(content)
+            seen.add(id(content))
+            node.content = content
         for node in nodes:
             node.content.node = node
         return nodes
 
+    @classmethod
+    def fetch_descendants(cls, root_nodes):
+        """
+        Fetches the descendants of many nodes at once, in as few queries as
+        possible. Returns a list with the descendants of each node in path
+        order. Nodes that are descendants of more than one of the
+        `root_nodes` are copied, so every tree gets its own instances.
+        """
+        trees = defaultdict(list)
+        for root_node in root_nodes:
+            trees[root_node.path].append([])
+        root_depths = sorted(set(i.depth for i in root_nodes))
+
+        paths = list(trees)
+        for i in range(0, len(paths), PREFETCH_TREES_BATCH_SIZE):
+            batch = paths[i:i + PREFETCH_TREES_BATCH_SIZE]
+            query = six.moves.reduce(operator.or_, (
+                models.Q(path__startswith=path, depth__gt=len(path) // cls.steplen)
+                for path in batch
+            ))
+            seen = set()
+            for node in cls.objects.filter(query).order_by('path'):
+                for depth in root_depths:
+                    if depth >= node.depth:
+                        break
+                    for descendants in trees.get(node.path[:depth * cls.steplen], ()):
+                        if node.pk in seen:
+                            descendants.append(copy.copy(node))
+                        else:
+                            seen.add(node.pk)
+                            descendants.append(node)
+
+        return [trees[root_node.path].pop() for root_node in root_nodes]
+
     @classmethod
     def prefetch_trees(cls, *root_nodes):
-        trees = [i.depth_first_order() for i in root_nodes]
+        """
+        Like :meth:`prefetch_tree`, but for many trees. The descendants of all
+        the trees are fetched together, and the content instances are fetched
+        with one query per content type for all of the trees.
+        """
+        unfetched = [i for i in root_nodes if not hasattr(i, '_children')]
+        descendants = dict(zip(map(id, unfetched), cls.fetch_descendants(unfetched)))
+
+        trees = []
+        for root_node in root_nodes:
+            if id(root_node) in descendants:
+                trees.append([root_node] + descendants[id(root_node)])
+            else:
+                trees.append(root_node.depth_first_order())
         cls.attach_content_instances(list(itertools.chain(*trees)))
         for tree in trees:
-            root_node = tree.pop(0)
+            root_node = tree[0]
             # This should get_depth() or is_root(), but both of those do
             # another query
             if root_node.depth == 1:
                 root_node._parent = None
-            root_node.consume_children(tree)
-            assert not tree, "all of the nodes should be consumed"
+            root_node.assemble_tree(itertools.islice(tree, 1, None))
 
     def prefetch_tree(self):
         """
@@ -223,30 +387,55 @@ class Node(MP_Node):
         """
         self.prefetch_trees(self)
 
-    def consume_children(self, descendants):
+    def prefetch_partial_tree(self, depth):
         """
-        Helper method to assign the proper children in the proper order to each
-        node
+        Like :meth:`prefetch_tree`, but only for `depth` levels of my
+        descendants. The nodes at the limit look like leaves, so this is
+        only meant for serializing with :meth:`to_json`.
+        """
+        descendants = list(Node.objects.filter(
+            path__startswith=self.path,
+            depth__gt=self.depth,
+            depth__lte=self.depth + depth,
+        ).order_by('path'))
+        self.attach_content_instances([self] + descendants)
+        if self.depth == 1:
+            self._parent = None
+        self.assemble_tree(descendants)
+
+    def assemble_tree(self, descendants):
+        """
+        Assigns the proper children in the proper order to each node in my
+        subtree. `descendants` must be all of my descendants in path order,
+        which is what the materialized path gives us for free.
+
+        We keep a stack of the nodes between me and the node we are looking
+        at, so this runs in linear time and never copies the list of
+        descendants. Every node also remembers its position among its
+        siblings, for :meth:`get_next_sibling` and :meth:`get_sibling_index`.
         """
         self._children = []
-
-        while descendants:
-            child = descendants[0]
-            if child.depth == self.depth + 1:
-                self._children.append(descendants.pop(0))
-                child._parent = self
-                child.consume_children(descendants)
-            else:
-                break
+        stack = [self]
+        for node in descendants:
+            while stack and stack[-1].depth >= node.depth:
+                stack.pop()
+            assert stack and stack[-1].depth == node.depth - 1, \
+                "descendants must be a complete subtree in path order"
+            parent = stack[-1]
+            node._parent = parent
+            node._children = []
+            node._sibling_index = len(parent._children)
+            parent._children.append(node)
+            stack.append(node)
 
     def get_api_url(self, site):
-        return site.reverse(site.node_view, kwargs={'node_pk': self.pk})
+        return site.cached_reverse(site.node_view, kwargs={'node_pk': self.pk})
 
     def get_available_children_url(self, site):
-        return site.reverse(site.shelf_view, kwargs={'node_pk': self.pk})
+        return site.cached_reverse(site.shelf_view, kwargs={'node_pk': self.pk})
 
     def get_possible_parents_url(self, site):
-        return site.reverse(site.node_parents_view, kwargs={'node_pk': self.pk})
+        return site.cached_reverse(site.node_parents_view, kwargs={'node_pk': self.pk})
 
     def filter_child_classes(self, site, classes):
         """
@@ -285,7 +474,7 @@ class Node(MP_Node):
         return [i for i in all_nodes if validator(i.content) and i not in my_family]
 
     @transaction.atomic(savepoint=False)
-    def clone_tree(self, freeze=True, new_page=False):
+    def clone_tree(self, freeze=True, new_page=False, share_with=None):
         """
         1. new_root <- root_node
         2. new_root.content <- Clone(root_node.content)
@@ -297,34 +486,90 @@ class Node(MP_Node):
             iii. cloned_content <- child.content
             iv. content_id <- cloned_content.pk
         6. Issue a bulk_create for children.
+
+        The contents are cloned with :func:`clone_contents`, so the ones
+        that don't override ``clone`` are inserted with a query per model.
+
+        `share_with` is another frozen tree, usually the previous commit's.
+        The subtrees that are the same in it (they have the same digest) are
+        not cloned, their nodes point at its contents instead. Only the
+        widgets that changed and their ancestors are cloned.
         """
         # This method only supports cloning an entire tree. We don't need it
         # for versioning, and I'm not sure what the semantics would be.
-        if new_page:
-            content_clone_method = 'clone_new_page'
-        else:
-            content_clone_method = 'clone'
-
         cls = self.__class__
         assert self.depth == 1
+        assert share_with is None or freeze, "only frozen trees can share contents"
         self.maybe_prefetch_tree()
+        digests = self.refresh_digests()
+        nodes = self.depth_first_order()
+
+        # (content_type_id, content_id) of every node, None for the ones
+        # that have to be cloned
+        shared = [None] * len(nodes)
+        if share_with is not None:
+            shared_subtrees = share_with.get_shared_subtrees()
+            # a content is only used once in a tree
+            used = set()
+            i = 0
+            while i < len(nodes):
+                for subtree in shared_subtrees.get(digests[nodes[i].pk], ()):
+                    if used.isdisjoint(subtree):
+                        used.update(subtree)
+                        shared[i:i + len(subtree)] = subtree
+                        i += len(subtree)
+                        break
+                else:
+                    i += 1
+
+        to_clone = [node.content for node, ids in zip(nodes, shared) if ids is None]
+        clones = iter(clone_contents(to_clone, new_page))
+
+        def content_kwargs(ids):
+            if ids is None:
+                return {'content': next(clones)}
+            return {'content_type_id': ids[0], 'content_id': ids[1]}
+
         new_root = cls.add_root(
-            content=getattr(self.content, content_clone_method)(),
             numchild=self.numchild,
             is_frozen=freeze,
+            digest=digests[self.pk],
+            **content_kwargs(shared[0])
         )
         children_to_create = []
-        for child in self.depth_first_order()[1:]:
+        for child, ids in zip(nodes[1:], shared[1:]):
             children_to_create.append(Node(
-                content=getattr(child.content, content_clone_method)(),
                 path=new_root.path + child.path[cls.steplen:],
                 is_frozen=freeze,
                 depth=child.depth,
                 numchild=child.numchild,
+                digest=digests[child.pk],
+                **content_kwargs(ids)
             ))
         cls.objects.bulk_create(children_to_create)
         return new_root
 
+    def get_shared_subtrees(self):
+        """
+        The subtrees of my tree that :meth:`clone_tree` can share, by
+        digest. Each is the list of the ``(content_type_id, content_id)`` of
+        its nodes in depth-first order. It takes one query, the contents
+        aren't fetched.
+        """
+        rows = list(self.__class__.objects.filter(
+            path__startswith=self.path,
+        ).order_by('path').values_list('depth', 'digest', 'content_type_id', 'content_id'))
+
+        ret = defaultdict(list)
+        for i, (depth, digest, content_type_id, content_id) in enumerate(rows):
+            if not digest:
+                continue
+            end = i + 1
+            while end < len(rows) and rows[end][0] > depth:
+                end += 1
+            ret[digest].append([row[2:] for row in rows[i:end]])
+        return ret
+
     def check_frozen(self):
         if self.is_frozen:
             raise InvalidOperation({'message': "This widget is uneditable."})
@@ -332,22 +577,232 @@ class Node(MP_Node):
     @transaction.atomic(savepoint=False)
     def delete(self, *args, **kwargs):
         self.check_frozen()
+        self.invalidate_digests()
         return super(Node, self).delete(*args, **kwargs)
 
     @transaction.atomic(savepoint=False)
     def add_child(self, *args, **kwargs):
         self.check_frozen()
-        return super(Node, self).add_child(*args, **kwargs)
+        node = super(Node, self).add_child(*args, **kwargs)
+        node.invalidate_digests()
+        return node
+
+    @transaction.atomic(savepoint=False)
+    def add_children(self, contents):
+        """
+        Adds a whole subtree below me at once. `contents` is a list of
+        ``(content, children)`` pairs, where `children` is a list of the
+        same shape, and every content must already be saved. The paths are
+        allocated in memory, all of the nodes are inserted with one query
+        and my numchild is only updated once.
+
+        Returns my new children, with their subtrees assembled like
+        :meth:`prefetch_tree` does.
+        """
+        self.check_frozen()
+        cls = self.__class__
+        max_length = cls._meta.get_field('path').max_length
+        new_nodes = []
+
+        def build(parent, contents, position, first_index=0):
+            children = []
+            for content, grandchildren in contents:
+                position += 1
+                depth = parent.depth + 1
+                path = cls._get_path(parent.path, depth, position)
+                if len(path) != depth * cls.steplen or len(path) > max_length:
+                    raise PathOverflow("Path Overflow from: '%s'" % parent.path)
+                node = cls(path=path, depth=depth, numchild=len(grandchildren), content=content)
+                content.node = node
+                node._parent = parent
+                node._sibling_index = first_index + len(children)
+                new_nodes.append(node)
+                children.append(node)
+                node._children = build(node, grandchildren, 0)
+            return children
+
+        # the new children go after the ones I already have
+        if hasattr(self, '_children'):
+            first_index = len(self._children)
+            last_child = self._children[-1] if self._children else None
+        else:
+            first_index = self.numchild
+            last_child = None if self.is_leaf() else self.get_last_child()
+        position = last_child._get_lastpos_in_path() if last_child else 0
+        children = build(self, contents, position, first_index)
+        if not children:
+            return children
+
+        # new_nodes is in depth-first order, so every child comes before
+        # its parent when reversed.
+        for node in reversed(new_nodes):
+            node.digest = node.compute_digest(i.digest for i in node._children)
+        cls.objects.bulk_create(new_nodes)
+        if new_nodes[0].pk is None:
+            # The database can't return the ids of the inserted rows, but
+            # the new nodes are the last ones in my subtree.
+            pks = dict(cls.objects.filter(
+                path__startswith=self.path,
+                depth__gt=self.depth,
+                path__gte=new_nodes[0].path,
+            ).values_list('path', 'pk'))
+            for node in new_nodes:
+                node.pk = pks[node.path]
+
+        cls.objects.filter(pk=self.pk).update(numchild=models.F('numchild') + len(children))
+        self.numchild += len(children)
+        if hasattr(self, '_children'):
+            self._children.extend(children)
+        self.invalidate_digests()
+        return children
 
     @transaction.atomic(savepoint=False)
     def add_sibling(self, *args, **kwargs):
         self.check_frozen()
-        return super(Node, self).add_sibling(*args, **kwargs)
+        node = super(Node, self).add_sibling(*args, **kwargs)
+        node.invalidate_digests()
+        return node
 
     @transaction.atomic(savepoint=False)
     def move(self, *args, **kwargs):
         self.check_frozen()
-        return super(Node, self).move(*args, **kwargs)
+        # Moving changes the paths of other nodes, so the old ancestors have
+        # to be invalidated before.
+        self.invalidate_digests()
+        ret = super(Node, self).move(*args, **kwargs)
+        moved = self.__class__.objects.get(pk=self.pk)
+        moved.refresh_ancestor_digests()
+        return ret
+
+    def invalidate_digests(self):
+        """
+        Marks the digests of my ancestors and me as out of date. This must be
+        called whenever something in my subtree changes.
+        """
+        paths = [self.path[:i * self.steplen] for i in range(1, self.depth + 1)]
+        self.__class__.objects.filter(path__in=paths).update(digest='')
+        self.digest = ''
+
+    def compute_digest(self, child_digests):
+        """
+        My digest, given the digests of my children.
+        """
+        content_type = ContentType.objects.get_for_id(self.content_type_id)
+        content = self.content
+        attributes = content and content.get_attributes()
+        digest = hashlib.sha1()
+        digest.update(force_bytes('%s.%s\0' % (content_type.app_label, content_type.model)))
+        digest.update(force_bytes(json.dumps(attributes, sort_keys=True, cls=DigestJSONEncoder)))
+        for child_digest in child_digests:
+            digest.update(b'\0')
+            digest.update(force_bytes(child_digest))
+        return digest.hexdigest()
+
+    def refresh_digests(self):
+        """
+        Recomputes the digests that are out of date in my subtree. Returns a
+        dictionary of the digest of every node in the subtree, by pk.
+
+        Only the nodes that changed since the last refresh need their
+        contents fetched, so this is cheap if the tree was refreshed
+        recently. A prefetched tree doesn't need any queries unless some of
+        it is out of date.
+        """
+        return self.refresh_subtree_digests(self)
+
+    @classmethod
+    def refresh_subtree_digests(cls, *subtree_roots):
+        """
+        Like :meth:`refresh_digests`, but for many subtrees. The ones that
+        aren't prefetched are fetched together, and the digests are saved
+        with one query.
+        """
+        prefetched = [i for i in subtree_roots if hasattr(i, '_children')]
+        unfetched = [i for i in subtree_roots if not hasattr(i, '_children')]
+        nodes = list(itertools.chain.from_iterable(i.depth_first_order() for i in prefetched))
+        if unfetched:
+            query = models.Q()
+            for root in unfetched:
+                query |= models.Q(path__startswith=root.path, depth__gte=root.depth)
+            nodes.extend(cls.objects.filter(query))
+        nodes.sort(key=lambda i: i.path)
+
+        children = defaultdict(list)
+        for node in nodes:
+            children[node.path[:-cls.steplen]].append(node)
+        stale = [i for i in nodes if not i.digest]
+        if stale:
+            cls.attach_content_instances(stale)
+            for node in sorted(stale, key=lambda i: -i.depth):
+                node.digest = node.compute_digest(i.digest for i in children[node.path])
+        for root in prefetched:
+            if root not in stale:
+                # The root was probably fetched before its descendants were,
+                # so its digest can be older than theirs. Its content is
+                # already here, checking it is free.
+                digest = root.compute_digest(i.digest for i in root._children)
+                if digest != root.digest:
+                    root.digest = digest
+                    stale.append(root)
+        if stale:
+            cls.save_digests(stale)
+
+        digests = dict((i.pk, i.digest) for i in nodes)
+        for root in subtree_roots:
+            root.digest = digests[root.pk]
+        return digests
+
+    def refresh_ancestor_digests(self):
+        """
+        Recomputes the digests of my ancestors and me after something in my
+        subtree changed. Only the ancestors and their children are fetched,
+        children that are out of date have their subtrees refreshed, and
+        only the digests that changed are saved. Returns the new digests, by
+        pk.
+        """
+        cls = self.__class__
+        paths = [self.path[:i * cls.steplen] for i in range(1, self.depth + 1)]
+        query = models.Q(path=paths[0])
+        for path in paths:
+            query |= models.Q(path__startswith=path, depth=len(path) // cls.steplen + 1)
+        nodes = sorted(cls.objects.filter(query), key=lambda i: i.path)
+
+        by_path = dict((i.path, i) for i in nodes)
+        ancestors = [by_path[path] for path in paths]
+        children = defaultdict(list)
+        for node in nodes:
+            children[node.path[:-cls.steplen]].append(node)
+        stale = [i for i in nodes if not i.digest and i.path not in paths]
+        if stale:
+            cls.refresh_subtree_digests(*stale)
+
+        old_digests = [i.digest for i in ancestors]
+        # my own content is usually here already
+        cls.attach_content_instances(ancestors[:-1])
+        self.digest = ancestors[-1].digest = self.compute_digest(
+            i.digest for i in children[self.path])
+        for node in reversed(ancestors[:-1]):
+            node.digest = node.compute_digest(i.digest for i in children[node.path])
+        changed = [i for i, old in zip(ancestors, old_digests) if i.digest != old]
+        if changed:
+            cls.save_digests(changed)
+        return dict((i.pk, i.digest) for i in ancestors)
+
+    @classmethod
+    def save_digests(cls, nodes):
+        """
+        Saves the digests of `nodes` with one query.
+        """
+        cls.objects.filter(pk__in=[i.pk for i in nodes]).update(digest=models.Case(
+            *[models.When(pk=i.pk, then=models.Value(i.digest)) for i in nodes],
+            output_field=models.CharField()
+        ))
+
+    def get_digest(self):
+        """
+        The up to date digest of my subtree.
+        """
+        return self.refresh_digests()[self.pk]
 
     def trees_equal(self, other):
         if self.content_type_id != other.content_type_id:
@@ -388,6 +843,180 @@ class Node(MP_Node):
         return dangling, unknown
 
 
+class DigestJSONEncoder(DjangoJSONEncoder):
+    """
+    Serializes the attributes of a widget for Node.compute_digest. Values
+    that JSON doesn't know about, like files, are converted to text.
+    """
+    def default(self, o):
+        try:
+            return super(DigestJSONEncoder, self).default(o)
+        except TypeError:
+            return force_text(o)
+
+
+def save_contents(contents):
+    """
+    Saves many new content instances, with one query per model when the
+    database can tell us the ids of the inserted rows.
+    """
+    by_model = OrderedDict()
+    for obj in contents:
+        if can_bulk_create(type(obj)):
+            by_model.setdefault(type(obj)._meta.concrete_model, []).append(obj)
+        else:
+            obj.save()
+    for model, objs in by_model.items():
+        bulk_create(model, objs)
+
+
+def clone_contents(contents, new_page=False):
+    """
+    Clones many content instances, like calling ``clone`` (or
+    ``clone_new_page``) on each of them. The classes that override those
+    methods are cloned one at a time, the others with one query per model
+    and one per many-to-many field. Returns the clones in the same order.
+    """
+    method = 'clone_new_page' if new_page else 'clone'
+    clones = []
+    by_model = OrderedDict()
+    for obj in contents:
+        if can_bulk_clone(type(obj), method):
+            new = obj._copy_for_clone()
+            by_model.setdefault(type(obj)._meta.concrete_model, []).append((obj, new))
+        else:
+            new = getattr(obj, method)()
+        clones.append(new)
+
+    for model, pairs in by_model.items():
+        bulk_create(model, [new for obj, new in pairs])
+        new_pks = dict((obj.pk, new.pk) for obj, new in pairs)
+        for f in model._meta.many_to_many:
+            through = f.remote_field.through
+            source = through._meta.get_field(f.m2m_field_name()).attname
+            target = through._meta.get_field(f.m2m_reverse_field_name()).attname
+            rows = through._base_manager.filter(**{
+                '%s__in' % source: list(new_pks),
+            }).values_list(source, target)
+            through._base_manager.bulk_create([
+                through(**{source: new_pks[pk], target: target_pk})
+                for pk, target_pk in rows
+            ])
+    return clones
+
+
+def can_bulk_clone(cls, method):
+    """
+    Whether the clone `method` of `cls` can be replaced by clone_contents.
+    """
+    unbound = six.get_unbound_function
+    return (
+        all(unbound(getattr(cls, name)) is unbound(getattr(Content, name))
+            for name in set(['clone', method])) and
+        all(f.remote_field.through._meta.auto_created for f in cls._meta.many_to_many) and
+        can_bulk_create(cls)
+    )
+
+
+def can_bulk_create(cls):
+    """
+    bulk_create doesn't call save() and it doesn't work for multi-table
+    inheritance.
+    """
+    connection = connections[router.db_for_write(cls)]
+    return (
+        connection.features.can_return_ids_from_bulk_insert and
+        all(i._meta.concrete_model is cls._meta.concrete_model
+            for i in cls._meta.get_parent_list()) and
+        six.get_unbound_function(cls.save) is six.get_unbound_function(Content.save)
+    )
+
+
+def bulk_create(model, objs):
+    """
+    Inserts `objs` with one query, sending pre_save and post_save for each of
+    them like saving them one at a time would.
+    """
+    using = router.db_for_write(model)
+    for obj in objs:
+        models.signals.pre_save.send(sender=type(obj), instance=obj, raw=False,
+                                     using=using, update_fields=None)
+    model._base_manager.using(using).bulk_create(objs)
+    for obj in objs:
+        models.signals.post_save.send(sender=type(obj), instance=obj, created=True,
+                                      raw=False, using=using, update_fields=None)
+
+
+def overrides_delete(cls):
+    return (cls is None or
+            six.get_unbound_function(cls.delete) is not six.get_unbound_function(Content.delete))
+
+
+@transaction.atomic
+def delete_trees(root_nodes, raw=False):
+    """
+    Deletes the widgets in the subtrees of `root_nodes`, like calling
+    Content.delete on each of their contents, with a few queries for all of
+    them: the nodes are deleted by path and the contents with one query per
+    class. Widgets below the roots that override delete are deleted one at a
+    time, before the others.
+
+    pre_delete_widgets is sent once per class with all of its instances.
+    pre_delete_widget is still sent for each widget that has receivers.
+    """
+    if not root_nodes:
+        return
+
+    def collect():
+        trees = Node.fetch_descendants(root_nodes)
+        nodes = list(itertools.chain.from_iterable(
+            [root_node] + descendants for root_node, descendants in zip(root_nodes, trees)))
+        return Node.attach_content_instances(nodes)
+
+    nodes = collect()
+    root_pks = set(i.pk for i in root_nodes)
+    overridden = [i for i in nodes if i.pk not in root_pks and overrides_delete(type(i.content))]
+    if overridden:
+        handled = []
+        for node in overridden:
+            if not any(node.path.startswith(i.path) for i in handled):
+                node.content.delete(raw)
+                handled.append(node)
+        # What's left of those widgets (if they were taken out of the tree,
+        # nothing) goes away with the nodes of the roots.
+        handled_pks = set(i.pk for i in handled)
+        nodes = collect()
+        handled_paths = [i.path for i in nodes if i.pk in handled_pks]
+        nodes = [i for i in nodes if not any(i.path.startswith(path) for path in handled_paths)]
+
+    # the trees of commits can share contents
+    contents = list(OrderedDict(
+        ((type(i.content), i.content.pk), i.content) for i in nodes
+    ).values())
+    by_class = OrderedDict()
+    for obj in contents:
+        by_class.setdefault(type(obj), []).append(obj)
+    for cls, instances in by_class.items():
+        pre_delete_widgets.send(cls, instances=instances, raw=raw)
+    for obj in contents:
+        if pre_delete_widget.has_listeners(type(obj)):
+            pre_delete_widget.send(type(obj), instance=obj, raw=raw)
+
+    ancestor_paths = set()
+    for node in root_nodes:
+        ancestor_paths.update(node.path[:i * Node.steplen] for i in range(1, node.depth))
+    if ancestor_paths:
+        Node.objects.filter(path__in=ancestor_paths).update(digest='')
+    Node.objects.filter(pk__in=root_pks).delete()
+
+    for cls, instances in by_class.items():
+        pks = [i.pk for i in instances]
+        for i in range(0, len(pks), DELETE_BATCH_SIZE):
+            cls._base_manager.filter(pk__in=pks[i:i + DELETE_BATCH_SIZE]).delete()
+    for obj in contents:
+        setattr(obj, obj._meta.pk.attname, None)
+
+
 def check_frozen(sender, instance, **kwargs):
     instance.check_frozen()
 
@@ -420,6 +1049,13 @@ class Content(models.Model):
 
     component_name = 'widget'
 
+    # Whether the rendered output of a frozen widget can be stored in the
+    # site's fragment cache. Widgets whose output depends on the request or
+    # on anything else that isn't frozen along with them should set this to
+    # False. Their ancestors won't be cached either, but the rest of the tree
+    # will be.
+    cacheable = True
+
     CANNOT_POP_OUT = 0
     CAN_POP_OUT = 1
     MUST_POP_OUT = 2
@@ -439,12 +1075,12 @@ class Content(models.Model):
         self.formfield_overrides = overrides
 
     def get_api_url(self, site):
-        return site.reverse(site.content_view, kwargs={
+        return site.cached_reverse(site.content_view, kwargs={
             'object_name': self._meta.model_name,
             'app_label': self._meta.app_label,
             'object_pk': self.pk})
 
-    def to_json(self, site):
+    def to_json(self, site, preview=True):
         node_pk_kwargs = {'node_pk': self.node.pk}
         data = {
             'url': self.get_api_url(site),
@@ -456,16 +1092,17 @@ class Content(models.Model):
             'draggable': self.draggable,
             'deletable': self.deletable,
             'accepting_children': self.accepting_children,
-            'template_url': site.reverse(site.node_templates_view, kwargs=node_pk_kwargs),
-            'preview_template': self.get_preview_template(site),
+            'template_url': site.cached_reverse(site.node_templates_view, kwargs=node_pk_kwargs),
             'pop_out': self.pop_out,
             'shelf': self.shelf,
             'attributes': self.get_attributes(),
             'form_prefix': self.get_form_prefix(),
             'display_name': self.display_name,
         }
+        if preview:
+            data['preview_template'] = self.get_preview_template(site)
         if self.editable:
-            data['edit_url'] = site.reverse(site.node_edit_view, kwargs=node_pk_kwargs)
+            data['edit_url'] = site.cached_reverse(site.node_edit_view, kwargs=node_pk_kwargs)
         return data
 
     def get_attributes(self):
@@ -523,14 +1160,23 @@ class Content(models.Model):
     def node(self):
         """
         Settable property used by Node.prefetch_tree to optimize tree
-        rendering
+        rendering. A frozen content can be in the trees of several commits
+        (see VersionTracker.structural_sharing). Which of its nodes is meant
+        is only known when it was fetched through one of them, otherwise
+        this raises Node.MultipleObjectsReturned instead of guessing, and
+        everything that uses the node (urls, get_root, delete) fails the
+        same way.
         """
         if hasattr(self, '_node'):
             return self._node
-        try:
-            return self._nodes.all()[0]
-        except IndexError:
+        nodes = list(self._nodes.all()[:2])
+        if not nodes:
             raise Node.DoesNotExist
+        if len(nodes) > 1:
+            raise Node.MultipleObjectsReturned(
+                "%s %s is in the trees of several commits, fetch it through one of its nodes" % (
+                    self._meta.label, self.pk))
+        return nodes[0]
 
     @node.setter
     def node(self, value):
@@ -547,6 +1193,55 @@ class Content(models.Model):
         nodes = Node.attach_content_instances(self.node.depth_first_order())
         return [node.content for node in nodes]
 
+    def iter_depth_first(self, cls=None):
+        """
+        Iterates over the contents of my tree (including myself) in
+        depth-first order, only yielding instances of ``cls`` if it is
+        given. When the tree hasn't been prefetched, only the contents of
+        the models that can match are fetched.
+        """
+        node = self.node
+        if hasattr(node, '_children'):
+            for child in node.iter_depth_first():
+                if cls is None or isinstance(child.content, cls):
+                    yield child.content
+            return
+
+        nodes = node.depth_first_order()
+        if cls is not None:
+            nodes = [i for i in nodes if self._content_type_is(i.content_type_id, cls)]
+        for child in Node.attach_content_instances(nodes):
+            if cls is None or isinstance(child.content, cls):
+                yield child.content
+
+    @staticmethod
+    def _content_type_is(content_type_id, cls):
+        model_class = ContentType.objects.get_for_id(content_type_id).model_class()
+        # unknown widgets are fetched like before, they are filtered out
+        # once they are instantiated
+        return model_class is None or issubclass(model_class, cls)
+
+    def get_descendants_of_type(self, cls):
+        """
+        Returns a list of the contents in my tree (including myself) that
+        are instances of ``cls``, in depth-first order. On a prefetched tree
+        the list is remembered on my node, so asking for the same type again
+        doesn't walk the tree, and a copy of it is returned. Like the
+        prefetched tree itself, it isn't updated when the tree changes.
+        """
+        node = self.node
+        if not hasattr(node, '_children'):
+            return list(self.iter_depth_first(cls))
+        try:
+            memo = node._descendants_memo
+        except AttributeError:
+            memo = node._descendants_memo = {}
+        try:
+            ret = memo[cls]
+        except KeyError:
+            ret = memo[cls] = list(self.iter_depth_first(cls))
+        return list(ret)
+
     def get_children(self):
         node_children = Node.attach_content_instances(self.node.get_children())
         return [node.content for node in node_children]
@@ -584,6 +1279,15 @@ class Content(models.Model):
         form_kwargs.setdefault('instance', self)
         return form_class(**form_kwargs)
 
+    # Compatibility rules that only depend on the classes involved (not on
+    # instance state, the tree or `obj`) can be declared static, so
+    # WidgySite can remember their results for each pair of classes. See
+    # `has_static_rule`. The default valid_parent_of depends on
+    # accepting_children, which can be instance state, so the default rules
+    # aren't static.
+    static_valid_parent_of = False
+    static_valid_child_of = False
+
     def valid_parent_of(self, cls, obj=None):
         """
         Given a content class, can it be _added_ as our child?
@@ -598,6 +1302,20 @@ class Content(models.Model):
         """
         return True
 
+    @classmethod
+    def has_static_rule(cls, name):
+        """
+        Is my `name` rule (``'valid_parent_of'`` or ``'valid_child_of'``)
+        declared static? Only the class that defines the method can declare
+        it, so inheriting a rule from a class that didn't declare it, or
+        overriding a rule without declaring it static again, makes it
+        dynamic.
+        """
+        for klass in cls.__mro__:
+            if name in klass.__dict__:
+                return klass.__dict__.get('static_' + name, False)
+        return False
+
     @classmethod
     @transaction.atomic
     def add_root(cls, site, **kwargs):
@@ -606,15 +1324,16 @@ class Content(models.Model):
         ``Node.add_root``
         """
         obj = cls.objects.create(**kwargs)
-        Node.add_root(content=obj)
+        node = Node.add_root(content=obj)
         obj.post_create(site)
+        node.refresh_ancestor_digests()
         return obj
 
     @transaction.atomic
     def add_child(self, site, cls, **kwargs):
         self.check_frozen()
         obj = cls.objects.create(**kwargs)
-        self.node.add_child(content=obj)
+        node = self.node.add_child(content=obj)
 
         try:
             site.validate_relationship(self, obj)
@@ -623,8 +1342,75 @@ class Content(models.Model):
             raise
 
         obj.post_create(site)
+        node.refresh_ancestor_digests()
         return obj
 
+    @transaction.atomic
+    def add_children(self, site, children):
+        """
+        Adds many children at once. `children` is a list of ``(cls,
+        kwargs)`` pairs, like the arguments of :meth:`add_child`. The
+        children that the new widgets would add in post_create are built
+        along with them when :meth:`get_bulk_children` allows it, so the
+        whole subtree is inserted with a query per content class and one for
+        the nodes. post_create is called for the other widgets.
+
+        Returns the new children.
+        """
+        self.check_frozen()
+        had_node = hasattr(self, '_node')
+        node = self.node
+        pending = []
+
+        def build(children):
+            subtree = []
+            for cls, kwargs in children:
+                obj = cls(**kwargs)
+                grandchildren = obj.get_bulk_children()
+                if grandchildren is None:
+                    pending.append(obj)
+                    grandchildren = []
+                subtree.append((obj, build(grandchildren)))
+            return subtree
+
+        def contents(subtree):
+            for obj, grandchildren in subtree:
+                yield obj
+                for i in contents(grandchildren):
+                    yield i
+
+        subtree = build(children)
+        save_contents(list(contents(subtree)))
+        was_leaf = node.is_leaf()
+        new_nodes = node.add_children(subtree)
+        new_descendants = list(itertools.chain.from_iterable(
+            i.depth_first_order() for i in new_nodes))
+
+        # The new subtree is assembled in memory, so validating it doesn't
+        # need any queries.
+        self.node = node
+        if was_leaf:
+            node._children = new_nodes
+        try:
+            for child in new_nodes:
+                site.validate_relationship(self, child.content)
+                child.content._recheck_children(site)
+        finally:
+            if not had_node:
+                del self._node
+            if was_leaf:
+                del node._children
+            # post_create may change the tree, which would make these stale.
+            for i in new_descendants:
+                del i._children
+                del i._parent
+                del i._sibling_index
+
+        for obj in pending:
+            obj.post_create(site)
+        node.refresh_ancestor_digests()
+        return [i.content for i in new_nodes]
+
     @transaction.atomic
     def add_sibling(self, site, cls, **kwargs):
         self.check_frozen()
@@ -632,7 +1418,7 @@ class Content(models.Model):
             raise RootDisplacementError({'message': 'You can\'t put things next to me'})
 
         obj = cls.objects.create(**kwargs)
-        self.node.add_sibling(content=obj, pos='left')
+        node = self.node.add_sibling(content=obj, pos='left')
         parent = self.node.get_parent().content
 
         try:
@@ -642,6 +1428,7 @@ class Content(models.Model):
             raise
 
         obj.post_create(site)
+        node.refresh_ancestor_digests()
         return obj
 
     def post_create(self, site):
@@ -652,8 +1439,35 @@ class Content(models.Model):
         """
         pass
 
+    def get_bulk_children(self):
+        """
+        The children that :meth:`post_create` would add, as ``(cls, kwargs)``
+        pairs, when :meth:`add_children` can build them along with me
+        instead of calling post_create. None means post_create has to be
+        called.
+        """
+        post_create = six.get_unbound_function(type(self).post_create)
+        if post_create is six.get_unbound_function(Content.post_create):
+            return []
+        return None
+
     @classmethod
     def get_templates_hierarchy(cls, **kwargs):
+        try:
+            key = (cls, tuple(sorted(kwargs.items())))
+            hash(key)
+        except TypeError:
+            # unhashable arguments
+            return cls.build_templates_hierarchy(**kwargs)
+        try:
+            templates = TEMPLATES_HIERARCHY_CACHE[key]
+        except KeyError:
+            templates = TEMPLATES_HIERARCHY_CACHE[key] = cls.build_templates_hierarchy(**kwargs)
+        # a copy, in case the caller modifies it
+        return list(templates)
+
+    @classmethod
+    def build_templates_hierarchy(cls, **kwargs):
         templates = kwargs.get('hierarchy', (
             'widgy/{app_label}/{model_name}/{template_name}{extension}',
             'widgy/{app_label}/{template_name}{extension}',
@@ -712,15 +1526,15 @@ class Content(models.Model):
         if not context:
             context = RequestContext(request)
         with update_context(context, {'form': self.get_form(request, prefix=self.get_form_prefix())}):
-            return render_to_string(template or self.edit_templates, context.flatten())
+            return select_template(template or self.edit_templates).render(context.flatten())
 
     def get_preview_template(self, site):
         """
         :Returns: Rendered preview template.
         """
-        return render_to_string(self.preview_templates, {
+        return select_template(self.preview_templates).render({
             'self': self,
-            'edit_url': site.reverse(site.node_edit_view, kwargs={
+            'edit_url': site.cached_reverse(site.node_edit_view, kwargs={
                 'node_pk': self.node.pk,
             }),
             'site': site,
@@ -732,10 +1546,67 @@ class Content(models.Model):
         instead of the default template list.
         """
         with update_context(context, {'self': self}):
-            return render_to_string(
+            return select_template(
                 template or self.get_render_templates(context),
-                context.flatten(),
-            )
+            ).render(context.flatten())
+
+    def get_cache_vary(self, context):
+        """
+        Values besides the ones from
+        :meth:`~widgy.site.WidgySite.get_fragment_cache_vary` that my rendered
+        output depends on.  Anything cached for my ancestors will vary on them
+        too.
+        """
+        return ()
+
+    def get_fragment_cache_info(self):
+        """
+        Returns a tuple of whether my subtree can be cached, and the widgets
+        in my subtree that override :meth:`get_cache_vary`.
+        """
+        try:
+            return self._fragment_cache_info
+        except AttributeError:
+            pass
+
+        cacheable = self.cacheable
+        varying = []
+        if six.get_unbound_function(type(self).get_cache_vary) is not \
+                six.get_unbound_function(Content.get_cache_vary):
+            varying.append(self)
+        for child in self.get_children():
+            child_cacheable, child_varying = child.get_fragment_cache_info()
+            cacheable = cacheable and child_cacheable
+            varying.extend(child_varying)
+
+        self._fragment_cache_info = (cacheable, varying)
+        return self._fragment_cache_info
+
+    def cached_render(self, context):
+        """
+        Like :meth:`render`, but if my tree is frozen, the output is stored
+        in the site's fragment cache.
+        """
+        widgy = context and context.get('widgy')
+        site = isinstance(widgy, dict) and widgy.get('site')
+        cache = site and site.get_fragment_cache()
+        if not cache or not self.node.is_frozen:
+            return self.render(context)
+
+        cacheable, varying = self.get_fragment_cache_info()
+        if not cacheable:
+            return self.render(context)
+
+        vary = tuple(site.get_fragment_cache_vary(context))
+        vary += tuple(content.get_cache_vary(context) for content in varying)
+        key = 'widgy-fragment:%s:%s' % (
+            self.node.pk, hashlib.md5(force_bytes(repr(vary))).hexdigest())
+
+        rendered = cache.get(key)
+        if rendered is None:
+            rendered = self.render(context)
+            cache.set(key, rendered, site.fragment_cache_timeout)
+        return rendered
 
     def formfield_for_dbfield(self, db_field, **kwargs):
         """
@@ -809,11 +1680,20 @@ class Content(models.Model):
     @transaction.atomic
     def delete(self, raw=False):
         self.check_frozen()
-        pre_delete_widget.send(self.__class__, instance=self, raw=raw)
-        for child in self.get_children():
-            child.delete(raw)
-        self.node.delete()
-        super(Content, self).delete()
+        node = self.node
+        node.content = self
+        delete_trees([node], raw)
+
+    def _copy_for_clone(self):
+        new = copy.copy(self)
+        unset_pks(new)
+        try:
+            # Contents keep a cached copy of their Node. After the clone the
+            # cache is invalid.
+            del new._node
+        except AttributeError:
+            pass
+        return new
 
     def clone_new_page(self):
         """
@@ -833,14 +1713,7 @@ class Content(models.Model):
         # TODO: Maybe provide support for many-to-many relationships too, or
         # document that you should provide your own clone()
         # See https://code.djangoproject.com/ticket/4027
-        new = copy.copy(self)
-        unset_pks(new)
-        try:
-            # Contents keep a cached copy of their Node. After the clone the
-            # cache is invalid.
-            del new._node
-        except AttributeError:
-            pass
+        new = self._copy_for_clone()
         new.save()
 
         for f in self._meta.many_to_many:
@@ -853,7 +1726,22 @@ class Content(models.Model):
 
     def save(self, *args, **kwargs):
         self.check_frozen()
-        return super(Content, self).save(*args, **kwargs)
+        adding = self._state.adding or self.pk is None
+        ret = super(Content, self).save(*args, **kwargs)
+        if not adding:
+            self.update_digests()
+        return ret
+
+    def update_digests(self):
+        """
+        Recomputes the digests of my node and its ancestors after my
+        attributes have changed.
+        """
+        try:
+            node = self.node
+        except Node.DoesNotExist:
+            return
+        node.refresh_ancestor_digests()
 
     def check_frozen(self):
         if not self.pk:
@@ -868,6 +1756,26 @@ class Content(models.Model):
         return self.get_attributes() == other.get_attributes()
 
 
+def update_m2m_digests(sender, instance, action, reverse, model, pk_set, **kwargs):
+    """
+    Many-to-many fields are part of a widget's attributes, so changing them
+    changes the digest.
+    """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        contents = [instance]
+    elif issubclass(model, Content) and pk_set:
+        contents = model.objects.filter(pk__in=pk_set)
+    else:
+        return
+    for content in contents:
+        if isinstance(content, Content) and content.pk:
+            content.update_digests()
+
+models.signals.m2m_changed.connect(update_m2m_digests)
+
+
 class UnknownWidget(Content):
     """
     A placeholder Content class used when the correct one can't be found. For
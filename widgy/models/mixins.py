@@ -21,9 +21,23 @@ class DefaultChildrenMixin(object):
     """
     default_children = tuple()
 
+    def get_default_children(self):
+        """
+        The children to add, as ``(cls, kwargs)`` pairs for
+        Content.add_children.
+        """
+        return [(cls, kwargs) for cls, args, kwargs in self.default_children]
+
     def post_create(self, site):
-        for cls, args, kwargs in self.default_children:
-            self.add_child(site, cls, *args, **kwargs)
+        self.add_children(site, self.get_default_children())
+
+    def get_bulk_children(self):
+        # The default children of default children can be built all at once,
+        # unless post_create has been overridden to do something else.
+        post_create = six.get_unbound_function(type(self).post_create)
+        if post_create is six.get_unbound_function(DefaultChildrenMixin.post_create):
+            return self.get_default_children()
+        return super(DefaultChildrenMixin, self).get_bulk_children()
 
 
 class StrictDefaultChildrenMixin(DefaultChildrenMixin):
@@ -40,9 +54,8 @@ class StrictDefaultChildrenMixin(DefaultChildrenMixin):
             ('sidebar', Sidebar, (), {}),
         ]
     """
-    def post_create(self, site):
-        for name, cls, args, kwargs in self.default_children:
-            self.add_child(site, cls, *args, **kwargs)
+    def get_default_children(self):
+        return [(cls, kwargs) for name, cls, args, kwargs in self.default_children]
 
     @property
     def children(self):
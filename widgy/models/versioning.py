@@ -1,6 +1,10 @@
 import copy
 
-from django.db import models
+import six
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import IntegrityError, models, transaction
+from django.db.models import Min
 from django.utils import timezone
 from django.utils.functional import cached_property
 from django.utils.encoding import python_2_unicode_compatible
@@ -9,10 +13,56 @@ from django.conf import settings
 from django.template.defaultfilters import date as date_format
 
 from widgy.db.fields import WidgyField
-from widgy.models.base import Node
+from widgy.models.base import Node, delete_trees, overrides_delete
 from widgy.utils import QuerySet, unset_pks
 
 
+class TreeSnapshot(models.Model):
+    """
+    A frozen tree serialized in one row, with the field values of all of
+    its widgets, see :attr:`VersionTracker.snapshot_trees`. Frozen trees
+    never change, so the snapshot never has to be updated.
+    """
+    root_node = models.OneToOneField(Node, primary_key=True, on_delete=models.CASCADE,
+                                     related_name='snapshot')
+    data = models.TextField()
+
+    class Meta:
+        app_label = 'widgy'
+
+    @classmethod
+    def take(cls, root_node):
+        """
+        Returns the snapshot of `root_node`, making it if it doesn't exist.
+        """
+        from widgy.frozen import FrozenNode
+
+        try:
+            return cls.objects.get(root_node=root_node)
+        except cls.DoesNotExist:
+            pass
+        snapshot = cls(root_node=root_node, data=FrozenNode.fetch_tree(root_node).dump())
+        try:
+            with transaction.atomic():
+                snapshot.save(force_insert=True)
+        except IntegrityError:
+            # someone else took it first
+            return cls.objects.get(root_node=root_node)
+        return snapshot
+
+    def load_tree(self):
+        """
+        Returns the :class:`~widgy.frozen.FrozenNode` tree, or None if the
+        snapshot was made by an incompatible version of widgy.
+        """
+        from widgy.frozen import FrozenNode
+
+        try:
+            return FrozenNode.load(self.data)
+        except ValueError:
+            return None
+
+
 @python_2_unicode_compatible
 class VersionCommit(models.Model):
     tracker = models.ForeignKey('VersionTracker', related_name='commits')
@@ -39,13 +89,53 @@ class VersionCommit(models.Model):
         date = date_format(self.created_at, 'DATETIME_FORMAT')
         return '#%s %s%s' % (self.id, date, subject)
 
+    def save(self, *args, **kwargs):
+        super(VersionCommit, self).save(*args, **kwargs)
+        # Any change to a commit (being created, approved, rescheduled) can
+        # change which commit of the tracker is published. It's worked out
+        # now, so that rendering the tracker doesn't have to write it.
+        self.get_tracker().save_published_commit()
+
+    def get_tracker(self):
+        """
+        My tracker, as an instance of the class that decides which of its
+        commits are ready.
+        """
+        return self.tracker
+
 
 class VersionTracker(models.Model):
     commit_model = VersionCommit
 
+    # When True, a commit only clones the widgets that changed since the
+    # last commit (and their ancestors). The nodes of the subtrees that
+    # didn't change point at the contents of the last commit's tree, and a
+    # commit of an unchanged working copy reuses the whole tree. See
+    # Node.clone_tree's share_with. A shared content has a node in each of
+    # those trees, so Content.node only works for it when the content was
+    # fetched through one of them (like the prefetched trees that render).
+    structural_sharing = False
+
+    # When True, a TreeSnapshot of the tree is saved for every commit, and
+    # the published tree is rendered from it with one query, without
+    # fetching the nodes or the widgets (except the widgets whose manager
+    # fetches related objects, see widgy.frozen.fetches_related).
+    snapshot_trees = False
+
     head = models.ForeignKey('VersionCommit', null=True, on_delete=models.PROTECT, unique=True)
     working_copy = models.ForeignKey(Node, on_delete=models.PROTECT, unique=True)
 
+    # A cache of the commit get_published_node returns, valid until
+    # published_commit_expires_at (or forever, if that is null). It's written
+    # when a commit is saved, with a queryset update, see save() and
+    # save_published_commit. Reading it never writes.
+    published_commit = models.ForeignKey('VersionCommit', null=True, blank=True,
+                                         on_delete=models.SET_NULL,
+                                         related_name='+', editable=False)
+    published_commit_expires_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    PUBLISHED_COMMIT_FIELDS = ('published_commit', 'published_commit_expires_at')
+
     class Meta:
         app_label = 'widgy'
 
@@ -77,19 +167,45 @@ class VersionTracker(models.Model):
 
     objects = VersionTrackerQuerySet.as_manager()
 
+    def save(self, *args, **kwargs):
+        # Don't overwrite the published commit with what may be a stale copy
+        # of it.
+        if self.pk and not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in self.PUBLISHED_COMMIT_FIELDS
+            ]
+        return super(VersionTracker, self).save(*args, **kwargs)
+
     def commit(self, user=None, **kwargs):
         self.head = self.commit_model.objects.create(
             parent=self.head,
             author=user,
-            root_node=self.working_copy.clone_tree(),
+            root_node=self.get_commit_root_node(),
             tracker=self,
             **kwargs
         )
+        if self.snapshot_trees:
+            TreeSnapshot.take(self.head.root_node)
 
         self.save()
 
         return self.head
 
+    def get_commit_root_node(self):
+        """
+        The frozen tree for a new commit of the working copy.
+        """
+        if self.structural_sharing and self.head:
+            # self.working_copy may be stale, the tree could have been edited
+            # through other instances. has_changes reads the digest from the
+            # database, and the tree is fetched again to be cloned.
+            if not self.has_changes():
+                return self.head.root_node
+            working_copy = Node.objects.get(pk=self.working_copy_id)
+            return working_copy.clone_tree(share_with=self.head.root_node)
+        return self.working_copy.clone_tree()
+
     def revert_to(self, commit, user=None, **kwargs):
         self.head = self.commit_model.objects.create(
             parent=self.head,
@@ -98,6 +214,8 @@ class VersionTracker(models.Model):
             tracker=self,
             **kwargs
         )
+        if self.snapshot_trees:
+            TreeSnapshot.take(self.head.root_node)
 
         old_working_copy = self.working_copy
         self.working_copy = commit.root_node.clone_tree(freeze=False)
@@ -127,11 +245,157 @@ class VersionTracker(models.Model):
         return commit.is_published
 
     def get_published_node(self, request):
+        """
+        The root node of the newest commit that is ready, see
+        :meth:`get_published_commit`. `request` isn't used here, it's for
+        subclasses that pick the node per request.
+        """
+        commit = self.get_published_commit()
+        return commit and commit.root_node
+
+    def get_published_snapshot(self, request):
+        """
+        The published tree loaded from its :class:`TreeSnapshot`, as a
+        :class:`~widgy.frozen.FrozenNode`. Returns None unless
+        :attr:`snapshot_trees` is enabled, or if :meth:`get_published_node`
+        is overridden, because the snapshot might not be of the node it
+        would return. Missing snapshots are taken, so it can be enabled for
+        existing trackers. The tree is remembered until the published
+        commit changes.
+        """
+        if not self._uses_snapshots():
+            return None
+        try:
+            return self._published_snapshot
+        except AttributeError:
+            pass
+
+        snapshot = None
+        if self._published_commit_is_cached() and not hasattr(self, self._published_commit_cache_name()):
+            # Don't fetch the commit just to know its root node.
+            snapshot = TreeSnapshot.objects.filter(
+                root_node__versioncommit=self.published_commit_id).first()
+        if snapshot is None:
+            commit = self.get_published_commit()
+            if commit is None:
+                return None
+            snapshot = TreeSnapshot.objects.filter(root_node=commit.root_node_id).first()
+            if snapshot is None:
+                snapshot = TreeSnapshot.take(commit.root_node)
+        self._published_snapshot = snapshot.load_tree()
+        return self._published_snapshot
+
+    def _uses_snapshots(self):
+        return self.snapshot_trees and \
+            six.get_unbound_function(type(self).get_published_node) is \
+            six.get_unbound_function(VersionTracker.get_published_node)
+
+    @classmethod
+    def prefetch_snapshots(cls, trackers):
+        """
+        Loads the snapshots of the published trees of all of the `trackers`
+        in one query, for :meth:`get_published_snapshot`. Their histories
+        should be prefetched, see :meth:`prefetch_histories`.
+        """
+        commits = []
+        for tracker in trackers:
+            if tracker._uses_snapshots() and not hasattr(tracker, '_published_snapshot'):
+                commit = tracker.get_published_commit()
+                if commit is not None:
+                    commits.append((tracker, commit))
+        if not commits:
+            return
+        snapshots = TreeSnapshot.objects.in_bulk(set(i.root_node_id for _, i in commits))
+        trees = {}
+        for tracker, commit in commits:
+            if commit.root_node_id in snapshots:
+                if commit.root_node_id not in trees:
+                    trees[commit.root_node_id] = snapshots[commit.root_node_id].load_tree()
+                tracker._published_snapshot = trees[commit.root_node_id]
+
+    def _published_commit_is_cached(self):
+        expires_at = self.published_commit_expires_at
+        return self.published_commit_id and (expires_at is None or timezone.now() < expires_at)
+
+    def _published_commit_cache_name(self):
+        return self._meta.get_field('published_commit').get_cache_name()
+
+    def get_published_commit(self):
+        """
+        The newest commit that is ready. This uses the cached
+        :attr:`published_commit` if it is still valid, otherwise it is looked
+        up with :meth:`refresh_published_commit`. That is only remembered on
+        this instance, the cache in the database is updated the next time a
+        commit is saved.
+        """
+        if self._published_commit_is_cached():
+            cache_name = self._published_commit_cache_name()
+            if not hasattr(self, cache_name):
+                self.published_commit = self.get_commit_queryset().get(pk=self.published_commit_id)
+            return self.published_commit
+        elif getattr(self, '_history_prefetched', False):
+            # Walking the prefetched history doesn't need any queries.
+            return self._find_ready_commit()
+        else:
+            return self.refresh_published_commit()
+
+    def _find_ready_commit(self):
         for commit in self.get_history():
             if self.commit_is_ready(commit):
-                return commit.root_node
+                return commit
         return None
 
+    def get_publishable_commits(self):
+        """
+        My commits that are or will be ready once their publish_at has
+        passed. This must agree with :meth:`commit_is_ready`.
+        """
+        return self.get_commit_queryset().filter(tracker=self)
+
+    def refresh_published_commit(self):
+        """
+        Finds the newest ready commit in a single query and remembers it in
+        :attr:`published_commit`, until the next commit is scheduled to be
+        published. This doesn't write anything, see
+        :meth:`save_published_commit`.
+        """
+        now = timezone.now()
+        commits = self.get_publishable_commits()
+        commit = commits.filter(publish_at__lte=now).order_by('-pk').first()
+        if commit is not None and not self.commit_is_ready(commit):
+            # get_publishable_commits was overridden without agreeing with
+            # commit_is_ready, so we can't trust the query.
+            self.forget_published_commit()
+            return self._find_ready_commit()
+
+        if commit is not None:
+            commits = commits.filter(pk__gt=commit.pk)
+        expires_at = commits.filter(publish_at__gt=now).aggregate(
+            min=Min('publish_at'))['min']
+
+        self.published_commit = commit
+        self.published_commit_expires_at = expires_at
+        self.__dict__.pop('_published_snapshot', None)
+        return commit
+
+    def save_published_commit(self):
+        """
+        Looks up the published commit with :meth:`refresh_published_commit`
+        and saves it, so that :meth:`get_published_node` doesn't have to
+        look it up. This happens whenever a commit is saved.
+        """
+        self.refresh_published_commit()
+        if self.pk:
+            type(self).objects.filter(pk=self.pk).update(
+                published_commit=self.published_commit,
+                published_commit_expires_at=self.published_commit_expires_at,
+            )
+
+    def forget_published_commit(self):
+        self.published_commit = None
+        self.published_commit_expires_at = None
+        self.__dict__.pop('_published_snapshot', None)
+
     def get_history(self):
         """
         An iterator over commits, newest first.
@@ -148,6 +412,14 @@ class VersionTracker(models.Model):
         """
 
         commit_dict = dict((i.id, i) for i in self.commits.select_related('author', 'root_node'))
+        return self._link_history(commit_dict)
+
+    def _link_history(self, commit_dict):
+        """
+        Fills in the parent of every commit in my history from `commit_dict`,
+        so walking it doesn't need any more queries. Returns the commits,
+        newest first.
+        """
         res = []
         commit_id = self.head_id
         while commit_id:
@@ -158,11 +430,47 @@ class VersionTracker(models.Model):
             commit_id = commit.parent_id
         return res
 
+    @classmethod
+    def get_commit_queryset(cls):
+        """
+        The commits used by :meth:`prefetch_histories`. It should select
+        everything :meth:`commit_is_ready` needs.
+        """
+        return VersionCommit.objects.select_related('root_node')
+
+    @classmethod
+    def prefetch_histories(cls, trackers):
+        """
+        Fetches the commits of all of the `trackers` in a single query, so
+        that walking their history (in :meth:`get_published_node`, for
+        example) doesn't do any more queries.
+        """
+        for tracker in trackers:
+            tracker._history_prefetched = True
+        trackers = [i for i in trackers if i.head_id]
+        if not trackers:
+            return
+        commit_dict = dict((i.id, i) for i in cls.get_commit_queryset().filter(
+            tracker__in=trackers))
+        for tracker in trackers:
+            tracker.head = tracker._link_history(commit_dict)[0]
+            if tracker.published_commit_id in commit_dict:
+                tracker.published_commit = commit_dict[tracker.published_commit_id]
+
     def has_changes(self):
         if not self.head:
             return True
+        newest_tree = self.head.root_node
+        if newest_tree.digest:
+            # The working copy can be edited through other instances, so its
+            # digest comes from the database, not from self.working_copy. It
+            # is only empty when a widget was deleted, or moved without
+            # refreshing.
+            working_copy = Node.objects.get(pk=self.working_copy_id)
+            working_digest = working_copy.digest or working_copy.get_digest()
+            return working_digest != newest_tree.digest
         else:
-            newest_tree = self.head.root_node
+            # committed before digests existed
             Node.prefetch_trees(self.working_copy, newest_tree)
             return not self.working_copy.trees_equal(newest_tree)
 
@@ -181,9 +489,17 @@ class VersionTracker(models.Model):
 
         super(VersionTracker, self).delete()
 
+        # The trees are deleted together, except for the root widgets that
+        # do something special in delete.
+        root_nodes = []
         for root_node in trees_to_delete:
             Node.get_tree(root_node).update(is_frozen=False)
-            root_node.content.delete()
+            root_node.is_frozen = False
+            if overrides_delete(ContentType.objects.get_for_id(root_node.content_type_id).model_class()):
+                root_node.content.delete()
+            else:
+                root_nodes.append(root_node)
+        delete_trees(root_nodes)
 
     @classmethod
     def get_owner_related_names(cls):
@@ -211,6 +527,7 @@ class VersionTracker(models.Model):
         commits = list(self._commits_to_clone())
         unset_pks(vt)
         vt.head = None
+        vt.forget_published_commit()
         vt.save()
         for commit in commits:
             commit.tracker = vt
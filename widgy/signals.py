@@ -2,4 +2,6 @@ from django.dispatch import Signal
 
 
 pre_delete_widget = Signal(providing_args=['instance', 'raw'])
+# Sent once per class with all of its instances when a tree is deleted.
+pre_delete_widgets = Signal(providing_args=['instances', 'raw'])
 widgy_pre_index = Signal()
@@ -1,13 +1,25 @@
+from functools import partial
+import re
+
+from django.conf import settings
 from django.conf.urls import url
-from django.core.urlresolvers import reverse
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.urlresolvers import (
+    reverse, get_resolver, get_script_prefix, get_urlconf, NoReverseMatch,
+)
 from django.core.exceptions import PermissionDenied
 from django.contrib.staticfiles import finders
 from django.contrib.auth import get_permission_codename
 from django.utils.functional import cached_property
+from django.utils import six
+from django.utils.translation import get_language
 
 from widgy import registry
 from widgy.views import (
     NodeView,
+    BatchView,
+    PreviewsView,
     ContentView,
     ShelfView,
     NodeEditView,
@@ -25,8 +37,24 @@ from widgy.exceptions import (
     ChildWasRejected,
 )
 
+# Reversed in place of the real arguments to build URL templates. It has to
+# be accepted by the regexes of all the url patterns.
+URL_PLACEHOLDER = 'widgyurlplaceholder'
+
+# Values that reverse() would insert in the URL unchanged.
+URL_SAFE_VALUE_RE = re.compile(r'^[A-Za-z0-9_]+\Z')
+
 
 class WidgySite(object):
+    # The alias (a key of settings.CACHES) of the cache used to store the
+    # rendered output of frozen widgets. None disables the fragment cache.
+    fragment_cache_alias = None
+    fragment_cache_timeout = DEFAULT_TIMEOUT
+
+    # Render frozen trees with widgy.frozen.FrozenNode instead of Node model
+    # instances. Widgets must only use the traversal API of their node.
+    compact_frozen_trees = False
+
     def get_registry(self):
         return registry
 
@@ -36,6 +64,8 @@ class WidgySite(object):
     def get_urls(self):
         urlpatterns = [
             url('^node/$', self.node_view),
+            url('^node/batch/$', self.batch_view),
+            url('^node/previews/$', self.previews_view),
             url('^node/(?P<node_pk>[^/]+)/$', self.node_view),
             url('^node/(?P<node_pk>[^/]+)/available-children-recursive/$', self.shelf_view),
             url('^node/(?P<node_pk>[^/]+)/edit/$', self.node_edit_view),
@@ -69,6 +99,79 @@ class WidgySite(object):
         """
         return reverse(*args, **kwargs)
 
+    @cached_property
+    def _url_templates(self):
+        return {}
+
+    def get_url_template(self, view, names):
+        """
+        Reverses `view` with placeholders for the keyword arguments in
+        `names`. Returns a list that alternates between literal parts of the
+        URL and argument names, along with the regex of the url pattern, or
+        None if the URL can't be templated.
+        """
+        placeholders = dict((name, '%s%d' % (URL_PLACEHOLDER, i))
+                            for i, name in enumerate(names))
+        try:
+            url = self.reverse(view, kwargs=placeholders)
+        except NoReverseMatch:
+            # the url pattern doesn't accept the placeholders
+            return None
+        parts = re.split('(%s[0-9]+)' % URL_PLACEHOLDER, url)
+        by_placeholder = dict((v, k) for k, v in placeholders.items())
+        if sorted(parts[1::2]) != sorted(by_placeholder):
+            # an argument is missing from the URL or appears twice
+            return None
+        parts[1::2] = [by_placeholder[i] for i in parts[1::2]]
+
+        # The values are checked against the pattern, which is only known
+        # when the view has one pattern for these arguments.
+        patterns = [
+            pattern
+            for possibility, pattern, defaults in get_resolver(get_urlconf()).reverse_dict.getlist(view)
+            if not defaults and any(sorted(params) == sorted(names) for _, params in possibility)
+        ]
+        if len(patterns) != 1:
+            return None
+        regex = re.compile('^%s%s' % (re.escape(get_script_prefix()), patterns[0]), re.UNICODE)
+        if not regex.search(url):
+            # self.reverse doesn't use that pattern
+            return None
+        return parts, regex
+
+    def cached_reverse(self, view, kwargs):
+        """
+        Like :meth:`reverse`, but the URL is reversed once per view with
+        placeholders for `kwargs`, and later calls just fill in the template.
+        This gives the same result as :meth:`reverse` because values that
+        would be quoted, or that don't match their argument's regex in the url
+        pattern, are still reversed.
+
+        This is used to serialize trees, where the same few URLs have to be
+        built for every node.
+        """
+        values = dict((k, six.text_type(v)) for k, v in kwargs.items())
+        if not all(URL_SAFE_VALUE_RE.match(v) for v in values.values()):
+            return self.reverse(view, kwargs=kwargs)
+
+        names = tuple(sorted(values))
+        key = (view, names, get_script_prefix(), get_urlconf(), get_language())
+        try:
+            template = self._url_templates[key]
+        except KeyError:
+            template = self._url_templates[key] = self.get_url_template(view, names)
+        if template is None:
+            return self.reverse(view, kwargs=kwargs)
+
+        template, regex = template
+        parts = template[:]
+        parts[1::2] = [values[i] for i in template[1::2]]
+        url = ''.join(parts)
+        match = regex.search(url)
+        if match is None or any(match.group(k) != v for k, v in values.items()):
+            return self.reverse(view, kwargs=kwargs)
+        return url
+
     def authorize_view(self, request, view):
         if not (request.user.is_authenticated() and request.user.is_staff):
             raise PermissionDenied
@@ -97,6 +200,14 @@ class WidgySite(object):
     def node_view(self):
         return NodeView.as_view(site=self)
 
+    @cached_property
+    def batch_view(self):
+        return BatchView.as_view(site=self)
+
+    @cached_property
+    def previews_view(self):
+        return PreviewsView.as_view(site=self)
+
     @cached_property
     def content_view(self):
         return ContentView.as_view(site=self)
@@ -137,11 +248,32 @@ class WidgySite(object):
     def reset_view(self):
         return ResetView.as_view(site=self)
 
+    @cached_property
+    def _compatibility_matrix(self):
+        return {}
+
+    def check_static_rule(self, key, rule):
+        """
+        The result of a static compatibility rule, by the classes in `key`.
+        Every pair of classes is only checked once.
+        """
+        try:
+            return self._compatibility_matrix[key]
+        except KeyError:
+            result = self._compatibility_matrix[key] = bool(rule())
+            return result
+
     def valid_parent_of(self, parent, child_class, child=None):
-        return parent.valid_parent_of(child_class, child)
+        rule = partial(parent.valid_parent_of, child_class, child)
+        if type(parent).has_static_rule('valid_parent_of'):
+            return self.check_static_rule(('valid_parent_of', type(parent), child_class), rule)
+        return rule()
 
     def valid_child_of(self, parent, child_class, child=None):
-        return child_class.valid_child_of(parent, child)
+        rule = partial(child_class.valid_child_of, parent, child)
+        if child_class.has_static_rule('valid_child_of'):
+            return self.check_static_rule(('valid_child_of', type(parent), child_class), rule)
+        return rule()
 
     def validate_relationship(self, parent, child):
         if isinstance(child, type):
@@ -169,6 +301,17 @@ class WidgySite(object):
                 parent=type(parent).__name__,
             ))
 
+    def get_fragment_cache(self):
+        if self.fragment_cache_alias is None:
+            return None
+        return caches[self.fragment_cache_alias]
+
+    def get_fragment_cache_vary(self, context):
+        """
+        Values that every cached fragment depends on.
+        """
+        return (get_language(), getattr(settings, 'SITE_ID', None))
+
     def get_version_tracker_model(self):
         from widgy.models import VersionTracker
         return VersionTracker
@@ -142,6 +142,8 @@ define([ 'underscore', 'widgy.backbone', 'lib/q'
       options.success = function(resp, status, xhr) {
         if ( options.app && resp.compatibility ) {
           options.app.setCompatibility(resp.compatibility);
+        } else if ( options.app && resp.compatibility_delta ) {
+          options.app.patchCompatibility(resp.compatibility_delta);
         }
 
         // Don't pass url onto the success method.  The options are passed all
@@ -160,7 +162,11 @@ define([ 'underscore', 'widgy.backbone', 'lib/q'
         var model_url = _.result(model, 'url'),
             root_url = _.result(options.app.root_node, 'url');
 
+        // Mutations only need the shelf entries of the nodes around the one
+        // that changed.
         options.url =  model_url + '?include_compatibility_for=' + root_url;
+        if ( method !== 'read' )
+          options.url += '&compatibility=delta';
       }
 
       return Backbone.sync.call(this, method, model, options);
@@ -21,6 +21,7 @@ define([ 'jquery', 'underscore', 'widgy.backbone', 'lib/csrf', 'lib/q', 'nodes/n
 
       _.bindAll(this,
         'refreshCompatibility',
+        'patchCompatibility',
         'setCompatibility',
         'validateRelationship',
         'ready'
@@ -103,6 +104,25 @@ define([ 'jquery', 'underscore', 'widgy.backbone', 'lib/csrf', 'lib/q', 'nodes/n
       this.updateCompatibility(data);
     },
 
+    /**
+     * Applies the compatibility_delta of a node response to the
+     * compatibility data we already have.
+     */
+    patchCompatibility: function(delta) {
+      if ( this.inflight || ! this.compatibility_data ) {
+        // The full data hasn't arrived yet and might be older than the
+        // delta.
+        this.refreshCompatibility();
+        return;
+      }
+
+      var data = _.extend({}, this.compatibility_data, delta.changed);
+      _.each(delta.removed, function(url) {
+        delete data[url];
+      });
+      this.setCompatibility(data);
+    },
+
     updateCompatibility: function(data) {
       this.node_view_list.each(function(view) {
         var shelf = view.getShelf();
@@ -10,7 +10,7 @@ register = template.Library()
 
 @register.simple_tag(takes_context=True)
 def render(context, node):
-    return node.render(context)
+    return node.cached_render(context)
 
 
 @register.filter
@@ -5,15 +5,17 @@ for Widgy nodes and Content objects.
 from functools import partial
 
 from django.http import Http404
-from django.core.exceptions import ValidationError, PermissionDenied
+from django.core.exceptions import ValidationError, PermissionDenied, NON_FIELD_ERRORS
 from django.core.urlresolvers import reverse
 from django.shortcuts import get_object_or_404
 from django.contrib.contenttypes.models import ContentType
 from django.views.generic import DetailView
 from django.views.generic.detail import SingleObjectMixin
-from django.db.models import ProtectedError
+from django.db import transaction
+from django.db.models import ProtectedError, Q
 from django.utils.translation import ugettext as _
 from django.apps import apps
+from django.utils import six
 
 from argonauts.views import RestView
 
@@ -60,48 +62,31 @@ class ContentView(WidgyView):
         if not self.site.has_change_permission(request, obj):
             raise PermissionDenied(_("You don't have permission to edit this widget."))
 
-        data = self.data()['attributes']
-        form = obj.get_form(request, data=data)
-        if not form.is_valid():
-            raise ValidationError(form.errors)
-        form.save()
-        return self.render_to_response(form.instance.to_json(self.site),
+        obj = update_content(request, obj, self.data()['attributes'])
+        return self.render_to_response(obj.to_json(self.site),
                                        status=200)
 
 
-class NodeView(WidgyView):
+def update_content(request, obj, attributes):
     """
-    General purpose resource for updating, deleting, and repositioning
-    :class:`widgy.models.Node` objects.
-
-    **Supported Methods**:
-        :post: Create a new :class:`widgy.models.Node` object.  This method
-            requires that ``__class__`` is passed in the JSON request as a
-            parameter.  ``__class__`` is expected to be a ``.`` separated
-            string of ``app_label.model_classname``.
-        :delete: Delete a :class:`widgy.models.Node` object.
-        :put: Make changes to a :class:`widgy.models.Node` object.  This method
-            also supports repositioning a node to the the left of new sibling by
-            supplying a ``right_id`` in the request.
-
+    Validates ``attributes`` with the content's form and saves it.
     """
-    def render_as_node(self, obj, *args, **kwargs):
-        obj = {'node': obj}
-
-        compatibility_node_url = self.request.GET.get('include_compatibility_for', None)
-        if compatibility_node_url:
-            node = get_object_or_404(Node, pk=extract_id(compatibility_node_url))
-            obj['compatibility'] = ShelfView.get_compatibility_data(self.site, self.request, node)
+    form = obj.get_form(request, data=attributes)
+    if not form.is_valid():
+        raise ValidationError(form.errors)
+    form.save()
+    return form.instance
 
-        return self.render_to_response(obj, *args, **kwargs)
 
-    def get(self, request, node_pk):
-        node = get_object_or_404(Node, pk=node_pk)
-        node.prefetch_tree()
-        return self.render_as_node(node.to_json(self.site))
+class NodeOperationsMixin(object):
+    """
+    The tree mutations of the editor. They do their own permission checks,
+    so they can be shared by :class:`NodeView` and :class:`BatchView`.
+    """
+    def get_node(self, node_id):
+        return get_object_or_404(Node, pk=extract_id(node_id))
 
-    def post(self, request, node_pk=None):
-        data = self.data()
+    def add_node(self, request, data):
         app_label, model = data['__class__'].split('.')
         try:
             content_class = apps.get_model(app_label, model)
@@ -109,61 +94,39 @@ class NodeView(WidgyView):
             raise Http404
 
         try:
-            right = get_object_or_404(Node, pk=extract_id(data['right_id']))
+            right = self.get_node(data.get('right_id'))
             parent = right.get_parent()
             create_content = right.content.add_sibling
         except Http404:
-            parent = get_object_or_404(Node, pk=extract_id(data['parent_id']))
+            parent = self.get_node(data.get('parent_id'))
             create_content = parent.content.add_child
 
         if not self.site.has_add_permission(request, parent.content, content_class):
             raise PermissionDenied(_("You don't have permission to add this widget."))
 
-        content = create_content(self.site, content_class)
+        return create_content(self.site, content_class).node
 
-        return self.render_as_node(content.node.to_json(self.site),
-                                   status=201)
-
-    def put(self, request, node_pk):
+    def move_node(self, request, node, data):
         """
         If you put with a right_id, then your node will be placed immediately
         to the right of the node corresponding with the right_id.
 
         If you put with a parent_id, then your node will be placed as the
         first-child of the node corresponding with the parent_id.
-
-        .. todo::
-            put this in the model
         """
-        node = get_object_or_404(Node, pk=node_pk)
-        data = self.data()
-
         if not self.site.has_change_permission(request, node.content):
             raise PermissionDenied(_("You don't have permission to move this widget."))
         if not node.content.draggable:
             raise InvalidTreeMovement({'message': "You can't move me"})
 
         try:
-            right = Node.objects.get(pk=extract_id(data['right_id']))
+            right = self.get_node(data.get('right_id'))
             node.content.reposition(self.site, right=right.content)
-        except Node.DoesNotExist:
-            try:
-                parent = Node.objects.get(pk=extract_id(data['parent_id']))
-                node.content.reposition(self.site, parent=parent.content)
-            except Node.DoesNotExist:
-                raise Http404
-
-        # We have to refetch before returning because treebeard doesn't
-        # update the in-memory instance, only the database, see
-        # <https://tabo.pe/projects/django-treebeard/docs/tip/caveats.html#raw-queries>
-        node = Node.objects.get(pk=node.pk)
-        node.prefetch_tree()
-
-        return self.render_as_node(node.to_json(self.site), status=200)
-
-    def delete(self, request, node_pk):
-        node = get_object_or_404(Node, pk=node_pk)
+        except Http404:
+            parent = self.get_node(data.get('parent_id'))
+            node.content.reposition(self.site, parent=parent.content)
 
+    def delete_node(self, request, node):
         if not self.site.has_delete_permission(request, node.content):
             raise PermissionDenied(_("You don't have permission to delete this widget."))
         if not node.content.deletable:
@@ -171,10 +134,116 @@ class NodeView(WidgyView):
 
         try:
             node.content.delete()
-            return self.render_as_node(None)
         except ProtectedError as e:
             raise ValidationError({'message': e.args[0]})
 
+    def update_node(self, request, node, attributes):
+        if not self.site.has_change_permission(request, node.content):
+            raise PermissionDenied(_("You don't have permission to edit this widget."))
+        update_content(request, node.content, attributes)
+
+
+class NodeView(NodeOperationsMixin, WidgyView):
+    """
+    General purpose resource for updating, deleting, and repositioning
+    :class:`widgy.models.Node` objects.
+
+    **Supported Methods**:
+        :post: Create a new :class:`widgy.models.Node` object.  This method
+            requires that ``__class__`` is passed in the JSON request as a
+            parameter.  ``__class__`` is expected to be a ``.`` separated
+            string of ``app_label.model_classname``.
+        :delete: Delete a :class:`widgy.models.Node` object.
+        :put: Make changes to a :class:`widgy.models.Node` object.  This method
+            also supports repositioning a node to the the left of new sibling by
+            supplying a ``right_id`` in the request.
+
+    """
+    def render_as_node(self, obj, *args, **kwargs):
+        """
+        With ``?include_compatibility_for=<root url>``, the shelf data for the
+        whole tree is included as ``compatibility``. Mutations also accept
+        ``&compatibility=delta``, then only the entries of the nodes whose
+        allowed children could have changed are included, as
+        ``compatibility_delta``. See
+        :meth:`ShelfView.get_compatibility_delta`.
+        """
+        touched_pks = kwargs.pop('touched_pks', None)
+        removed_pks = kwargs.pop('removed_pks', ())
+        obj = {'node': obj}
+
+        compatibility_node_url = self.request.GET.get('include_compatibility_for', None)
+        if compatibility_node_url:
+            node = get_object_or_404(Node, pk=extract_id(compatibility_node_url))
+            if touched_pks is not None and self.request.GET.get('compatibility') == 'delta':
+                obj['compatibility_delta'] = ShelfView.get_compatibility_delta(
+                    self.site, self.request, node, touched_pks, removed_pks)
+            else:
+                obj['compatibility'] = ShelfView.get_compatibility_data(self.site, self.request, node)
+
+        return self.render_to_response(obj, *args, **kwargs)
+
+    def get_family_pks(self, node):
+        """
+        The pks of `node`, its ancestors and its descendants. Those are the
+        nodes whose allowed children can change when `node` is added, moved
+        or deleted.
+        """
+        ancestor_paths = [node.path[:i * Node.steplen] for i in range(1, node.depth)]
+        return set(Node.objects.filter(
+            Q(path__startswith=node.path) | Q(path__in=ancestor_paths)
+        ).values_list('pk', flat=True))
+
+    def get(self, request, node_pk):
+        """
+        Serializes the node's tree. ``?depth=n`` only includes n levels of
+        descendants, GETting a collapsed node with a depth expands it.
+        ``?preview=0`` leaves out the preview templates, which can be fetched
+        later with :class:`PreviewsView`.
+        """
+        node = get_object_or_404(Node, pk=node_pk)
+        depth = request.GET.get('depth')
+        if depth is None:
+            node.prefetch_tree()
+        else:
+            depth = int(depth)
+            if depth < 0:
+                raise ValueError("depth must not be negative.")
+            node.prefetch_partial_tree(depth)
+        preview = request.GET.get('preview') != '0'
+        return self.render_as_node(node.to_json(self.site, depth=depth, preview=preview))
+
+    def post(self, request, node_pk=None):
+        node = self.add_node(request, self.data())
+        return self.render_as_node(node.to_json(self.site), status=201,
+                                   touched_pks=self.get_family_pks(node))
+
+    def put(self, request, node_pk):
+        """
+        Repositions the node, see :meth:`NodeOperationsMixin.move_node`.
+        """
+        node = get_object_or_404(Node, pk=node_pk)
+        touched_pks = self.get_family_pks(node)
+        self.move_node(request, node, self.data())
+
+        # We have to refetch before returning because treebeard doesn't
+        # update the in-memory instance, only the database, see
+        # <https://tabo.pe/projects/django-treebeard/docs/tip/caveats.html#raw-queries>
+        node = Node.objects.get(pk=node.pk)
+        touched_pks |= self.get_family_pks(node)
+        node.prefetch_tree()
+
+        return self.render_as_node(node.to_json(self.site), status=200,
+                                   touched_pks=touched_pks)
+
+    def delete(self, request, node_pk):
+        node = get_object_or_404(Node, pk=node_pk)
+        touched_pks = self.get_family_pks(node)
+        removed_pks = set(node.get_descendants().values_list('pk', flat=True)) | set([node.pk])
+        self.delete_node(request, node)
+        return self.render_as_node(None, touched_pks=touched_pks - removed_pks,
+                                   removed_pks=removed_pks)
+
     def options(self, request, node_pk=None):
         response = super(NodeView, self).options(request, node_pk)
 
@@ -184,6 +253,174 @@ class NodeView(WidgyView):
         return response
 
 
+class BatchView(NodeOperationsMixin, WidgyView):
+    """
+    Applies a list of operations to one tree in a single transaction and
+    returns the resulting tree once, instead of one request (and one
+    serialized tree) per operation. The request looks like::
+
+        {
+            "operations": [
+                {"op": "add", "__class__": "app_label.model", "parent_id": url},
+                {"op": "add", "__class__": "app_label.model", "right_id": "$0"},
+                {"op": "move", "node": url, "right_id": url},
+                {"op": "update", "node": "$1", "attributes": {...}},
+                {"op": "delete", "node": url}
+            ]
+        }
+
+    Wherever a node url is expected, ``"$n"`` refers to the node added (or
+    moved or updated) by the nth operation. ``add`` and ``move`` take a
+    ``right_id`` or a ``parent_id`` just like :class:`NodeView`.
+
+    The operations are validated one at a time, as they are applied, because
+    whether one is allowed depends on the tree the previous ones left. If
+    any operation fails, none of them are applied and the error is returned
+    along with the ``index`` (a number) of the operation that failed,
+    whatever the kind of error.
+    Otherwise the response contains the whole tree as ``node``, and the
+    urls of the nodes touched by each operation as ``results``.
+    """
+    http_method_names = ['post', 'options']
+
+    # The keys each kind of operation needs, besides ``op``.
+    operation_keys = {
+        'add': ['__class__'],
+        'move': ['node'],
+        'update': ['node'],
+        'delete': ['node'],
+    }
+
+    def get_node(self, node_id):
+        if isinstance(node_id, six.string_types) and node_id.startswith('$'):
+            try:
+                node_pk = self.results[int(node_id[1:])]
+            except (ValueError, IndexError):
+                raise ValueError("Invalid reference %r." % node_id)
+            if node_pk is None:
+                raise ValueError("Operation %s didn't return a node." % node_id[1:])
+            # always refetch, the operations change the tree behind the back
+            # of any instance we've already got.
+            return get_object_or_404(Node, pk=node_pk)
+        return super(BatchView, self).get_node(node_id)
+
+    def check_operation(self, operation):
+        if not isinstance(operation, dict):
+            raise ValueError("Each operation must be an object.")
+        op = operation.get('op')
+        try:
+            keys = self.operation_keys[op]
+        except (KeyError, TypeError):
+            raise ValueError("Unknown operation %r." % op)
+        for key in keys:
+            if not isinstance(operation.get(key), six.string_types):
+                raise ValueError("%s needs a %s." % (op, key))
+        if op == 'add' and operation['__class__'].count('.') != 1:
+            raise ValueError("__class__ must look like app_label.model.")
+
+    def apply_operation(self, request, operation):
+        self.check_operation(operation)
+        op = operation['op']
+        if op == 'add':
+            return self.add_node(request, operation)
+
+        node = self.get_node(operation['node'])
+        self.check_root(node)
+        if op == 'move':
+            self.move_node(request, node, operation)
+        elif op == 'update':
+            self.update_node(request, node, operation.get('attributes', {}))
+        elif op == 'delete':
+            self.delete_node(request, node)
+            return None
+        return node
+
+    def check_root(self, node):
+        """
+        All the operations of a batch must happen in the same tree.
+        """
+        root_path = node.path[:Node.steplen]
+        if self.root_path is None:
+            self.root_path = root_path
+        elif self.root_path != root_path:
+            raise InvalidTreeMovement({'message': "All the operations must be in the same tree."})
+
+    def render_error(self, e, index):
+        """
+        The response RestView.dispatch would give for `e`, shaped like a
+        ValidationError's, with the index of the operation that raised it.
+        """
+        if isinstance(e, ValidationError):
+            status = 409
+            if hasattr(e, 'error_dict'):
+                data = e.message_dict
+            else:
+                data = {NON_FIELD_ERRORS: e.messages}
+        else:
+            if isinstance(e, Http404):
+                status = 404
+            elif isinstance(e, PermissionDenied):
+                status = 403
+            else:
+                status = 400
+            data = {'message': [six.text_type(e)]}
+        data['index'] = [index]
+        return self.render_to_response(data, status=status)
+
+    def post(self, request):
+        operations = self.data().get('operations')
+        if not isinstance(operations, list):
+            raise ValueError("operations must be a list.")
+
+        self.results = []
+        self.root_path = None
+        index = None
+        try:
+            with transaction.atomic():
+                for index, operation in enumerate(operations):
+                    node = self.apply_operation(request, operation)
+                    if node is not None:
+                        self.check_root(node)
+                    self.results.append(node and node.pk)
+        except (ValidationError, Http404, PermissionDenied, ValueError) as e:
+            return self.render_error(e, index)
+
+        if self.root_path is None:
+            return self.render_to_response({'node': None, 'results': []})
+
+        try:
+            root = Node.objects.get(path=self.root_path)
+        except Node.DoesNotExist:
+            # the root itself was deleted
+            return self.render_to_response({'node': None, 'results': [None] * len(self.results)})
+        root.prefetch_tree()
+        urls = dict((node.pk, node.get_api_url(self.site)) for node in root.depth_first_order())
+        return self.render_to_response({
+            'node': root.to_json(self.site),
+            'results': [urls.get(pk) for pk in self.results],
+        })
+
+
+class PreviewsView(WidgyView):
+    """
+    Renders the preview templates of many nodes at once, for editors that
+    fetched the tree with ``?preview=0``. Takes the node urls as ``node``
+    query parameters and returns a mapping of node url to preview template.
+    """
+    http_method_names = ['get', 'options']
+
+    def get(self, request):
+        node_pks = [extract_id(i) for i in request.GET.getlist('node')]
+        nodes = list(Node.objects.filter(pk__in=node_pks))
+        if len(nodes) != len(set(node_pks)):
+            raise Http404
+        Node.attach_content_instances(nodes)
+        return self.render_to_response(dict(
+            (node.get_api_url(self.site), node.content.get_preview_template(self.site))
+            for node in nodes
+        ))
+
+
 class ShelfView(WidgyView):
     """
     For a given node, returns a mapping of node urls to lists of content
@@ -208,16 +445,45 @@ class ShelfView(WidgyView):
             res[node.get_api_url(site)] = [i.class_to_json(site) for i in classes]
         return res
 
+    @staticmethod
+    def get_shelf_classes(site, request, root_node):
+        """
+        The content classes that the user could add somewhere in the tree.
+        """
+        parent = root_node.content
+        return [c for c in site.get_all_content_classes()
+                if site.has_add_permission(request, parent, c)]
+
     @staticmethod
     def get_compatibility_data(site, request, root_node):
         root_node.maybe_prefetch_tree()
-        parent = root_node.content
-        content_classes = site.get_all_content_classes()
-        content_classes = [c for c in content_classes
-                           if site.has_add_permission(request, parent, c)]
+        content_classes = ShelfView.get_shelf_classes(site, request, root_node)
         content_classes = root_node.filter_child_classes_recursive(site, content_classes)
         return ShelfView.serialize_content_classes(site, content_classes)
 
+    @staticmethod
+    def get_compatibility_delta(site, request, root_node, touched_pks, removed_pks=()):
+        """
+        Like :meth:`get_compatibility_data`, but only for the nodes in
+        `touched_pks` that are in `root_node`'s tree. The urls of the nodes
+        in `removed_pks` are listed so they can be removed from the shelf
+        data::
+
+            {
+                'changed': {node_url: [content classes], ...},
+                'removed': [node_url, ...],
+            }
+        """
+        nodes = list(Node.objects.filter(pk__in=touched_pks, path__startswith=root_node.path))
+        Node.attach_content_instances(nodes)
+        content_classes = ShelfView.get_shelf_classes(site, request, root_node)
+        changed = dict((node, node.filter_child_classes(site, content_classes))
+                       for node in nodes)
+        return {
+            'changed': ShelfView.serialize_content_classes(site, changed),
+            'removed': [Node(pk=pk).get_api_url(site) for pk in removed_pks],
+        }
+
     def get(self, request, node_pk):
         node = get_object_or_404(Node, pk=node_pk)
         return self.render_to_response(self.get_compatibility_data(self.site, request, node))
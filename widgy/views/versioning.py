@@ -17,9 +17,12 @@ from django.utils.encoding import force_text
 from django.core.exceptions import PermissionDenied
 from django.core import urlresolvers
 from django.http import Http404
+from django.db.models import Q
 
 from bs4 import BeautifulSoup
 
+from widgy.diff import diff_trees
+from widgy.models import Node
 from widgy.views.base import AuthorizedMixin
 from widgy.utils import build_url
 
@@ -83,11 +86,9 @@ class VersionTrackerMixin(SingleObjectMixin):
                         yield link
 
     def get_diff_urls(self, before_node, after_node):
-        if DIFF_ENABLED:
-            for a, b in zip(self.get_preview_urls(before_node), self.get_preview_urls(after_node)):
-                yield build_url(self.site.reverse(self.site.diff_view),
-                                before=a['url'],
-                                after=b['url'])
+        yield build_url(self.site.reverse(self.site.diff_view),
+                        before=before_node.pk,
+                        after=after_node.pk)
 
 
 class PopupView(object):
@@ -114,8 +115,8 @@ class CommitView(PopupView, AuthorizedMixin, VersionTrackerMixin, FormView):
             kwargs['permission_error_message'] = self.permission_error_message
 
         if self.object.head:
-            kwargs['diff_urls'] = self.get_diff_urls(self.object.working_copy,
-                                                     self.object.head.root_node)
+            kwargs['diff_urls'] = self.get_diff_urls(self.object.head.root_node,
+                                                     self.object.working_copy)
 
         # lazy because the template doesn't always use it
         kwargs['changed_anything'] = lambda: self.object.has_changes()
@@ -186,7 +187,7 @@ class HistoryView(AuthorizedMixin, VersionTrackerMixin, DetailView):
         kwargs['commits'] = self.object.get_history_list()
         for commit in kwargs['commits']:
             if commit.parent_id:
-                commit.diff_urls = self.get_diff_urls(commit.root_node, commit.parent.root_node)
+                commit.diff_urls = self.get_diff_urls(commit.parent.root_node, commit.root_node)
         return kwargs
 
 
@@ -259,27 +260,62 @@ class RevertView(PopupView, AuthorizedMixin, VersionTrackerMixin, FormView):
 
 
 class DiffView(AuthorizedMixin, TemplateView):
-    template_name = 'widgy/diff.html'
+    """
+    Shows the changes between the trees of two nodes, given by their pks in
+    the `before` and `after` query parameters. Each has to be the working
+    copy or the tree of a commit of a version tracker the user has
+    permission to commit to, or it's a 404.
+
+    Links to the old diff view had the URLs of two preview pages instead.
+    Those are still diffed with daisydiff if DAISYDIFF_JAR_PATH is set.
+    """
+    template_name = 'widgy/tree_diff.html'
+    daisydiff_template_name = 'widgy/diff.html'
 
     def call_view_from_url(self, url):
         view, args, kwargs = urlresolvers.resolve(url)
         return view(self.request, *args, **kwargs).rendered_content
 
+    def get_template_names(self):
+        if self.is_daisydiff:
+            return [self.daisydiff_template_name]
+        return super(DiffView, self).get_template_names()
+
     def get_context_data(self, **kwargs):
         kwargs = super(DiffView, self).get_context_data(**kwargs)
         try:
-            before_url = self.request.GET['before']
-            after_url = self.request.GET['after']
+            before = self.request.GET['before']
+            after = self.request.GET['after']
         except KeyError:
             raise Http404
 
-        before = self.call_view_from_url(before_url)
-        after = self.call_view_from_url(after_url)
-
-        kwargs['diff'] = daisydiff(before, after)
+        self.is_daisydiff = not (before.isdigit() and after.isdigit())
+        if self.is_daisydiff:
+            if not DIFF_ENABLED:
+                raise Http404
+            before = self.call_view_from_url(before)
+            after = self.call_view_from_url(after)
+            kwargs['diff'] = daisydiff(before, after)
+        else:
+            kwargs['diff'] = diff_trees(self.get_node(before), self.get_node(after))
 
         return kwargs
 
+    def get_node(self, pk):
+        node = get_object_or_404(Node, pk=pk)
+        # a tree can be in more than one tracker (trackers can be cloned),
+        # any of them will do.
+        trackers = self.site.get_version_tracker_model().objects.filter(
+            Q(working_copy=node) | Q(commits__root_node=node)
+        ).distinct()
+        if not any(self.has_permission(tracker) for tracker in trackers):
+            raise Http404
+        return node
+
+    def has_permission(self, tracker):
+        # the same as CommitView's
+        return self.site.has_add_permission(self.request, tracker, tracker.commit_model)
+
 
 def daisydiff(before, after):
     """